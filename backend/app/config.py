@@ -1,5 +1,7 @@
+from pydantic import Field
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Literal
 
 
 class Settings(BaseSettings):
@@ -9,6 +11,65 @@ class Settings(BaseSettings):
     BACKEND_HOST: str = "0.0.0.0"
     BACKEND_PORT: int = 8000
 
+    # Buy-fee engine: "numpy" pulls both series and matches in Python,
+    # "sql" does the nearest-minute lookup inside Postgres.
+    FEE_ENGINE: Literal["numpy", "sql"] = "numpy"
+    # Candlestick engine: "numpy" reduces columnar-fetched rows in Python,
+    # "sql" uses a FIRST_VALUE/LAST_VALUE window in Postgres.
+    CANDLE_ENGINE: Literal["numpy", "sql"] = "numpy"
+
+    # Local, writable directory for derived data (the fee ledger, caches).
+    # Relative paths resolve against the backend's working directory.
+    DATA_DIR: str = "data"
+    # Serve the buy fee from persisted per-day partials instead of recomputing
+    # the whole range on every request.
+    FEE_LEDGER_ENABLED: bool = True
+    # Mirror the fee price series into memory-mapped files shared by all
+    # workers, fetching only the rows added since the last request.
+    PRICE_STORE_ENABLED: bool = True
+
+    # Time zone of the calendar used when a series asks for a `granularity`
+    # (created_at is stored as UTC).
+    ANALYTICS_TIMEZONE: str = "Asia/Tehran"
+
+    # Response cache (per worker): closed date ranges are final and kept long,
+    # ranges that include today only briefly.
+    CACHE_ENABLED: bool = True
+    CACHE_MAX_ENTRIES: int = 2048
+    CACHE_TTL_OPEN_SECONDS: int = 60
+    CACHE_TTL_CLOSED_SECONDS: int = 86400
+    # Let concurrent identical requests share one in-flight query.
+    SINGLE_FLIGHT_ENABLED: bool = True
+
+    # Widgets of one /api/batch request that may query at the same time.
+    BATCH_MAX_CONCURRENCY: int = 4
+
+    # Independent queries of one request may run on separate pooled
+    # connections (at most this many at once) while the pool has idle ones.
+    QUERY_FANOUT_ENABLED: bool = True
+    QUERY_FANOUT_MAX_CONCURRENCY: int = 4
+
+    # Minimum seconds between two checks of one token's refunds for rows
+    # paid or edited since the last check (closed-day rollups, sketches,
+    # leaderboard, wallet indexes).
+    CHANGE_POLL_SECONDS: int = 30
+
+    # How long a pending-users filter set reuses its row count across pages.
+    PENDING_TOTAL_TTL_SECONDS: int = 60
+
+    # Relative accuracy of the per-day quantile sketches behind the
+    # median/p90/p99 KPI cards.
+    QUANTILE_SKETCH_ACCURACY: float = 0.01
+
+    # Wallet → display-name cache: identity data rarely changes.
+    IDENTITY_CACHE_MAX_ENTRIES: int = 50000
+    IDENTITY_CACHE_TTL_SECONDS: int = 3600
+
+    # HyperLogLog precision for approximate distinct counts: 2**p one-byte
+    # registers per day sketch, relative error 1.04 / sqrt(2**p). At least 12,
+    # so the 64-bit hash tails convert to float exactly (hll.register_updates).
+    HLL_PRECISION: int = Field(12, ge=12, le=18)
+
     class Config:
         env_file = "../.env"
         env_file_encoding = "utf-8"
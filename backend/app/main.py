@@ -5,7 +5,7 @@ from contextlib import asynccontextmanager
 from sqlalchemy import text
 from app.database import engine, AsyncSessionLocal
 from app.logger import setup_logger
-from app.routers import buys, refunds, users
+from app.routers import batch, buys, cache, refunds, users
 
 
 @asynccontextmanager
@@ -38,6 +38,8 @@ app.add_middleware(
 app.include_router(buys.router, prefix="/api/buys", tags=["buys"])
 app.include_router(refunds.router, prefix="/api/refunds", tags=["refunds"])
 app.include_router(users.router, prefix="/api/users", tags=["users"])
+app.include_router(batch.router, prefix="/api/batch", tags=["batch"])
+app.include_router(cache.router, prefix="/api/cache", tags=["cache"])
 
 
 @app.get("/")
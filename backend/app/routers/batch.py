@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+from app.services import batch_service
+from app.services.token_utils import resolve_token
+from app.schemas.analytics import BatchRequest, BatchResponse
+
+router = APIRouter()
+
+
+@router.get("/widgets")
+async def get_batch_widgets():
+    return {"widgets": list(batch_service.WIDGETS)}
+
+
+@router.post("", response_model=BatchResponse)
+async def run_batch(request: BatchRequest):
+    return await batch_service.run_batch(
+        request.widgets, request.start_date, request.end_date, resolve_token(request.token)
+    )
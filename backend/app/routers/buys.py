@@ -1,14 +1,33 @@
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 from app.database import get_session
 from app.services import buys_service
+from app.services.bucketing import Granularity
+from app.services.candles import Interval
+from app.services.downsample import downsample_series
+from app.services.histogram import Strategy, parse_edges
 from app.services.token_utils import DEFAULT_TOKEN, SUPPORTED_TOKENS, resolve_token
-from app.schemas.analytics import KPIResponse, SeriesResponse, DistributionResponse
+from app.schemas.analytics import KPIResponse, SeriesResponse, DistributionResponse, CandlestickResponse
 
 router = APIRouter()
 
 
+class _KpiStreamResponse(StreamingResponse):
+    """Streams a `KpiStream` and closes it however the response ends — even unsent."""
+
+    def __init__(self, stream: buys_service.KpiStream):
+        super().__init__(stream.lines(), media_type="application/x-ndjson")
+        self.stream = stream
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.stream.aclose()
+
+
 @router.get("/tokens")
 async def get_supported_tokens():
     return {"tokens": list(SUPPORTED_TOKENS), "default": DEFAULT_TOKEN}
@@ -19,9 +38,21 @@ async def get_buys_kpis(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    quantiles: bool = Query(False),
     session: AsyncSession = Depends(get_session),
 ):
-    return await buys_service.get_kpis(session, start_date, end_date, resolve_token(token))
+    return await buys_service.get_kpis(session, start_date, end_date, resolve_token(token), quantiles)
+
+
+@router.get("/kpis/stream")
+async def stream_buys_kpis(
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    token: Optional[str] = Query(None),
+    quantiles: bool = Query(False),
+):
+    stream = await buys_service.open_kpi_stream(start_date, end_date, resolve_token(token), quantiles)
+    return _KpiStreamResponse(stream)
 
 
 @router.get("/total-fee")
@@ -39,9 +70,12 @@ async def get_daily_purchase_count(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    granularity: Optional[Granularity] = Query(None),
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
     session: AsyncSession = Depends(get_session),
 ):
-    return await buys_service.get_daily_count(session, start_date, end_date, resolve_token(token))
+    data = await buys_service.get_daily_count(session, start_date, end_date, resolve_token(token), granularity)
+    return downsample_series(data, max_points)
 
 
 @router.get("/daily-volume", response_model=SeriesResponse)
@@ -49,9 +83,12 @@ async def get_daily_purchase_volume(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    granularity: Optional[Granularity] = Query(None),
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
     session: AsyncSession = Depends(get_session),
 ):
-    return await buys_service.get_daily_volume(session, start_date, end_date, resolve_token(token))
+    data = await buys_service.get_daily_volume(session, start_date, end_date, resolve_token(token), granularity)
+    return downsample_series(data, max_points)
 
 
 @router.get("/monthly-trend", response_model=SeriesResponse)
@@ -59,9 +96,12 @@ async def get_monthly_purchase_trend(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    granularity: Optional[Granularity] = Query(None),
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
     session: AsyncSession = Depends(get_session),
 ):
-    return await buys_service.get_monthly_trend(session, start_date, end_date, resolve_token(token))
+    data = await buys_service.get_monthly_trend(session, start_date, end_date, resolve_token(token), granularity)
+    return downsample_series(data, max_points)
 
 
 @router.get("/exchange-rate-trend", response_model=SeriesResponse)
@@ -69,9 +109,23 @@ async def get_exchange_rate_trend(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    granularity: Optional[Granularity] = Query(None),
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
+    session: AsyncSession = Depends(get_session),
+):
+    data = await buys_service.get_exchange_rate_trend(session, start_date, end_date, resolve_token(token), granularity)
+    return downsample_series(data, max_points)
+
+
+@router.get("/rate-candlestick", response_model=CandlestickResponse)
+async def get_rate_candlestick(
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    token: Optional[str] = Query(None),
+    interval: Interval = Query("1d"),
     session: AsyncSession = Depends(get_session),
 ):
-    return await buys_service.get_exchange_rate_trend(session, start_date, end_date, resolve_token(token))
+    return await buys_service.get_rate_candlestick(session, start_date, end_date, resolve_token(token), interval)
 
 
 @router.get("/by-gateway", response_model=DistributionResponse)
@@ -109,6 +163,11 @@ async def get_amount_distribution(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    strategy: Strategy = Query("edges"),
+    edges: Optional[str] = Query(None, description="Comma-separated bucket upper bounds, e.g. 10,100,1000"),
+    bins: int = Query(5, ge=2, le=50),
     session: AsyncSession = Depends(get_session),
 ):
-    return await buys_service.get_amount_distribution(session, start_date, end_date, resolve_token(token))
+    return await buys_service.get_amount_distribution(
+        session, start_date, end_date, resolve_token(token), strategy, parse_edges(edges), bins
+    )
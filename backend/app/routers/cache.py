@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Query
+from typing import Optional
+from app.services import response_cache
+from app.services.identity_names import name_cache
+from app.services.single_flight import flights
+from app.services.token_utils import resolve_token
+import os
+
+router = APIRouter()
+
+
+# Caches and counters live in each worker process: both responses name the
+# worker (pid) that served them.
+@router.get("/stats")
+async def get_cache_stats():
+    return {
+        "worker_pid": os.getpid(),
+        "response_cache": response_cache.response_cache.stats(),
+        "single_flight": flights.stats(),
+        "identity_names": name_cache.stats(),
+    }
+
+
+@router.delete("")
+async def invalidate_cache(
+    endpoint: Optional[str] = Query(None, description='Endpoint prefix, e.g. "buys." or "buys.kpis"'),
+    token: Optional[str] = Query(None),
+):
+    dropped = response_cache.invalidate(endpoint, resolve_token(token) if token else None)
+    # Every worker drops its matching entries; the count is this worker's.
+    return {"invalidated": dropped, "worker_pid": os.getpid()}
@@ -3,6 +3,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 from app.database import get_session
 from app.services import refunds_service
+from app.services.bucketing import Granularity
+from app.services.candles import Interval
+from app.services.downsample import downsample_series
+from app.services.histogram import Strategy, parse_edges
 from app.services.token_utils import DEFAULT_TOKEN, SUPPORTED_TOKENS, resolve_token
 from app.schemas.analytics import KPIResponse, SeriesResponse, DistributionResponse, CandlestickResponse
 
@@ -19,9 +23,10 @@ async def get_refunds_kpis(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    quantiles: bool = Query(False),
     session: AsyncSession = Depends(get_session),
 ):
-    return await refunds_service.get_kpis(session, start_date, end_date, resolve_token(token))
+    return await refunds_service.get_kpis(session, start_date, end_date, resolve_token(token), quantiles)
 
 
 @router.get("/daily-count", response_model=SeriesResponse)
@@ -29,9 +34,12 @@ async def get_daily_refund_count(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    granularity: Optional[Granularity] = Query(None),
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
     session: AsyncSession = Depends(get_session),
 ):
-    return await refunds_service.get_daily_count(session, start_date, end_date, resolve_token(token))
+    data = await refunds_service.get_daily_count(session, start_date, end_date, resolve_token(token), granularity)
+    return downsample_series(data, max_points)
 
 
 @router.get("/monthly-trend", response_model=SeriesResponse)
@@ -39,9 +47,12 @@ async def get_monthly_refund_trend(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    granularity: Optional[Granularity] = Query(None),
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
     session: AsyncSession = Depends(get_session),
 ):
-    return await refunds_service.get_monthly_trend(session, start_date, end_date, resolve_token(token))
+    data = await refunds_service.get_monthly_trend(session, start_date, end_date, resolve_token(token), granularity)
+    return downsample_series(data, max_points)
 
 
 @router.get("/rate-trend", response_model=SeriesResponse)
@@ -49,9 +60,12 @@ async def get_refund_rate_trend(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    granularity: Optional[Granularity] = Query(None),
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
     session: AsyncSession = Depends(get_session),
 ):
-    return await refunds_service.get_rate_trend(session, start_date, end_date, resolve_token(token))
+    data = await refunds_service.get_rate_trend(session, start_date, end_date, resolve_token(token), granularity)
+    return downsample_series(data, max_points)
 
 
 @router.get("/rate-candlestick", response_model=CandlestickResponse)
@@ -59,9 +73,10 @@ async def get_rate_candlestick(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    interval: Interval = Query("1d"),
     session: AsyncSession = Depends(get_session),
 ):
-    return await refunds_service.get_rate_candlestick(session, start_date, end_date, resolve_token(token))
+    return await refunds_service.get_rate_candlestick(session, start_date, end_date, resolve_token(token), interval)
 
 
 @router.get("/status-distribution", response_model=DistributionResponse)
@@ -89,6 +104,11 @@ async def get_amount_distribution(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    strategy: Strategy = Query("edges"),
+    edges: Optional[str] = Query(None, description="Comma-separated bucket upper bounds, e.g. 10,100,1000"),
+    bins: int = Query(5, ge=2, le=50),
     session: AsyncSession = Depends(get_session),
 ):
-    return await refunds_service.get_amount_distribution(session, start_date, end_date, resolve_token(token))
+    return await refunds_service.get_amount_distribution(
+        session, start_date, end_date, resolve_token(token), strategy, parse_edges(edges), bins
+    )
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional
+from typing import Literal, Optional
 from app.database import get_session
 from app.services import users_service
+from app.services.downsample import downsample_series
+from app.services.histogram import Strategy, parse_edges
 from app.services.token_utils import DEFAULT_TOKEN, SUPPORTED_TOKENS, resolve_token
-from app.schemas.analytics import KPIResponse, SeriesResponse, DistributionResponse, TopUsersResponse, BuySellComparisonResponse, PendingUsersResponse
+from app.schemas.analytics import KPIResponse, SeriesResponse, DistributionResponse, TopUsersResponse, BuySellComparisonResponse, PendingUsersResponse, RetentionResponse
 
 router = APIRouter()
 
@@ -19,9 +22,10 @@ async def get_users_kpis(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    approx: bool = Query(False),
     session: AsyncSession = Depends(get_session),
 ):
-    return await users_service.get_kpis(session, start_date, end_date, resolve_token(token))
+    return await users_service.get_kpis(session, start_date, end_date, resolve_token(token), approx)
 
 
 @router.get("/new-per-month", response_model=SeriesResponse)
@@ -29,9 +33,24 @@ async def get_new_users_per_month(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    side: Literal["buy", "sell"] = Query("buy"),
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
     session: AsyncSession = Depends(get_session),
 ):
-    return await users_service.get_new_per_month(session, start_date, end_date, resolve_token(token))
+    data = await users_service.get_new_per_month(session, start_date, end_date, resolve_token(token), side)
+    return downsample_series(data, max_points)
+
+
+@router.get("/retention", response_model=RetentionResponse)
+async def get_retention(
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    token: Optional[str] = Query(None),
+    side: Literal["buy", "sell"] = Query("buy"),
+    max_months: int = Query(12, ge=1, le=60),
+    session: AsyncSession = Depends(get_session),
+):
+    return await users_service.get_retention(session, start_date, end_date, resolve_token(token), side, max_months)
 
 
 @router.get("/top-buyers", response_model=TopUsersResponse)
@@ -39,9 +58,10 @@ async def get_top_buyers(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    limit: int = Query(10, ge=1, le=500),
     session: AsyncSession = Depends(get_session),
 ):
-    return await users_service.get_top_buyers(session, start_date, end_date, resolve_token(token))
+    return await users_service.get_top_buyers(session, start_date, end_date, resolve_token(token), limit)
 
 
 @router.get("/top-sellers", response_model=TopUsersResponse)
@@ -49,9 +69,10 @@ async def get_top_sellers(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    limit: int = Query(10, ge=1, le=500),
     session: AsyncSession = Depends(get_session),
 ):
-    return await users_service.get_top_sellers(session, start_date, end_date, resolve_token(token))
+    return await users_service.get_top_sellers(session, start_date, end_date, resolve_token(token), limit)
 
 
 @router.get("/activity-distribution", response_model=DistributionResponse)
@@ -59,9 +80,14 @@ async def get_activity_distribution(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    strategy: Strategy = Query("edges"),
+    edges: Optional[str] = Query(None, description="Comma-separated bucket upper bounds, e.g. 10,100,1000"),
+    bins: int = Query(5, ge=2, le=50),
     session: AsyncSession = Depends(get_session),
 ):
-    return await users_service.get_activity_distribution(session, start_date, end_date, resolve_token(token))
+    return await users_service.get_activity_distribution(
+        session, start_date, end_date, resolve_token(token), strategy, parse_edges(edges), bins
+    )
 
 
 @router.get("/monthly-active", response_model=SeriesResponse)
@@ -69,9 +95,12 @@ async def get_monthly_active_users(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
+    approx: bool = Query(False),
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
     session: AsyncSession = Depends(get_session),
 ):
-    return await users_service.get_monthly_active(session, start_date, end_date, resolve_token(token))
+    data = await users_service.get_monthly_active(session, start_date, end_date, resolve_token(token), approx)
+    return downsample_series(data, max_points)
 
 
 @router.get("/buy-sell-comparison", response_model=BuySellComparisonResponse)
@@ -88,6 +117,7 @@ async def get_buy_sell_comparison(
 async def get_pending_users(
     page: int = Query(1, ge=1),
     page_size: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
     token: Optional[str] = Query(None),
     public: Optional[str] = Query(None),
     national_id: Optional[str] = Query(None),
@@ -111,11 +141,12 @@ async def get_pending_users(
     ]:
         if val:
             filters[key] = val
-    return await users_service.get_pending_users(session, page, page_size, filters or None)
+    return await users_service.get_pending_users(session, page, page_size, filters or None, cursor)
 
 
 @router.get("/pending-users/export")
 async def export_pending_users(
+    format: Literal["json", "csv", "ndjson"] = Query("json"),
     token: Optional[str] = Query(None),
     public: Optional[str] = Query(None),
     national_id: Optional[str] = Query(None),
@@ -139,5 +170,16 @@ async def export_pending_users(
     ]:
         if val:
             filters[key] = val
+    if format == "csv":
+        return StreamingResponse(
+            users_service.stream_pending_users_export(filters or None, "csv"),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="pending-users.csv"'},
+        )
+    if format == "ndjson":
+        return StreamingResponse(
+            users_service.stream_pending_users_export(filters or None, "ndjson"),
+            media_type="application/x-ndjson",
+        )
     data = await users_service.get_pending_users_export(session, filters or None)
     return {"data": data}
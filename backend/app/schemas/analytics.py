@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional
 from datetime import datetime
 
 
@@ -11,6 +11,9 @@ class KPIItem(BaseModel):
     value: Optional[float | int] = None
     format: Literal["number", "rial", "percent", "decimal"]
     lazy: Optional[bool] = None
+    # Set on estimated values (approx mode): the relative standard error.
+    approximate: Optional[bool] = None
+    error_bound: Optional[float] = None
 
 
 class KPIResponse(BaseModel):
@@ -33,6 +36,9 @@ class SeriesResponse(BaseModel):
     """Response model for time series endpoints"""
 
     series: List[SeriesPoint]
+    # Set when every value is an estimate (approx mode): the relative standard error.
+    approximate: Optional[bool] = None
+    error_bound: Optional[float] = None
 
 
 class DistributionItem(BaseModel):
@@ -48,6 +54,8 @@ class DistributionResponse(BaseModel):
     """Response model for distribution endpoints"""
 
     data: List[DistributionItem]
+    # Histogram endpoints: p50/p90/p99 of the underlying values.
+    percentiles: Optional[Dict[str, float]] = None
 
 
 class ErrorResponse(BaseModel):
@@ -95,6 +103,7 @@ class CandlestickPoint(BaseModel):
     close: float
     low: float
     high: float
+    volume: Optional[float] = None
 
 
 class CandlestickResponse(BaseModel):
@@ -103,6 +112,23 @@ class CandlestickResponse(BaseModel):
     series: List[CandlestickPoint]
 
 
+class RetentionCohort(BaseModel):
+    """One cohort row of the retention grid"""
+
+    cohort: str
+    size: int
+    # Active wallets and their share of `size` at offsets 0, 1, ... months.
+    retained: List[int]
+    rates: List[float]
+
+
+class RetentionResponse(BaseModel):
+    """Response model for the cohort retention endpoint"""
+
+    side: Literal["buy", "sell"]
+    cohorts: List[RetentionCohort]
+
+
 class PendingUserItem(BaseModel):
     """A user with pending (unpaid) refund"""
 
@@ -126,3 +152,28 @@ class PendingUsersResponse(BaseModel):
     total: int
     page: int
     page_size: int
+    # Opaque keyset cursor for the following page; None on the last page.
+    next_cursor: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    """Several dashboard widgets sharing one set of filters"""
+
+    widgets: List[str] = Field(..., min_length=1, max_length=40)
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    token: Optional[str] = None
+
+
+class BatchWidgetResult(BaseModel):
+    """One widget's payload, or its error when it failed on its own"""
+
+    data: Optional[Any] = None
+    error: Optional[str] = None
+    status: int
+
+
+class BatchResponse(BaseModel):
+    """Response model for the batch endpoint, keyed by widget name"""
+
+    results: Dict[str, BatchWidgetResult]
@@ -0,0 +1,82 @@
+from fastapi import HTTPException
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.logger import logger
+from app.services import buys_service, refunds_service, users_service
+from app.services.token_utils import DEFAULT_TOKEN
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+
+# Widget names mirror the endpoint paths ("buys.daily-count" is
+# /api/buys/daily-count) and the response-cache keys.
+WIDGETS: Dict[str, Callable[..., Awaitable[Dict]]] = {
+    "buys.kpis": buys_service.get_kpis,
+    "buys.total-fee": buys_service.get_total_buys_fee,
+    "buys.daily-count": buys_service.get_daily_count,
+    "buys.daily-volume": buys_service.get_daily_volume,
+    "buys.monthly-trend": buys_service.get_monthly_trend,
+    "buys.exchange-rate-trend": buys_service.get_exchange_rate_trend,
+    "buys.rate-candlestick": buys_service.get_rate_candlestick,
+    "buys.by-gateway": buys_service.get_by_gateway,
+    "buys.by-application": buys_service.get_by_application,
+    "buys.status-distribution": buys_service.get_status_distribution,
+    "buys.amount-distribution": buys_service.get_amount_distribution,
+    "refunds.kpis": refunds_service.get_kpis,
+    "refunds.daily-count": refunds_service.get_daily_count,
+    "refunds.monthly-trend": refunds_service.get_monthly_trend,
+    "refunds.rate-trend": refunds_service.get_rate_trend,
+    "refunds.rate-candlestick": refunds_service.get_rate_candlestick,
+    "refunds.status-distribution": refunds_service.get_status_distribution,
+    "refunds.by-bank": refunds_service.get_by_bank,
+    "refunds.amount-distribution": refunds_service.get_amount_distribution,
+    "users.kpis": users_service.get_kpis,
+    "users.new-per-month": users_service.get_new_per_month,
+    "users.top-buyers": users_service.get_top_buyers,
+    "users.top-sellers": users_service.get_top_sellers,
+    "users.activity-distribution": users_service.get_activity_distribution,
+    "users.monthly-active": users_service.get_monthly_active,
+    "users.buy-sell-comparison": users_service.get_buy_sell_comparison,
+    "users.retention": users_service.get_retention,
+}
+
+
+async def _run_widget(
+    name: str,
+    semaphore: asyncio.Semaphore,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    token: str,
+) -> Dict:
+    fn = WIDGETS.get(name)
+    if fn is None:
+        return {"data": None, "error": f"ویجت ناشناخته: {name}", "status": 400}
+    async with semaphore:
+        try:
+            # An AsyncSession runs one statement at a time, so every widget
+            # gets its own (and with it its own pooled connection).
+            async with AsyncSessionLocal() as session:
+                data = await fn(session, start_date, end_date, token)
+            return {"data": data, "error": None, "status": 200}
+        except HTTPException as e:
+            return {"data": None, "error": e.detail, "status": e.status_code}
+        except Exception as e:
+            logger.error(f"Error in batch_service widget {name}: {e}")
+            return {"data": None, "error": "خطا در اتصال به پایگاه داده", "status": 503}
+
+
+async def run_batch(
+    widgets: List[str],
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    token: str = DEFAULT_TOKEN,
+) -> Dict:
+    """
+    Run several widgets with the same filters, at most BATCH_MAX_CONCURRENCY at
+    a time. A failing widget reports its own error; the others still return.
+    """
+    names = list(dict.fromkeys(widgets))
+    semaphore = asyncio.Semaphore(settings.BATCH_MAX_CONCURRENCY)
+    results = await asyncio.gather(
+        *(_run_widget(name, semaphore, start_date, end_date, token) for name in names)
+    )
+    return {"results": dict(zip(names, results))}
@@ -0,0 +1,161 @@
+"""
+Calendar-aware time buckets with gap filling.
+
+The daily and monthly endpoints group by `DATE(created_at)`, i.e. by UTC day,
+and only return buckets that have rows. With a `granularity` they are served
+from here instead: rows are bucketed in ANALYTICS_TIMEZONE (Asia/Tehran by
+default) by hour, day, week (ISO, from Monday), month or Jalali month, and
+every bucket of the range is returned — empty ones with zero measures —
+because the bucket list comes from `generate_series` and the aggregates are
+LEFT JOINed onto it.
+
+`created_at` is stored without a time zone and is taken to be UTC. The range
+boundaries (whole local days) are converted to UTC in the bind parameters, so
+the filter stays a plain range on `created_at`. Jalali months do not line up
+with any `DATE_TRUNC` unit: they are built from dense local days in Python.
+
+The measures are the rollups' (`rollups._TABLES`), over successful rows only.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Literal, Optional, Tuple
+from zoneinfo import ZoneInfo
+from app.config import settings
+from app.services.rollups import _TABLES, get_rollup, months_ago
+
+Granularity = Literal["hour", "day", "week", "month", "jalali_month"]
+
+# (bucket label, {measure: value})
+Bucket = Tuple[str, Dict[str, float]]
+
+
+def to_jalali(day: date) -> Tuple[int, int, int]:
+    """Jalali (Solar Hijri) year, month and day of a Gregorian date."""
+    g_days_in_month = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+    gy = day.year - 1600
+    gm = day.month - 1
+    g_day_no = 365 * gy + (gy + 3) // 4 - (gy + 99) // 100 + (gy + 399) // 400
+    g_day_no += sum(g_days_in_month[:gm]) + day.day - 1
+    if gm > 1 and ((gy + 1600) % 4 == 0 and ((gy + 1600) % 100 != 0 or (gy + 1600) % 400 == 0)):
+        g_day_no += 1
+
+    j_day_no = g_day_no - 79
+    j_np = j_day_no // 12053
+    j_day_no %= 12053
+    jy = 979 + 33 * j_np + 4 * (j_day_no // 1461)
+    j_day_no %= 1461
+    if j_day_no >= 366:
+        jy += (j_day_no - 1) // 365
+        j_day_no = (j_day_no - 1) % 365
+
+    for jm, length in enumerate((31, 31, 31, 31, 31, 31, 30, 30, 30, 30, 30), start=1):
+        if j_day_no < length:
+            return jy, jm, j_day_no + 1
+        j_day_no -= length
+    return jy, 12, j_day_no + 1
+
+
+def _label(bucket: datetime, granularity: str) -> str:
+    if granularity == "hour":
+        return bucket.strftime("%Y-%m-%d %H:00")
+    return str(bucket.date())
+
+
+async def _local_range(
+    session: AsyncSession,
+    table: str,
+    token: str,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    default_months: Optional[int],
+) -> Optional[Tuple[date, date]]:
+    """Local [start, end) days of a request, with the same defaults as `rollups.load_days`."""
+    today = datetime.now(ZoneInfo(settings.ANALYTICS_TIMEZONE)).date()
+    end = date.fromisoformat(end_date) if end_date else today
+    if start_date:
+        start = date.fromisoformat(start_date)
+    elif default_months is not None and not end_date:
+        start = months_ago(today, default_months)
+    else:
+        start = await get_rollup(table, token).first_day(session)
+        if start is None:
+            return None
+    return start, end + timedelta(days=1)
+
+
+async def load_buckets(
+    session: AsyncSession,
+    table: str,
+    token: str,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    granularity: str,
+    default_months: Optional[int] = None,
+) -> List[Bucket]:
+    """Every bucket of the range in order, each with all of the table's measures."""
+    bounds = await _local_range(session, table, token, start_date, end_date, default_months)
+    if bounds is None or bounds[0] >= bounds[1]:
+        return []
+    start, end = bounds
+    measures = _TABLES[table]["measures"]
+    unit = "day" if granularity == "jalali_month" else granularity
+
+    result = await session.execute(
+        text(f"""
+            WITH buckets AS (
+                SELECT generate_series(
+                    DATE_TRUNC(CAST(:unit AS text), CAST(:start AS timestamp)),
+                    DATE_TRUNC(CAST(:unit AS text), CAST(:end AS timestamp) - INTERVAL '1 microsecond'),
+                    CAST('1 ' || CAST(:unit AS text) AS interval)
+                ) AS bucket
+            ),
+            agg AS (
+                SELECT DATE_TRUNC(CAST(:unit AS text), (created_at AT TIME ZONE 'UTC') AT TIME ZONE CAST(:tz AS text)) AS bucket,
+                       {", ".join(f"{expr} AS {name}" for name, expr in measures.items())}
+                FROM {table}
+                WHERE status = '0' AND code = :token
+                  AND created_at >= (CAST(:start AS timestamp) AT TIME ZONE CAST(:tz AS text)) AT TIME ZONE 'UTC'
+                  AND created_at < (CAST(:end AS timestamp) AT TIME ZONE CAST(:tz AS text)) AT TIME ZONE 'UTC'
+                GROUP BY 1
+            )
+            SELECT b.bucket, {", ".join(f"COALESCE(a.{name}, 0) AS {name}" for name in measures)}
+            FROM buckets b
+            LEFT JOIN agg a ON a.bucket = b.bucket
+            ORDER BY b.bucket
+        """),
+        {
+            "unit": unit,
+            "tz": settings.ANALYTICS_TIMEZONE,
+            "token": token,
+            "start": datetime.combine(start, datetime.min.time()),
+            "end": datetime.combine(end, datetime.min.time()),
+        },
+    )
+    rows = result.fetchall()
+
+    if granularity != "jalali_month":
+        return [
+            (_label(row.bucket, granularity), {name: float(getattr(row, name)) for name in measures})
+            for row in rows
+        ]
+
+    months: Dict[str, Dict[str, float]] = {}
+    for row in rows:
+        jy, jm, _ = to_jalali(row.bucket.date())
+        totals = months.setdefault(f"{jy:04d}-{jm:02d}", dict.fromkeys(measures, 0.0))
+        for name in measures:
+            totals[name] += float(getattr(row, name))
+    return list(months.items())
+
+
+def averaged(buckets: List[Bucket], total: str, count: str) -> List[Tuple[str, float, int]]:
+    """
+    (label, total / count, count) for every bucket. An empty bucket has no
+    average and reads 0 with count 0, like the other measures of empty buckets.
+    """
+    out = []
+    for label, measures in buckets:
+        n = int(measures[count])
+        out.append((label, measures[total] / n if n else 0.0, n))
+    return out
@@ -2,10 +2,23 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
 from app.logger import logger
-from typing import Dict, Optional
+from typing import AsyncIterator, Dict, Optional, Tuple
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.services.bucketing import averaged, load_buckets
+from app.services.candles import compute_candles
 from app.services.date_utils import build_date_filter
+from app.services.histogram import fetch_histogram
+from app.services.persian_format import bucket_labels
+from app.services.response_cache import cached
+from app.services.rollups import by_month, load_days, measure
+from app.services.fee_engine import compute_total_fee
+from app.services.fee_ledger import get_ledger
+from app.services.parallel import can_fan_out, run_in_own_session
+from app.services.quantiles import load_quantiles, quantile_kpis
 from app.services.token_utils import DEFAULT_TOKEN, FEE_PRICE_SERIES
-import numpy as np
+import asyncio
+import json
 
 
 def buys_fee_label(token: str) -> str:
@@ -13,45 +26,37 @@ def buys_fee_label(token: str) -> str:
     return f"مجموع کارمزد خرید ({token})"
 
 
+@cached("buys.kpis")
 async def get_kpis(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    quantiles: bool = False,
 ) -> Dict:
     try:
         df, params = build_date_filter(start_date, end_date)
         params["token"] = token
 
         result = await session.execute(
-            text(f"SELECT COUNT(*) AS total_successful_buys FROM pending_txes WHERE status = '0' AND code = :token{df}"),
-            params,
-        )
-        total_buys = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COALESCE(SUM(amount), 0) AS total_bought FROM pending_txes WHERE status = '0' AND code = :token{df}"),
-            params,
-        )
-        total_volume = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COALESCE(SUM(price), 0) AS total_revenue_rials FROM pending_txes WHERE status = '0' AND code = :token{df}"),
-            params,
-        )
-        total_revenue = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COALESCE(AVG(amount), 0) AS avg_purchase_amount FROM pending_txes WHERE status = '0' AND code = :token{df}"),
-            params,
-        )
-        avg_amount = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COUNT(DISTINCT public_key) AS unique_buyers FROM pending_txes WHERE status = '0' AND code = :token{df}"),
+            text(f"""
+                SELECT
+                    COUNT(*) AS total_successful_buys,
+                    COALESCE(SUM(amount), 0) AS total_bought,
+                    COALESCE(SUM(price), 0) AS total_revenue_rials,
+                    COALESCE(AVG(amount), 0) AS avg_purchase_amount,
+                    COUNT(DISTINCT public_key) AS unique_buyers
+                FROM pending_txes
+                WHERE status = '0' AND code = :token{df}
+            """),
             params,
         )
-        unique_buyers = result.scalar() or 0
+        row = result.one()
+        total_buys = row.total_successful_buys or 0
+        total_volume = row.total_bought or 0
+        total_revenue = row.total_revenue_rials or 0
+        avg_amount = row.avg_purchase_amount or 0
+        unique_buyers = row.unique_buyers or 0
 
         # Every label carries the selected token, so a card is never ambiguous
         # once it has been read out of context (or exported / screenshotted).
@@ -62,6 +67,12 @@ async def get_kpis(
             {"key": "avg_amount", "label": f"میانگین مقدار خرید ({token})", "value": float(avg_amount), "format": "decimal"},
         ]
 
+        # Whale purchases pull the average up; the quantiles come from per-day sketches.
+        if quantiles:
+            estimates = await load_quantiles(session, "pending_txes", token, start_date, end_date)
+            kpis += quantile_kpis(estimates["amount"], "amount", f"مقدار خرید ({token})", "decimal")
+            kpis += quantile_kpis(estimates["price"], "price", f"مبلغ ریالی خرید ({token})", "rial")
+
         # The fee formula depends on a token-specific price series; only PMN has
         # one. The label must match get_total_buys_fee's exactly, or it would
         # visibly change when the lazily-loaded value patches the card.
@@ -81,31 +92,27 @@ async def get_kpis(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("buys.daily-count")
 async def get_daily_count(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    granularity: Optional[str] = None,
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-        time_filter = df if df else " AND created_at >= NOW() - INTERVAL '12 months'"
+        if granularity:
+            buckets = await load_buckets(session, "pending_txes", token, start_date, end_date, granularity, default_months=12)
+            return {"series": [{"date": label, "value": m["amount"]} for label, m in buckets]}
 
-        result = await session.execute(
-            text(f"""
-                SELECT DATE(created_at) AS day, COALESCE(SUM(amount), 0) AS total_amount
-                FROM pending_txes
-                WHERE status = '0' AND code = :token{time_filter}
-                GROUP BY DATE(created_at)
-                ORDER BY day
-            """),
-            params,
-        )
-        rows = result.fetchall()
+        days = await load_days(session, "pending_txes", token, start_date, end_date, default_months=12)
 
         return {
-            "series": [{"date": str(row.day), "value": float(row.total_amount)} for row in rows]
+            "series": [
+                {"date": str(day), "value": measure(r, "amount")}
+                for day, r in sorted(days.items())
+                if measure(r, "count")
+            ]
         }
 
     except Exception as e:
@@ -113,31 +120,27 @@ async def get_daily_count(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("buys.daily-volume")
 async def get_daily_volume(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    granularity: Optional[str] = None,
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-        time_filter = df if df else " AND created_at >= NOW() - INTERVAL '12 months'"
+        if granularity:
+            buckets = await load_buckets(session, "pending_txes", token, start_date, end_date, granularity, default_months=12)
+            return {"series": [{"date": label, "value": m["price"]} for label, m in buckets]}
 
-        result = await session.execute(
-            text(f"""
-                SELECT DATE(created_at) AS day, COALESCE(SUM(price), 0) AS total_rials
-                FROM pending_txes
-                WHERE status = '0' AND code = :token{time_filter}
-                GROUP BY DATE(created_at)
-                ORDER BY day
-            """),
-            params,
-        )
-        rows = result.fetchall()
+        days = await load_days(session, "pending_txes", token, start_date, end_date, default_months=12)
 
         return {
-            "series": [{"date": str(row.day), "value": float(row.total_rials)} for row in rows]
+            "series": [
+                {"date": str(day), "value": measure(r, "price")}
+                for day, r in sorted(days.items())
+                if measure(r, "count")
+            ]
         }
 
     except Exception as e:
@@ -145,75 +148,71 @@ async def get_daily_volume(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("buys.monthly-trend")
 async def get_monthly_trend(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    granularity: Optional[str] = None,
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-
-        result = await session.execute(
-            text(f"""
-                SELECT
-                    DATE_TRUNC('month', created_at) AS month,
-                    COUNT(*) AS count,
-                    COALESCE(SUM(amount), 0) AS total_amount,
-                    COALESCE(SUM(price), 0) AS total_rials
-                FROM pending_txes
-                WHERE status = '0' AND code = :token{df}
-                GROUP BY DATE_TRUNC('month', created_at)
-                ORDER BY month
-            """),
-            params,
-        )
-        rows = result.fetchall()
-
-        return {
-            "series": [
-                {
-                    "date": str(row.month.date()),
-                    "value": int(row.count),
-                    "count": int(row.count),
-                    "total_amount": float(row.total_amount),
-                    "total_rials": float(row.total_rials),
-                }
-                for row in rows
-            ]
-        }
+        if granularity:
+            buckets = await load_buckets(session, "pending_txes", token, start_date, end_date, granularity)
+            return {
+                "series": [
+                    {"date": label, "value": int(m["count"]), "count": int(m["count"]),
+                     "total_amount": m["amount"], "total_rials": m["price"]}
+                    for label, m in buckets
+                ]
+            }
+
+        months = by_month(await load_days(session, "pending_txes", token, start_date, end_date))
+
+        series = []
+        for month, days in months.items():
+            count = sum(measure(r, "count") for r in days)
+            if count:
+                series.append({
+                    "date": str(month),
+                    "value": int(count),
+                    "count": int(count),
+                    "total_amount": sum(measure(r, "amount") for r in days),
+                    "total_rials": sum(measure(r, "price") for r in days),
+                })
+        return {"series": series}
 
     except Exception as e:
         logger.error(f"Database error in buys_service.get_monthly_trend: {e}")
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("buys.exchange-rate-trend")
 async def get_exchange_rate_trend(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    granularity: Optional[str] = None,
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-        time_filter = df if df else " AND created_at >= NOW() - INTERVAL '12 months'"
+        if granularity:
+            buckets = await load_buckets(session, "pending_txes", token, start_date, end_date, granularity, default_months=12)
+            return {
+                "series": [
+                    {"date": label, "value": value, "count": count}
+                    for label, value, count in averaged(buckets, "rate_sum", "rate_count")
+                ]
+            }
 
-        result = await session.execute(
-            text(f"""
-                SELECT DATE(created_at) AS day, AVG(exchange_rate) AS avg_rate
-                FROM pending_txes
-                WHERE status = '0' AND code = :token AND exchange_rate > 0{time_filter}
-                GROUP BY DATE(created_at)
-                ORDER BY day
-            """),
-            params,
-        )
-        rows = result.fetchall()
+        days = await load_days(session, "pending_txes", token, start_date, end_date, default_months=12)
 
         return {
-            "series": [{"date": str(row.day), "value": float(row.avg_rate)} for row in rows]
+            "series": [
+                {"date": str(day), "value": measure(r, "rate_sum") / measure(r, "rate_count")}
+                for day, r in sorted(days.items())
+                if measure(r, "rate_count")
+            ]
         }
 
     except Exception as e:
@@ -221,6 +220,23 @@ async def get_exchange_rate_trend(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("buys.rate-candlestick")
+async def get_rate_candlestick(
+    session: AsyncSession,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    token: str = DEFAULT_TOKEN,
+    interval: str = "1d",
+) -> Dict:
+    try:
+        return {"series": await compute_candles(session, "buy", interval, start_date, end_date, token)}
+
+    except Exception as e:
+        logger.error(f"Database error in buys_service.get_rate_candlestick: {e}")
+        raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
+
+
+@cached("buys.by-gateway")
 async def get_by_gateway(
     session: AsyncSession,
     start_date: Optional[str] = None,
@@ -255,6 +271,7 @@ async def get_by_gateway(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("buys.by-application")
 async def get_by_application(
     session: AsyncSession,
     start_date: Optional[str] = None,
@@ -286,6 +303,7 @@ async def get_by_application(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("buys.status-distribution")
 async def get_status_distribution(
     session: AsyncSession,
     start_date: Optional[str] = None,
@@ -293,23 +311,18 @@ async def get_status_distribution(
     token: str = DEFAULT_TOKEN,
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
+        days = await load_days(session, "pending_txes", token, start_date, end_date)
 
-        result = await session.execute(
-            text(f"""
-                SELECT status, COUNT(*) AS count
-                FROM pending_txes
-                WHERE code = :token{df}
-                GROUP BY status
-                ORDER BY count DESC
-            """),
-            params,
-        )
-        rows = result.fetchall()
+        counts: Dict = {}
+        for r in days.values():
+            for status, measures in r.items():
+                counts[status] = counts.get(status, 0) + measures["count"]
 
         return {
-            "data": [{"name": row.status, "value": int(row.count)} for row in rows]
+            "data": [
+                {"name": status, "value": int(count)}
+                for status, count in sorted(counts.items(), key=lambda item: item[1], reverse=True)
+            ]
         }
 
     except Exception as e:
@@ -317,38 +330,44 @@ async def get_status_distribution(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+# Upper bounds of the default buckets (right-inclusive, last one open-ended).
+AMOUNT_EDGES = (10, 100, 1000, 10000)
+
+
+@cached("buys.amount-distribution")
 async def get_amount_distribution(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    strategy: str = "edges",
+    edges: Optional[Tuple[float, ...]] = None,
+    bins: int = 5,
 ) -> Dict:
     try:
         df, params = build_date_filter(start_date, end_date)
         params["token"] = token
 
-        result = await session.execute(
-            text(f"""
-                SELECT
-                    CASE
-                        WHEN amount <= 10 THEN '۰-۱۰'
-                        WHEN amount <= 100 THEN '۱۰-۱۰۰'
-                        WHEN amount <= 1000 THEN '۱۰۰-۱٬۰۰۰'
-                        WHEN amount <= 10000 THEN '۱٬۰۰۰-۱۰٬۰۰۰'
-                        ELSE '۱۰٬۰۰۰+'
-                    END AS bucket,
-                    COUNT(*) AS count
+        hist = await fetch_histogram(
+            session,
+            f"""
+                SELECT amount::float8 AS value
                 FROM pending_txes
-                WHERE status = '0' AND code = :token{df}
-                GROUP BY bucket
-                ORDER BY MIN(amount)
-            """),
+                WHERE status = '0' AND code = :token AND amount IS NOT NULL{df}
+            """,
             params,
+            strategy,
+            edges or AMOUNT_EDGES,
+            bins,
         )
-        rows = result.fetchall()
 
         return {
-            "data": [{"name": row.bucket, "value": int(row.count)} for row in rows]
+            "data": [
+                {"name": label, "value": count}
+                for label, count in zip(bucket_labels(hist.edges), hist.counts)
+                if count
+            ],
+            "percentiles": hist.percentiles,
         }
 
     except Exception as e:
@@ -356,6 +375,7 @@ async def get_amount_distribution(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("buys.total-fee")
 async def get_total_buys_fee(
     session: AsyncSession,
     start_date: Optional[str] = None,
@@ -368,50 +388,10 @@ async def get_total_buys_fee(
         raise HTTPException(status_code=400, detail=f"محاسبه کارمزد برای توکن {token} پشتیبانی نمی‌شود")
 
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-
-        tx_result = await session.execute(
-            text(f"""
-                SELECT created_at, amount
-                FROM pending_txes
-                WHERE status = '0' AND code = :token{df}
-                ORDER BY created_at
-            """),
-            params,
-        )
-        tx_rows = tx_result.fetchall()
-
-        nd_result = await session.execute(
-            text("""
-                SELECT last_update, price
-                FROM market_parameters_minutes
-                WHERE name = :price_series
-                ORDER BY last_update
-            """),
-            {"price_series": price_series},
-        )
-        nd_rows = nd_result.fetchall()
-
-        total_buys_fee = 0
-        if tx_rows and nd_rows:
-            nd_timestamps = np.array([row.last_update.timestamp() for row in nd_rows])
-            nd_prices = np.array([float(row.price) for row in nd_rows])
-
-            tx_timestamps = np.array([row.created_at.timestamp() for row in tx_rows])
-            tx_amounts = np.array([float(row.amount) for row in tx_rows])
-
-            indices = np.searchsorted(nd_timestamps, tx_timestamps, side='right') - 1
-            indices = np.clip(indices, 0, len(nd_timestamps) - 1)
-
-            next_indices = np.minimum(indices + 1, len(nd_timestamps) - 1)
-            diff_left = np.abs(tx_timestamps - nd_timestamps[indices])
-            diff_right = np.abs(tx_timestamps - nd_timestamps[next_indices])
-            closest_indices = np.where(diff_right < diff_left, next_indices, indices)
-
-            closest_nd_prices = nd_prices[closest_indices]
-            fee_per_token = np.floor(0.02 * closest_nd_prices)
-            total_buys_fee = int(np.sum(tx_amounts * fee_per_token))
+        if settings.FEE_LEDGER_ENABLED:
+            total_buys_fee = await get_ledger(token, price_series).total(session, start_date, end_date)
+        else:
+            total_buys_fee = await compute_total_fee(session, price_series, token, start_date, end_date)
 
         return {
             "kpi": {"key": "total_buys_fee", "label": buys_fee_label(token), "value": int(total_buys_fee), "format": "rial"}
@@ -422,3 +402,86 @@ async def get_total_buys_fee(
     except Exception as e:
         logger.error(f"Database error in buys_service.get_total_buys_fee: {e}")
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
+
+
+async def _cancel_fee(task: "asyncio.Task") -> None:
+    """Cancel the side-by-side fee task and wait until it has released its connection."""
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, HTTPException):
+        pass
+
+
+class KpiStream:
+    """
+    The NDJSON lines of `open_kpi_stream`, plus `aclose` to release the fee
+    task. A generator's `finally` only runs once it has been started, so a
+    response that is never sent (the client left first) must call `aclose`.
+    """
+
+    def __init__(self, kpis: Dict, fee_task: Optional["asyncio.Task"], start_date: Optional[str],
+                 end_date: Optional[str], token: str):
+        self.kpis = kpis
+        self.fee_task = fee_task
+        self.start_date = start_date
+        self.end_date = end_date
+        self.token = token
+
+    async def lines(self) -> AsyncIterator[str]:
+        try:
+            yield json.dumps(self.kpis, ensure_ascii=False) + "\n"
+            if self.token in FEE_PRICE_SERIES:
+                try:
+                    if self.fee_task is not None:
+                        fee = await self.fee_task
+                    else:
+                        # Opened here, so nothing is held before the stream starts.
+                        async with AsyncSessionLocal() as session:
+                            fee = await get_total_buys_fee(session, self.start_date, self.end_date, self.token)
+                except HTTPException as e:
+                    fee = {"kpi": None, "detail": e.detail}
+                yield json.dumps(fee, ensure_ascii=False) + "\n"
+        finally:
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        """Cancel the fee task if it is still running; safe to call more than once."""
+        if self.fee_task is not None and not self.fee_task.done():
+            await _cancel_fee(self.fee_task)
+
+
+async def open_kpi_stream(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    token: str = DEFAULT_TOKEN,
+    quantiles: bool = False,
+) -> KpiStream:
+    """
+    KPIs and the lazy fee as one NDJSON response.
+
+    The cards are computed before the stream is returned, so a database error
+    still surfaces as a normal 503. The first line is the `get_kpis` payload
+    (with the quantile cards when `quantiles` is set, as on `/kpis`); for
+    tokens with a fee price series a second line carries the
+    `get_total_buys_fee` payload (or `{"kpi": null, "detail": ...}` if only
+    the fee failed — the cards have already been sent by then). When the pool
+    has room the fee starts on its own connection alongside the cards, so the
+    second line arrives after the slower of the two instead of their sum. The
+    caller must `aclose` the stream once the response is over, sent or not.
+    """
+    fee_task = None
+    if token in FEE_PRICE_SERIES and can_fan_out(2):
+        fee_task = asyncio.create_task(run_in_own_session(
+            lambda own_session: get_total_buys_fee(own_session, start_date, end_date, token)
+        ))
+
+    try:
+        async with AsyncSessionLocal() as session:
+            kpis = await get_kpis(session, start_date, end_date, token, quantiles)
+    except BaseException:
+        if fee_task is not None:
+            await _cancel_fee(fee_task)
+        raise
+
+    return KpiStream(kpis, fee_task, start_date, end_date, token)
@@ -0,0 +1,166 @@
+"""
+OHLC candles with volume for any interval.
+
+The old refund candles took open and close from two `ARRAY_AGG(... ORDER BY
+created_at)[1]` per day, which builds and sorts a full array per group twice,
+and could only produce daily candles. A candle here is an epoch-aligned
+bucket of `INTERVALS[interval]` seconds (weeks start on Monday) and is built
+by one of two engines, chosen by CANDLE_ENGINE:
+
+  * "sql": one window over (bucket ORDER BY created_at) with an unbounded
+    frame yields FIRST_VALUE/LAST_VALUE from a single sort, then a GROUP BY
+    adds low, high and volume.
+  * "numpy": rate, amount and timestamp arrive through the columnar fetch;
+    rows are sorted once, bucket boundaries found with `flatnonzero(diff)` and
+    low/high/volume reduced with `reduceat`, open/close read at the bounds.
+
+Timestamps are `created_at` as stored (UTC), so 1d candles are exactly the
+previous `DATE(created_at)` days. Volume is the token amount of the rows.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone
+from typing import Dict, List, Literal, Optional
+from app.config import settings
+from app.services.columnar import fetch_columns
+from app.services.date_utils import build_date_filter
+from app.services.token_utils import DEFAULT_TOKEN
+import numpy as np
+
+Interval = Literal["5m", "15m", "1h", "4h", "1d", "1w"]
+
+INTERVALS = {"5m": 300, "15m": 900, "1h": 3600, "4h": 14400, "1d": 86400, "1w": 604800}
+# 1970-01-05, the first Monday after the epoch: weekly candles start there.
+_WEEK_ORIGIN = 4 * 86400
+
+# market side -> (table, rate column, row filter)
+_SOURCES = {
+    "buy": ("pending_txes", "exchange_rate", "status = '0'"),
+    "refund": ("pending_refunds", "refund_rate", "status IN ('0', '1')"),
+}
+
+
+def _label(bucket_start: float, interval: str) -> str:
+    moment = datetime.fromtimestamp(bucket_start, tz=timezone.utc)
+    if INTERVALS[interval] >= 86400:
+        return moment.strftime("%Y-%m-%d")
+    return moment.strftime("%Y-%m-%d %H:%M")
+
+
+def _where(side: str, start_date: Optional[str], end_date: Optional[str], token: str):
+    table, rate_col, row_filter = _SOURCES[side]
+    df, params = build_date_filter(start_date, end_date)
+    params["token"] = token
+    # Without a range, the trailing 12 months the daily charts default to.
+    time_filter = df if df else " AND created_at >= NOW() - INTERVAL '12 months'"
+    return table, rate_col, f"{row_filter} AND code = :token AND {rate_col} > 0{time_filter}", params
+
+
+async def _candles_sql(session: AsyncSession, side: str, interval: str, start_date, end_date, token) -> List[Dict]:
+    table, rate_col, where, params = _where(side, start_date, end_date, token)
+    params["step"] = float(INTERVALS[interval])
+    params["origin"] = float(_WEEK_ORIGIN if interval == "1w" else 0)
+
+    result = await session.execute(
+        text(f"""
+            SELECT
+                bucket * CAST(:step AS float8) + CAST(:origin AS float8) AS bucket_start,
+                MIN(open) AS open,
+                MIN(close) AS close,
+                MIN(rate) AS low,
+                MAX(rate) AS high,
+                SUM(volume) AS volume
+            FROM (
+                SELECT
+                    bucket, rate, volume,
+                    FIRST_VALUE(rate) OVER w AS open,
+                    LAST_VALUE(rate) OVER w AS close
+                FROM (
+                    SELECT
+                        floor((extract(epoch FROM created_at)::float8 - CAST(:origin AS float8)) / CAST(:step AS float8)) AS bucket,
+                        created_at,
+                        {rate_col}::float8 AS rate,
+                        COALESCE(amount, 0)::float8 AS volume
+                    FROM {table}
+                    WHERE {where}
+                ) rows
+                WINDOW w AS (PARTITION BY bucket ORDER BY created_at
+                             ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+            ) framed
+            GROUP BY bucket
+            ORDER BY bucket
+        """),
+        params,
+    )
+    return [
+        {
+            "date": _label(float(row.bucket_start), interval),
+            "open": float(row.open),
+            "close": float(row.close),
+            "low": float(row.low),
+            "high": float(row.high),
+            "volume": float(row.volume),
+        }
+        for row in result.fetchall()
+    ]
+
+
+async def _candles_numpy(session: AsyncSession, side: str, interval: str, start_date, end_date, token) -> List[Dict]:
+    table, rate_col, where, params = _where(side, start_date, end_date, token)
+    columns = await fetch_columns(
+        session,
+        f"""
+            SELECT
+                extract(epoch FROM created_at)::float8 AS ts,
+                {rate_col}::float8 AS rate,
+                COALESCE(amount, 0)::float8 AS volume
+            FROM {table}
+            WHERE {where}
+        """,
+        params,
+        ("ts", "rate", "volume"),
+    )
+    if not columns["ts"].size:
+        return []
+
+    order = np.argsort(columns["ts"], kind="stable")
+    ts, rate, volume = columns["ts"][order], columns["rate"][order], columns["volume"][order]
+
+    step = INTERVALS[interval]
+    origin = _WEEK_ORIGIN if interval == "1w" else 0
+    bucket = np.floor((ts - origin) / step)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    ends = np.append(starts[1:], ts.size)
+
+    opens = rate[starts]
+    closes = rate[ends - 1]
+    lows = np.minimum.reduceat(rate, starts)
+    highs = np.maximum.reduceat(rate, starts)
+    volumes = np.add.reduceat(volume, starts)
+    bucket_starts = bucket[starts] * step + origin
+
+    return [
+        {
+            "date": _label(float(b), interval),
+            "open": float(o),
+            "close": float(c),
+            "low": float(lo),
+            "high": float(hi),
+            "volume": float(v),
+        }
+        for b, o, c, lo, hi, v in zip(bucket_starts, opens, closes, lows, highs, volumes)
+    ]
+
+
+async def compute_candles(
+    session: AsyncSession,
+    side: str,
+    interval: str = "1d",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    token: str = DEFAULT_TOKEN,
+) -> List[Dict]:
+    """Candles of the buy (`exchange_rate`) or refund (`refund_rate`) side, oldest first."""
+    if settings.CANDLE_ENGINE == "sql":
+        return await _candles_sql(session, side, interval, start_date, end_date, token)
+    return await _candles_numpy(session, side, interval, start_date, end_date, token)
@@ -0,0 +1,87 @@
+"""
+Columnar fetch: query results straight into NumPy arrays.
+
+`fetch_columns` runs the query through asyncpg's `COPY (...) TO STDOUT
+(FORMAT binary)` and decodes the whole payload with one `np.frombuffer`, so no
+Row objects, datetimes or Decimals are ever built. The price is a narrow
+contract: every selected column must be a non-NULL `float8` (cast in SQL —
+`extract(epoch FROM ts)::float8`, `amount::float8`). With fixed-width columns
+each binary tuple has the same layout, which is what makes the single
+structured-dtype decode possible.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Mapping, Sequence, Tuple
+import numpy as np
+import re
+
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+_HEADER_FIXED = len(_COPY_SIGNATURE) + 8  # signature, flags, extension length
+_TRAILER = b"\xff\xff"
+# `:name` binds, but not the second colon of a `::type` cast.
+_BIND = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+
+def _to_positional(sql: str, params: Mapping) -> Tuple[str, List]:
+    """Rewrite SQLAlchemy-style `:name` binds as asyncpg `$n` placeholders."""
+    order: Dict[str, int] = {}
+    args: List = []
+
+    def replace(m: "re.Match") -> str:
+        name = m.group(1)
+        if name not in order:
+            args.append(params[name])
+            order[name] = len(args)
+        return f"${order[name]}"
+
+    return _BIND.sub(replace, sql), args
+
+
+def decode_binary_copy(buf: bytes, names: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Decode a binary COPY payload of non-NULL float8 columns into arrays."""
+    if not buf.startswith(_COPY_SIGNATURE):
+        raise ValueError("not a binary COPY payload")
+    ext_len = int.from_bytes(buf[_HEADER_FIXED - 4:_HEADER_FIXED], "big")
+    offset = _HEADER_FIXED + ext_len
+    if not buf.endswith(_TRAILER):
+        raise ValueError("binary COPY payload is truncated")
+
+    dtype = np.dtype(
+        [("nfields", ">i2")]
+        + [field for name in names for field in ((f"{name}__len", ">i4"), (name, ">f8"))]
+    )
+    body = len(buf) - offset - len(_TRAILER)
+    if body % dtype.itemsize:
+        raise ValueError("columnar fetch needs non-NULL float8 columns only")
+    rows = np.frombuffer(buf, dtype=dtype, count=body // dtype.itemsize, offset=offset)
+
+    if rows.size and (
+        np.any(rows["nfields"] != len(names))
+        or any(np.any(rows[f"{name}__len"] != 8) for name in names)
+    ):
+        raise ValueError("columnar fetch needs non-NULL float8 columns only")
+    return {name: rows[name].astype(np.float64) for name in names}
+
+
+async def fetch_columns(
+    session: AsyncSession,
+    sql: str,
+    params: Mapping,
+    names: Sequence[str],
+) -> Dict[str, np.ndarray]:
+    """
+    Run `sql` and return its columns as float64 arrays keyed by `names`.
+
+    `names` must list the selected columns in order. Runs on the session's own
+    connection (and transaction), like `session.execute` would.
+    """
+    query, args = _to_positional(sql, params)
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+
+    chunks: List[bytes] = []
+
+    async def sink(chunk: bytes) -> None:
+        chunks.append(chunk)
+
+    await raw.driver_connection.copy_from_query(query, *args, output=sink, format="binary")
+    return decode_binary_copy(b"".join(chunks), names)
@@ -1,5 +1,9 @@
 from typing import Optional, Tuple, Dict
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
+
+# How long after midnight a day is still treated as open: late purchases and
+# the price point nearest midnight may land shortly after the day ends.
+SETTLE_PERIOD = timedelta(hours=1)
 
 
 def build_date_filter(
@@ -17,3 +21,27 @@ def build_date_filter(
         parts.append(f"{column} < :end_date")
         params["end_date"] = date.fromisoformat(end_date) + timedelta(days=1)
     return (" AND " + " AND ".join(parts)) if parts else "", params
+
+
+def utc_today() -> date:
+    """Today as `DATE(created_at)` sees it: created_at is stored as UTC."""
+    return datetime.now(timezone.utc).date()
+
+
+def first_open_day(now: Optional[datetime] = None) -> date:
+    """
+    Earliest day whose data may still change; every earlier day is closed.
+
+    Days are UTC days, like `DATE(created_at)`, whatever the server's local
+    zone. A naive `now` is taken as UTC; an aware one is converted.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    elif now.tzinfo is not None:
+        now = now.astimezone(timezone.utc)
+    return (now - SETTLE_PERIOD).date()
+
+
+def is_closed_range(end_date: Optional[str]) -> bool:
+    """True when a range ends before the first open day, so its result is final."""
+    return bool(end_date) and date.fromisoformat(end_date) < first_open_day()
@@ -0,0 +1,58 @@
+"""
+Largest-Triangle-Three-Buckets (LTTB) downsampling of chart series.
+
+A multi-year daily series is thousands of points, far more than a chart can
+show. LTTB keeps the first and last point and, from each of `max_points - 2`
+equal buckets in between, the point forming the largest triangle with the
+point kept from the previous bucket and the mean of the next bucket, which
+preserves peaks and troughs that plain striding or averaging would flatten.
+
+Points are placed at their position in the series (x = 0, 1, 2, ...); the
+series here are ordered and, with a `granularity`, evenly spaced. The per
+bucket work is vectorized; only the walk from bucket to bucket, where each
+choice depends on the previous one, is a Python loop of `max_points` steps.
+"""
+from typing import Dict, Optional
+import numpy as np
+
+
+def lttb_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of the points of `y` that LTTB keeps (all of them if it is short enough)."""
+    n = y.shape[0]
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=np.float64)
+    # Bucket edges over the interior points 1..n-2, plus the last point as its own bucket.
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.intp)
+    edges = np.append(edges, n)
+    starts, ends = edges[:-1], edges[1:]
+    # Mean of each bucket (the last one is just the final point): the "C" corner.
+    sums = np.add.reduceat(y, starts)
+    counts = ends - starts
+    mean_x = np.add.reduceat(x, starts) / counts
+    mean_y = sums / counts
+
+    keep = np.empty(max_points, dtype=np.intp)
+    keep[0] = 0
+    a = 0
+    for b in range(max_points - 2):
+        lo, hi = starts[b], ends[b]
+        cx, cy = mean_x[b + 1], mean_y[b + 1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[b + 1] = a
+    keep[-1] = n - 1
+    return keep
+
+
+def downsample_series(payload: Dict, max_points: Optional[int]) -> Dict:
+    """
+    A `SeriesResponse` payload with at most `max_points` points, chosen by LTTB
+    on `value`. Returns a new dict: the payload may be a shared cached result.
+    """
+    series = payload.get("series") or []
+    if not max_points or len(series) <= max_points:
+        return payload
+    y = np.fromiter((float(point["value"]) for point in series), dtype=np.float64, count=len(series))
+    return {**payload, "series": [series[i] for i in lttb_indices(y, max_points)]}
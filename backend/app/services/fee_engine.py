@@ -0,0 +1,194 @@
+"""
+Buy-fee engines.
+
+The fee of a purchase is `amount * floor(0.02 * price)`, where `price` is the
+point of the token's price series (`market_parameters_minutes`) closest in time
+to the purchase. Both engines implement exactly that rule, and the one used is
+chosen by `settings.FEE_ENGINE`:
+
+  * "numpy" — fetches the purchases and the whole price series as columnar
+    arrays (see `columnar.py`) and matches them with `np.searchsorted`. The
+    price series comes from the local mmap mirror (`price_store.py`) unless
+    PRICE_STORE_ENABLED is off.
+  * "sql"   — does the as-of lookup inside Postgres with two LATERAL probes per
+    purchase (the last price at or before it, the first one after it). Only a
+    single number comes back. Relies on the index on
+    `market_parameters_minutes (name, last_update)` from
+    `migrations/002_price_series_index.sql`; without it every probe scans
+    the series, which is why "numpy" stays the default.
+
+Ties go to the earlier price in both engines, and price points with a NULL
+price are skipped by both. The NumPy engine keeps the arithmetic exact, as
+NUMERIC is in Postgres: prices and amounts become scaled integers, and each
+day is summed as a Python int before the one final conversion to float. Both
+return per-day partial sums (keyed by `DATE(created_at)`) so the fee ledger can
+store them; the total is simply their sum.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
+from typing import Dict, Optional
+from app.config import settings
+from app.services.columnar import fetch_columns
+from app.services.date_utils import build_date_filter
+from app.services.price_store import get_price_store
+import numpy as np
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Token amounts have at most 7 decimals (stroops); prices are taken to 4.
+_AMOUNT_SCALE = 10 ** 7
+_PRICE_SCALE = 10 ** 4
+
+
+# Each LATERAL is a single index probe (migrations/002_price_series_index.sql);
+# a purchase before the first or after the last price point falls back to
+# whichever neighbour exists. `{df}` is the date filter on tx.created_at.
+_FEES_SQL = """
+    SELECT DATE(tx.created_at) AS day, COALESCE(SUM(
+        tx.amount * FLOOR(0.02 * CASE
+            WHEN nxt.price IS NULL THEN prv.price
+            WHEN prv.price IS NULL THEN nxt.price
+            WHEN nxt.last_update - tx.created_at < tx.created_at - prv.last_update THEN nxt.price
+            ELSE prv.price
+        END)
+    ), 0) AS fee_sum
+    FROM pending_txes tx
+    LEFT JOIN LATERAL (
+        SELECT last_update, price
+        FROM market_parameters_minutes
+        WHERE name = :price_series AND price IS NOT NULL AND last_update <= tx.created_at
+        ORDER BY last_update DESC
+        LIMIT 1
+    ) prv ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT last_update, price
+        FROM market_parameters_minutes
+        WHERE name = :price_series AND price IS NOT NULL AND last_update > tx.created_at
+        ORDER BY last_update ASC
+        LIMIT 1
+    ) nxt ON TRUE
+    WHERE tx.status = '0' AND tx.code = :token{df}
+    GROUP BY DATE(tx.created_at)
+"""
+
+
+async def compute_total_fee(
+    session: AsyncSession,
+    price_series: str,
+    token: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> int:
+    """Total buy fee for `token` over the date range, using the configured engine."""
+    daily = await compute_daily_fees(session, price_series, token, start_date, end_date)
+    return int(sum(daily.values()))
+
+
+async def compute_daily_fees(
+    session: AsyncSession,
+    price_series: str,
+    token: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> Dict[date, float]:
+    """Buy fee per day for `token` over the date range; days without purchases are absent."""
+    if settings.FEE_ENGINE == "sql":
+        return await _daily_fees_sql(session, price_series, token, start_date, end_date)
+    return await _daily_fees_numpy(session, price_series, token, start_date, end_date)
+
+
+async def _daily_fees_numpy(
+    session: AsyncSession,
+    price_series: str,
+    token: str,
+    start_date: Optional[str],
+    end_date: Optional[str],
+) -> Dict[date, float]:
+    df, params = build_date_filter(start_date, end_date)
+    params["token"] = token
+
+    # Columnar fetch: epochs, amounts and day numbers arrive as float arrays.
+    # The day is taken from DATE(created_at) in SQL so it matches the ledger's
+    # and the SQL engine's day boundaries exactly. Amounts are scaled to whole
+    # stroops in NUMERIC first, so the float8 carries an exact integer.
+    tx = await fetch_columns(
+        session,
+        f"""
+            SELECT
+                extract(epoch FROM created_at)::float8 AS ts,
+                (amount * {_AMOUNT_SCALE})::float8 AS amount,
+                (DATE(created_at) - DATE '1970-01-01')::float8 AS day
+            FROM pending_txes
+            WHERE status = '0' AND code = :token AND amount IS NOT NULL{df}
+            ORDER BY created_at
+        """,
+        params,
+        ("ts", "amount", "day"),
+    )
+    if settings.PRICE_STORE_ENABLED:
+        nd_timestamps, nd_prices = await get_price_store(price_series).load(session)
+    else:
+        nd = await fetch_columns(
+            session,
+            """
+                SELECT extract(epoch FROM last_update)::float8 AS ts, price::float8 AS price
+                FROM market_parameters_minutes
+                WHERE name = :price_series AND price IS NOT NULL
+                ORDER BY last_update
+            """,
+            {"price_series": price_series},
+            ("ts", "price"),
+        )
+        nd_timestamps, nd_prices = nd["ts"], nd["price"]
+
+    if not tx["ts"].size or not nd_timestamps.size:
+        return {}
+
+    tx_timestamps = tx["ts"]
+    tx_amounts = np.rint(tx["amount"]).astype(np.int64)
+    tx_days = tx["day"].astype(np.int64)
+
+    indices = np.searchsorted(nd_timestamps, tx_timestamps, side='right') - 1
+    indices = np.clip(indices, 0, len(nd_timestamps) - 1)
+
+    next_indices = np.minimum(indices + 1, len(nd_timestamps) - 1)
+    diff_left = np.abs(tx_timestamps - nd_timestamps[indices])
+    diff_right = np.abs(tx_timestamps - nd_timestamps[next_indices])
+    closest_indices = np.where(diff_right < diff_left, next_indices, indices)
+
+    # floor(0.02 * price) in integers: 0.02 * p == 2 * (p * scale) / (100 * scale).
+    closest_nd_prices = np.rint(nd_prices[closest_indices] * _PRICE_SCALE).astype(np.int64)
+    fee_per_token = (closest_nd_prices * 2) // (100 * _PRICE_SCALE)
+
+    # amount * fee overflows int64, so sum the amounts per (day, fee) first —
+    # few distinct pairs per day — and multiply those sums as Python ints.
+    days, day_index = np.unique(tx_days, return_inverse=True)
+    fees, fee_index = np.unique(fee_per_token, return_inverse=True)
+    pairs, pair_index = np.unique(day_index * fees.size + fee_index, return_inverse=True)
+    order = np.argsort(pair_index, kind="stable")
+    starts = np.searchsorted(pair_index[order], np.arange(pairs.size))
+    amount_sums = np.add.reduceat(tx_amounts[order], starts)
+
+    day_totals = [0] * days.size
+    for pair, amount_sum in zip(pairs.tolist(), amount_sums.tolist()):
+        day, fee = divmod(pair, fees.size)
+        day_totals[day] += amount_sum * int(fees[fee])
+    return {
+        date.fromordinal(_EPOCH_ORDINAL + int(d)): total / _AMOUNT_SCALE
+        for d, total in zip(days, day_totals)
+    }
+
+
+async def _daily_fees_sql(
+    session: AsyncSession,
+    price_series: str,
+    token: str,
+    start_date: Optional[str],
+    end_date: Optional[str],
+) -> Dict[date, float]:
+    df, params = build_date_filter(start_date, end_date, column="tx.created_at")
+    params["token"] = token
+    params["price_series"] = price_series
+
+    result = await session.execute(text(_FEES_SQL.format(df=df)), params)
+    return {row.day: float(row.fee_sum) for row in result.fetchall()}
@@ -0,0 +1,214 @@
+"""
+Fee ledger: persisted per-day partial sums of the buy fee.
+
+A past day's fee never changes, so it is computed once (by the configured fee
+engine) and stored as a (token, day, fee_sum) entry in
+`{DATA_DIR}/fee_ledger/{token}.json`. A range query then only sums stored
+partials and recomputes the days that are still open.
+
+A day counts as closed once it ended more than `SETTLE_PERIOD` ago
+(`date_utils.first_open_day`), which gives the minute price series time to
+record the point nearest midnight.
+Every closed day in a computed span is stored, including days without
+purchases (as 0), so it is never fetched again.
+
+The file is shared by all workers: writes go through a temp file and
+`os.replace`, and each process reloads it when its mtime changes. Two workers
+filling the same day write the same value, so a lost update only costs a
+recomputation.
+
+Run from `backend/`:
+
+    python -m app.services.fee_ledger backfill [--token PMN] [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+    python -m app.services.fee_ledger reconcile [--token PMN] [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+from app.logger import logger
+from app.services.date_utils import first_open_day, utc_today
+from app.services.fee_engine import compute_daily_fees
+import asyncio
+import json
+import os
+
+
+def _days(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+class FeeLedger:
+    """Per-day fee partials of one token, backed by a JSON file."""
+
+    def __init__(self, token: str, price_series: str):
+        self.token = token
+        self.price_series = price_series
+        self.path = os.path.join(settings.DATA_DIR, "fee_ledger", f"{token}.json")
+        self._days: Dict[date, float] = {}
+        self._mtime: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path, encoding="utf-8") as f:
+            raw = json.load(f)
+        self._days = {date.fromisoformat(d): float(v) for d, v in raw.items()}
+        self._mtime = mtime
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({d.isoformat(): v for d, v in sorted(self._days.items())}, f)
+        os.replace(tmp, self.path)
+        self._mtime = os.path.getmtime(self.path)
+
+    async def _fill(self, session: AsyncSession, start: date, end: date) -> int:
+        """Compute and store every closed day in [start, end] that is missing."""
+        missing = [d for d in _days(start, end) if d not in self._days]
+        if not missing:
+            return 0
+        span_start, span_end = missing[0], missing[-1]
+        daily = await compute_daily_fees(
+            session, self.price_series, self.token, span_start.isoformat(), span_end.isoformat()
+        )
+        for d in _days(span_start, span_end):
+            self._days[d] = daily.get(d, 0.0)
+        self._save()
+        logger.info(f"Fee ledger {self.token}: stored {len(missing)} day(s) {span_start}..{span_end}")
+        return len(missing)
+
+    async def _bounds(
+        self, session: AsyncSession, start_date: Optional[str], end_date: Optional[str]
+    ) -> Optional[Tuple[date, date]]:
+        end = date.fromisoformat(end_date) if end_date else utc_today()
+        if start_date:
+            start = date.fromisoformat(start_date)
+        else:
+            result = await session.execute(
+                text("SELECT MIN(created_at) FROM pending_txes WHERE status = '0' AND code = :token"),
+                {"token": self.token},
+            )
+            first = result.scalar()
+            if first is None:
+                return None
+            start = first.date()
+        return (start, end) if start <= end else None
+
+    async def total(
+        self, session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> int:
+        """Fee over the range: stored closed days plus a live recompute of open ones."""
+        bounds = await self._bounds(session, start_date, end_date)
+        if bounds is None:
+            return 0
+        start, end = bounds
+        first_open = first_open_day()
+        closed_end = min(end, first_open - timedelta(days=1))
+
+        total = 0.0
+        if start <= closed_end:
+            async with self._lock:
+                self._reload_if_changed()
+                await self._fill(session, start, closed_end)
+                total += sum(self._days[d] for d in _days(start, closed_end))
+
+        open_start = max(start, first_open)
+        if open_start <= end:
+            live = await compute_daily_fees(
+                session, self.price_series, self.token, open_start.isoformat(), end.isoformat()
+            )
+            total += sum(live.values())
+
+        return int(total)
+
+    async def backfill(
+        self, session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> int:
+        """Store every missing closed day in the range; returns how many were computed."""
+        bounds = await self._bounds(session, start_date, end_date)
+        if bounds is None:
+            return 0
+        start, end = bounds
+        end = min(end, first_open_day() - timedelta(days=1))
+        if start > end:
+            return 0
+        async with self._lock:
+            self._reload_if_changed()
+            return await self._fill(session, start, end)
+
+    async def reconcile(
+        self, session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> List[Tuple[date, Optional[float], float]]:
+        """
+        Compare stored days against a full recompute of the range.
+
+        Returns (day, stored, recomputed) for every stored day that differs by
+        more than half a rial; days not in the ledger yet are not reported.
+        """
+        self._reload_if_changed()
+        fresh = await compute_daily_fees(session, self.price_series, self.token, start_date, end_date)
+        lo = date.fromisoformat(start_date) if start_date else date.min
+        hi = date.fromisoformat(end_date) if end_date else date.max
+        mismatches = []
+        for d, stored in sorted(self._days.items()):
+            if lo <= d <= hi:
+                recomputed = fresh.get(d, 0.0)
+                if abs(stored - recomputed) > 0.5:
+                    mismatches.append((d, stored, recomputed))
+        return mismatches
+
+
+_ledgers: Dict[str, FeeLedger] = {}
+
+
+def get_ledger(token: str, price_series: str) -> FeeLedger:
+    ledger = _ledgers.get(token)
+    if ledger is None:
+        ledger = _ledgers[token] = FeeLedger(token, price_series)
+    return ledger
+
+
+async def _main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    from app.database import AsyncSessionLocal, engine
+    from app.services.token_utils import DEFAULT_TOKEN, FEE_PRICE_SERIES
+
+    parser = argparse.ArgumentParser(prog="python -m app.services.fee_ledger")
+    parser.add_argument("command", choices=("backfill", "reconcile"))
+    parser.add_argument("--token", default=DEFAULT_TOKEN)
+    parser.add_argument("--start", default=None, help="YYYY-MM-DD, default: first purchase")
+    parser.add_argument("--end", default=None, help="YYYY-MM-DD, default: last closed day")
+    args = parser.parse_args(argv)
+
+    token = args.token.strip().upper()
+    price_series = FEE_PRICE_SERIES.get(token)
+    if price_series is None:
+        parser.error(f"no fee price series for token {token}")
+
+    ledger = get_ledger(token, price_series)
+    try:
+        async with AsyncSessionLocal() as session:
+            if args.command == "backfill":
+                stored = await ledger.backfill(session, args.start, args.end)
+                print(f"{token}: stored {stored} day(s)")
+                return 0
+
+            mismatches = await ledger.reconcile(session, args.start, args.end)
+            for d, stored, recomputed in mismatches:
+                print(f"{token} {d}: ledger={stored:.0f} recomputed={recomputed:.0f}")
+            print(f"{token}: {len(mismatches)} mismatching day(s)")
+            return 1 if mismatches else 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(_main()))
@@ -0,0 +1,102 @@
+"""
+Histograms of one numeric column, with percentiles from the same pass.
+
+The values come through the columnar fetch as a single float8 array, so a
+distribution is one `searchsorted` + `bincount` in NumPy instead of a CASE per
+bucket in SQL, and the buckets are data rather than code:
+
+  * "edges": explicit upper bounds (each endpoint has its own default, which
+    reproduces the buckets it always had);
+  * "log": `bins` log-spaced buckets between the smallest positive and the
+    largest value, bounds rounded to two significant digits;
+  * "quantile": `bins` buckets holding roughly equal numbers of rows.
+
+Buckets are right-inclusive — `(e[i-1], e[i]]`, as the old `amount <= 10`
+CASE arms were — with an open-ended last bucket. p50/p90/p99 are computed
+from the same array. Labels are a presentation step (`persian_format`).
+"""
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Literal, Mapping, NamedTuple, Optional, Tuple
+from app.services.columnar import fetch_columns
+import math
+import numpy as np
+
+Strategy = Literal["edges", "log", "quantile"]
+
+PERCENTILES = (50, 90, 99)
+
+
+class Histogram(NamedTuple):
+    edges: Tuple[float, ...]
+    # len(edges) + 1 counts; the last bucket is everything above edges[-1]
+    counts: List[int]
+    # {"p50": ..., "p90": ..., "p99": ...}, None without values
+    percentiles: Optional[Dict[str, float]]
+
+
+def parse_edges(raw: Optional[str]) -> Optional[Tuple[float, ...]]:
+    """Comma-separated, finite, strictly increasing bucket bounds from a query string."""
+    if not raw:
+        return None
+    try:
+        edges = tuple(float(part) for part in raw.split(","))
+    except ValueError:
+        edges = ()
+    # NaN compares false both ways, so it has to be rejected explicitly.
+    if not edges or not all(math.isfinite(e) for e in edges) or any(b <= a for a, b in zip(edges, edges[1:])):
+        raise HTTPException(status_code=400, detail="مرزهای دسته‌بندی نامعتبر است")
+    return edges
+
+
+def _round_significant(values: np.ndarray, digits: int = 2) -> np.ndarray:
+    magnitude = np.floor(np.log10(np.abs(values)))
+    scale = 10.0 ** (magnitude - digits + 1)
+    return np.round(values / scale) * scale
+
+
+def resolve_edges(values: np.ndarray, strategy: str, edges: Tuple[float, ...], bins: int,
+                  discrete: bool = False) -> Tuple[float, ...]:
+    """
+    Bucket bounds for `values` under `strategy` (`edges` is used as is for
+    "edges"). With `discrete` (whole counts) computed bounds are floored.
+    """
+    if strategy == "edges" or not values.size:
+        return edges
+    if strategy == "log":
+        positive = values[values > 0]
+        if not positive.size or positive.min() == positive.max():
+            return edges
+        bounds = _round_significant(np.geomspace(positive.min(), positive.max(), bins + 1)[1:-1])
+    else:
+        bounds = np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1])
+    if discrete:
+        bounds = np.floor(bounds)
+    return tuple(float(b) for b in np.unique(bounds))
+
+
+def build_histogram(values: np.ndarray, strategy: str, edges: Tuple[float, ...], bins: int,
+                    discrete: bool = False) -> Histogram:
+    """Counts per bucket and percentiles of `values`."""
+    bounds = resolve_edges(values, strategy, edges, bins, discrete)
+    index = np.searchsorted(np.asarray(bounds, dtype=np.float64), values, side="left")
+    counts = np.bincount(index, minlength=len(bounds) + 1)
+    percentiles = None
+    if values.size:
+        points = np.percentile(values, PERCENTILES)
+        percentiles = {f"p{p}": float(v) for p, v in zip(PERCENTILES, points)}
+    return Histogram(bounds, [int(c) for c in counts], percentiles)
+
+
+async def fetch_histogram(
+    session: AsyncSession,
+    sql: str,
+    params: Mapping,
+    strategy: str,
+    edges: Tuple[float, ...],
+    bins: int,
+    discrete: bool = False,
+) -> Histogram:
+    """Histogram of the single non-NULL float8 column `value` selected by `sql`."""
+    columns = await fetch_columns(session, sql, params, ("value",))
+    return build_histogram(columns["value"], strategy, edges, bins, discrete)
@@ -0,0 +1,169 @@
+"""
+HyperLogLog sketches of wallet sets, for approximate distinct counts.
+
+A sketch is `2**precision` one-byte registers (4 KiB at the default precision
+of 12). Union is an element-wise max, so per-day sketches answer "distinct
+wallets over any range" by merging a few hundred small arrays instead of a
+`COUNT(DISTINCT ...)` over the raw rows. The relative standard error is
+`1.04 / sqrt(2**precision)` — about 1.6% at precision 12.
+
+`DailySketches` keeps one sketch per closed day of a (table, token) in process,
+built from the distinct (day, wallet) pairs of the missing span in a single
+query; open days are sketched live. Closed days of tables with a change column
+are re-sketched when their rows change, exactly like the rollups.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+from app.config import settings
+from app.services.date_utils import first_open_day, utc_today
+from app.services.rollups import changed_days, get_rollup
+import asyncio
+import hashlib
+import math
+import numpy as np
+
+_WALLET_COLUMNS = {"pending_txes": "public_key", "pending_refunds": "public"}
+
+
+def relative_error(precision: int) -> float:
+    """Relative standard error of a HyperLogLog estimate."""
+    return 1.04 / math.sqrt(1 << precision)
+
+
+def _alpha(m: int) -> float:
+    if m >= 128:
+        return 0.7213 / (1 + 1.079 / m)
+    return {16: 0.673, 32: 0.697, 64: 0.709}[m]
+
+
+def hash_wallets(wallets: Iterable[str]) -> np.ndarray:
+    """Stable 64-bit hashes (the same in every worker and across restarts)."""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(w.encode(), digest_size=8).digest(), "little") for w in wallets),
+        dtype=np.uint64,
+    )
+
+
+def register_updates(hashes: np.ndarray, precision: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(register index, rank) for each hash; a register keeps its maximum rank."""
+    tail_bits = 64 - precision
+    index = (hashes >> np.uint64(tail_bits)).astype(np.intp)
+    tail = hashes & np.uint64((1 << tail_bits) - 1)
+    # With precision >= 12 (the setting's minimum) the tail is < 2**52, so
+    # the float conversion is exact and frexp's exponent is its bit length:
+    # rank = leading zeros + 1.
+    _, bit_length = np.frexp(tail.astype(np.float64))
+    rank = (tail_bits - bit_length + 1).astype(np.uint8)
+    return index, rank
+
+
+def estimate(registers: np.ndarray) -> float:
+    """Cardinality estimate with the small-range (linear counting) correction."""
+    m = registers.size
+    raw = _alpha(m) * m * m / float(np.sum(np.ldexp(1.0, -registers.astype(np.int64))))
+    zeros = int(np.count_nonzero(registers == 0))
+    if raw <= 2.5 * m and zeros:
+        return m * math.log(m / zeros)
+    return raw
+
+
+def merge(sketches: Iterable[np.ndarray], precision: int) -> np.ndarray:
+    merged = np.zeros(1 << precision, dtype=np.uint8)
+    for registers in sketches:
+        np.maximum(merged, registers, out=merged)
+    return merged
+
+
+class DailySketches:
+    """Per-day wallet sketches of one table/token (successful rows only)."""
+
+    def __init__(self, table: str, token: str):
+        self.table = table
+        self.token = token
+        self.wallet_col = _WALLET_COLUMNS[table]
+        self.precision = settings.HLL_PRECISION
+        self._changes = changed_days(table, token)
+        self._closed: Dict[date, Optional[np.ndarray]] = {}
+        self._lock = asyncio.Lock()
+
+    async def _sketch(self, session: AsyncSession, start: date, end: date) -> Dict[date, np.ndarray]:
+        result = await session.execute(
+            text(f"""
+                SELECT DISTINCT DATE(created_at) AS day, {self.wallet_col} AS wallet
+                FROM {self.table}
+                WHERE status = '0' AND code = :token AND {self.wallet_col} IS NOT NULL
+                  AND created_at >= :start AND created_at < :end
+            """),
+            {"token": self.token, "start": start, "end": end + timedelta(days=1)},
+        )
+        rows = result.fetchall()
+        if not rows:
+            return {}
+        days = sorted({row.day for row in rows})
+        position = {d: i for i, d in enumerate(days)}
+        day_index = np.fromiter((position[row.day] for row in rows), dtype=np.intp, count=len(rows))
+        index, rank = register_updates(hash_wallets(row.wallet for row in rows), self.precision)
+
+        registers = np.zeros((len(days), 1 << self.precision), dtype=np.uint8)
+        np.maximum.at(registers, (day_index, index), rank)
+        return {d: registers[i] for d, i in position.items()}
+
+    async def range(self, session: AsyncSession, start: date, end: date) -> Dict[date, np.ndarray]:
+        """Sketches of every day in [start, end] that has wallets."""
+        if start > end:
+            return {}
+        first_open = first_open_day()
+        closed_end = min(end, first_open - timedelta(days=1))
+
+        out: Dict[date, np.ndarray] = {}
+        if start <= closed_end:
+            async with self._lock:
+                if self._changes is not None:
+                    for d in await self._changes.poll(session):
+                        self._closed.pop(d, None)
+                span = [start + timedelta(days=i) for i in range((closed_end - start).days + 1)]
+                missing = [d for d in span if d not in self._closed]
+                if missing:
+                    filled = await self._sketch(session, missing[0], missing[-1])
+                    for i in range((missing[-1] - missing[0]).days + 1):
+                        d = missing[0] + timedelta(days=i)
+                        self._closed[d] = filled.get(d)
+                for d in span:
+                    if self._closed[d] is not None:
+                        out[d] = self._closed[d]
+
+        open_start = max(start, first_open)
+        if open_start <= end:
+            out.update(await self._sketch(session, open_start, end))
+        return out
+
+
+_sketches: Dict[Tuple[str, str], DailySketches] = {}
+
+
+def get_sketches(table: str, token: str) -> DailySketches:
+    key = (table, token)
+    sketches = _sketches.get(key)
+    if sketches is None:
+        sketches = _sketches[key] = DailySketches(table, token)
+    return sketches
+
+
+async def load_sketches(
+    session: AsyncSession,
+    table: str,
+    token: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> Dict[date, np.ndarray]:
+    """Day sketches for a request's date range (all history without a start date)."""
+    end = date.fromisoformat(end_date) if end_date else utc_today()
+    if start_date:
+        start = date.fromisoformat(start_date)
+    else:
+        start = await get_rollup(table, token).first_day(session)
+        if start is None:
+            return {}
+    return await get_sketches(table, token).range(session, start, end)
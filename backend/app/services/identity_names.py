@@ -0,0 +1,56 @@
+"""
+Wallet → account-holder display name, cached in process.
+
+A wallet's name comes from `federation` → `kuknos_user` → `identity`, which
+rarely changes, so resolved names (including "no name") are kept for
+IDENTITY_CACHE_TTL_SECONDS in an LRU of at most IDENTITY_CACHE_MAX_ENTRIES
+wallets per worker. `resolve_names` serves a whole list of wallets and looks up
+only the misses, in one `= ANY(:wallets)` query.
+
+Names are attached after any ranking, so a wallet with no federation/identity
+record keeps its place with name None. `federation.public` is not unique
+(8 duplicates at the time of writing); `DISTINCT ON` keeps one row per wallet.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Iterable, Optional
+from app.config import settings
+from app.services.response_cache import MISSING, TTLCache
+
+name_cache = TTLCache(settings.IDENTITY_CACHE_MAX_ENTRIES)
+
+
+def _full_name(first_name: Optional[str], last_name: Optional[str]) -> Optional[str]:
+    # None rather than "" so the frontend can fall back to the wallet
+    return " ".join(p for p in (first_name, last_name) if p).strip() or None
+
+
+async def resolve_names(session: AsyncSession, wallets: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Display name (or None) of each wallet, querying only the uncached ones."""
+    names: Dict[str, Optional[str]] = {}
+    misses = []
+    for wallet in dict.fromkeys(wallets):
+        name = name_cache.get(wallet)
+        if name is MISSING:
+            misses.append(wallet)
+        else:
+            names[wallet] = name
+    if not misses:
+        return names
+
+    result = await session.execute(
+        text("""
+            SELECT DISTINCT ON (f.public) f.public AS wallet, i.first_name, i.last_name
+            FROM federation f
+            LEFT JOIN kuknos_user ku ON ku.id = f.user_id
+            LEFT JOIN identity i ON i.national_id = ku.national_id
+            WHERE f.public = ANY(:wallets)
+            ORDER BY f.public, i.last_name NULLS LAST
+        """),
+        {"wallets": misses},
+    )
+    found = {row.wallet: _full_name(row.first_name, row.last_name) for row in result.fetchall()}
+    for wallet in misses:
+        names[wallet] = found.get(wallet)
+        name_cache.set(wallet, names[wallet], settings.IDENTITY_CACHE_TTL_SECONDS)
+    return names
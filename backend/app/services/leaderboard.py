@@ -0,0 +1,140 @@
+"""
+Top-N wallet leaderboards from per-day partial sums.
+
+For every (table, token, day) a leaderboard keeps the successful volume and
+row count of each wallet active that day, as parallel arrays over interned
+wallet ids (`wallet_index.wallets`). A range's ranking merges only the days in
+the range — one `np.unique`/`bincount` over their wallet-days — and selects the
+top N with `argpartition`, so neither N nor the number of wallets outside the
+range adds to the cost. Names are attached separately (`identity_names`).
+
+Closed days are aggregated once and kept; open days are aggregated live, and
+days with changed rows (`pending_refunds.updated_at`) are re-aggregated, as
+for the rollups.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from app.services.date_utils import first_open_day, utc_today
+from app.services.rollups import changed_days, get_rollup
+from app.services.wallet_index import wallets
+import asyncio
+import numpy as np
+
+_WALLET_COLUMNS = {"pending_txes": "public_key", "pending_refunds": "public"}
+
+# wallet ids, summed amount and row count of one day
+DayTotals = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class Leaderboard:
+    """Per-day wallet totals of one table/token (successful rows only)."""
+
+    def __init__(self, table: str, token: str):
+        self.table = table
+        self.token = token
+        self.wallet_col = _WALLET_COLUMNS[table]
+        self._changes = changed_days(table, token)
+        self._closed: Dict[date, Optional[DayTotals]] = {}
+        self._lock = asyncio.Lock()
+
+    async def _aggregate(self, session: AsyncSession, start: date, end: date) -> Dict[date, DayTotals]:
+        result = await session.execute(
+            text(f"""
+                SELECT DATE(created_at) AS day, {self.wallet_col} AS wallet,
+                       COALESCE(SUM(amount), 0) AS total_amount, COUNT(*) AS tx_count
+                FROM {self.table}
+                WHERE status = '0' AND code = :token AND {self.wallet_col} IS NOT NULL
+                  AND created_at >= :start AND created_at < :end
+                GROUP BY DATE(created_at), {self.wallet_col}
+                ORDER BY day
+            """),
+            {"token": self.token, "start": start, "end": end + timedelta(days=1)},
+        )
+        rows = result.fetchall()
+        if not rows:
+            return {}
+        ids = wallets.ids(row.wallet for row in rows)
+        totals = np.fromiter((float(row.total_amount) for row in rows), dtype=np.float64, count=len(rows))
+        counts = np.fromiter((row.tx_count for row in rows), dtype=np.int64, count=len(rows))
+        days = [row.day for row in rows]
+        bounds = [0] + [i for i in range(1, len(days)) if days[i] != days[i - 1]] + [len(days)]
+        return {
+            days[lo]: (ids[lo:hi], totals[lo:hi], counts[lo:hi])
+            for lo, hi in zip(bounds[:-1], bounds[1:])
+        }
+
+    async def range(self, session: AsyncSession, start: date, end: date) -> List[DayTotals]:
+        """Totals of every day in [start, end] that has activity."""
+        if start > end:
+            return []
+        first_open = first_open_day()
+        closed_end = min(end, first_open - timedelta(days=1))
+
+        out: List[DayTotals] = []
+        if start <= closed_end:
+            async with self._lock:
+                if self._changes is not None:
+                    for d in await self._changes.poll(session):
+                        self._closed.pop(d, None)
+                span = [start + timedelta(days=i) for i in range((closed_end - start).days + 1)]
+                missing = [d for d in span if d not in self._closed]
+                if missing:
+                    filled = await self._aggregate(session, missing[0], missing[-1])
+                    for i in range((missing[-1] - missing[0]).days + 1):
+                        d = missing[0] + timedelta(days=i)
+                        self._closed[d] = filled.get(d)
+                out.extend(self._closed[d] for d in span if self._closed[d] is not None)
+
+        open_start = max(start, first_open)
+        if open_start <= end:
+            out.extend((await self._aggregate(session, open_start, end)).values())
+        return out
+
+
+_leaderboards: Dict[Tuple[str, str], Leaderboard] = {}
+
+
+def get_leaderboard(table: str, token: str) -> Leaderboard:
+    key = (table, token)
+    board = _leaderboards.get(key)
+    if board is None:
+        board = _leaderboards[key] = Leaderboard(table, token)
+    return board
+
+
+def top_n(days: List[DayTotals], n: int) -> List[Tuple[str, float, int]]:
+    """(wallet, total amount, row count) of the `n` largest wallets across `days`."""
+    if not days:
+        return []
+    ids = np.concatenate([d[0] for d in days])
+    unique, inverse = np.unique(ids, return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate([d[1] for d in days]))
+    counts = np.bincount(inverse, weights=np.concatenate([d[2] for d in days]))
+
+    if n < unique.shape[0]:
+        picked = np.argpartition(-totals, n - 1)[:n]
+    else:
+        picked = np.arange(unique.shape[0])
+    picked = picked[np.argsort(-totals[picked], kind="stable")]
+    return [(wallets.wallet(int(unique[i])), float(totals[i]), int(counts[i])) for i in picked]
+
+
+async def load_top(
+    session: AsyncSession,
+    table: str,
+    token: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    n: int = 10,
+) -> List[Tuple[str, float, int]]:
+    """Top `n` wallets of a request's date range (all history without a start date)."""
+    end = date.fromisoformat(end_date) if end_date else utc_today()
+    if start_date:
+        start = date.fromisoformat(start_date)
+    else:
+        start = await get_rollup(table, token).first_day(session)
+        if start is None:
+            return []
+    return top_n(await get_leaderboard(table, token).range(session, start, end), n)
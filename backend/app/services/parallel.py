@@ -0,0 +1,60 @@
+"""
+Run independent read queries concurrently, each on its own pooled connection.
+
+One `AsyncSession` holds one connection and runs its statements one after
+another, so a function that needs two independent queries pays for both in
+sequence. `gather_queries` instead gives every query its own session from the
+pool and awaits them together: the caller waits for the slowest query rather
+than the sum. At most QUERY_FANOUT_MAX_CONCURRENCY of one call's queries run
+at a time.
+
+Fanning out only helps while the pool has idle connections. When the queries
+would not all fit in the pool's idle connections (or QUERY_FANOUT_ENABLED is
+off) they run one after another on the caller's session, exactly as before,
+instead of queueing for connections other requests are waiting on.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Awaitable, Callable, List
+from app.config import settings
+from app.database import AsyncSessionLocal, engine
+import asyncio
+
+QueryFactory = Callable[[AsyncSession], Awaitable[Any]]
+
+
+def can_fan_out(n: int) -> bool:
+    """True when `n` extra connections are available without queueing on the pool."""
+    if not settings.QUERY_FANOUT_ENABLED or n < 2:
+        return False
+    pool = engine.pool
+    return pool.checkedout() + n <= pool.size()
+
+
+async def run_in_own_session(factory: QueryFactory) -> Any:
+    """`factory(session)` on a fresh session, closed when it finishes."""
+    async with AsyncSessionLocal() as session:
+        return await factory(session)
+
+
+async def gather_queries(session: AsyncSession, *factories: QueryFactory) -> List[Any]:
+    """
+    Results of `factory(session)` for each factory, in order.
+
+    Runs them concurrently on separate sessions when the pool has room, else
+    sequentially on `session`. If any fails, the rest are still awaited (so
+    every connection is returned) before the first error is raised.
+    """
+    if not can_fan_out(len(factories)):
+        return [await factory(session) for factory in factories]
+
+    semaphore = asyncio.Semaphore(settings.QUERY_FANOUT_MAX_CONCURRENCY)
+
+    async def run(factory: QueryFactory) -> Any:
+        async with semaphore:
+            return await run_in_own_session(factory)
+
+    results = await asyncio.gather(*(run(factory) for factory in factories), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return list(results)
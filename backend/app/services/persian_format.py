@@ -0,0 +1,74 @@
+"""
+Persian presentation of numbers and histogram bucket labels.
+
+Kept apart from the histogram engine, which only deals in edges and counts:
+the same buckets can be labelled differently without touching the query.
+"""
+from typing import List, Optional, Sequence
+import math
+
+_PERSIAN_DIGITS = str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")
+_THOUSANDS = "٬"  # ARABIC THOUSANDS SEPARATOR
+_DECIMAL = "٫"  # ARABIC DECIMAL SEPARATOR
+_MAX_DECIMALS = 10
+
+
+def _decimals(value: float, significant: int = 3) -> int:
+    """Decimals showing a fraction to `significant` digits (at least two); 0 for whole numbers."""
+    if float(value).is_integer():
+        return 0
+    return min(_MAX_DECIMALS, max(2, significant - 1 - math.floor(math.log10(abs(value)))))
+
+
+def format_number(value: float, decimals: Optional[int] = None) -> str:
+    """
+    `value` in Persian digits with thousands separators: 10000 -> '۱۰٬۰۰۰',
+    0.0012 -> '۰٫۰۰۱۲'. Without `decimals`, fractions keep three significant
+    digits (two decimals at least); trailing zeros are dropped either way.
+    """
+    if decimals is None:
+        decimals = _decimals(value)
+    text = f"{value:,.{decimals}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    text = text.replace(",", "\0").replace(".", _DECIMAL).replace("\0", _THOUSANDS)
+    return text.translate(_PERSIAN_DIGITS)
+
+
+def _label_decimals(points: Sequence[float]) -> int:
+    """One precision for every label: enough for each bound, and to tell neighbours apart."""
+    decimals = max(_decimals(p) for p in points)
+    gaps = [b - a for a, b in zip(points, points[1:]) if b > a]
+    if decimals and gaps and min(gaps) < 1:
+        decimals = max(decimals, 1 - math.floor(math.log10(min(gaps))))
+    return min(decimals, _MAX_DECIMALS)
+
+
+def bucket_labels(edges: Sequence[float], lower: float = 0, discrete: bool = False) -> List[str]:
+    """
+    Labels of the `len(edges) + 1` right-inclusive buckets `(-inf, e0], (e0, e1],
+    ..., (e_last, inf)`, the first one shown from `lower`.
+
+    Continuous values read 'a-b' for (a, b]. With `discrete` (whole counts)
+    (a, b] reads 'a+1-b', or just 'b' when that is a single value. The last
+    bucket is always 'e_last+'.
+    """
+    decimals = _label_decimals([lower, *edges])
+
+    def fmt(value: float) -> str:
+        return format_number(value, decimals)
+
+    labels = []
+    previous = None
+    for edge in edges:
+        if previous is None:
+            start = lower
+        else:
+            start = previous + 1 if discrete else previous
+        if discrete and start == edge:
+            labels.append(fmt(edge))
+        else:
+            labels.append(f"{fmt(start)}-{fmt(edge)}")
+        previous = edge
+    labels.append(f"{fmt(edges[-1])}+" if edges else fmt(lower) + "+")
+    return labels
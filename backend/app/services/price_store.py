@@ -0,0 +1,137 @@
+"""
+Local, memory-mapped copy of the minute price series used by the fee engine.
+
+`market_parameters_minutes` is append-only, so each series in
+`FEE_PRICE_SERIES` is mirrored into two flat little-endian float64 files under
+`{DATA_DIR}/price_series/`:
+
+    ND.ts.f8      epoch seconds of `last_update`, ascending
+    ND.price.f8   the matching `price`
+
+Before every use the store asks Postgres only for rows newer than the last
+cached timestamp and appends them. Readers `np.memmap` the files read-only, so
+all uvicorn workers share one copy through the OS page cache instead of each
+holding (and re-fetching) the full history. Appends are serialised across
+workers with an `flock` on a sidecar lock file; a reader that sees the files
+mid-append simply uses the shorter of the two, which is always a consistent
+prefix.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from app.config import settings
+from app.logger import logger
+from app.services.columnar import fetch_columns
+import asyncio
+import fcntl
+import numpy as np
+import os
+
+_EPOCH = datetime(1970, 1, 1)
+_ITEMSIZE = np.dtype("<f8").itemsize
+
+
+class PriceSeriesStore:
+    """Append-only mmap mirror of one `market_parameters_minutes` series."""
+
+    def __init__(self, name: str):
+        self.name = name
+        directory = os.path.join(settings.DATA_DIR, "price_series")
+        self.ts_path = os.path.join(directory, f"{name}.ts.f8")
+        self.price_path = os.path.join(directory, f"{name}.price.f8")
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        self._maps: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._mapped_count = -1
+        self._lock = asyncio.Lock()
+
+    def _count(self) -> int:
+        try:
+            sizes = (os.path.getsize(self.ts_path), os.path.getsize(self.price_path))
+        except FileNotFoundError:
+            return 0
+        return min(sizes) // _ITEMSIZE
+
+    def _last_ts(self) -> Optional[float]:
+        count = self._count()
+        if not count:
+            return None
+        with open(self.ts_path, "rb") as f:
+            f.seek((count - 1) * _ITEMSIZE)
+            return float(np.frombuffer(f.read(_ITEMSIZE), dtype="<f8")[0])
+
+    def _append(self, ts: np.ndarray, price: np.ndarray) -> int:
+        """Append rows newer than what is on disk; returns how many were written."""
+        os.makedirs(os.path.dirname(self.ts_path), exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another worker may have appended while we were fetching.
+                last = self._last_ts()
+                if last is not None:
+                    keep = ts > last
+                    ts, price = ts[keep], price[keep]
+                if not ts.size:
+                    return 0
+                # Drop any torn tail from an interrupted append before extending.
+                count = self._count()
+                for path, values in ((self.ts_path, ts), (self.price_path, price)):
+                    with open(path, "ab") as f:
+                        f.truncate(count * _ITEMSIZE)
+                        f.write(values.astype("<f8").tobytes())
+                return int(ts.size)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    async def refresh(self, session: AsyncSession) -> int:
+        """Fetch and append rows newer than the cached tail; returns how many were added."""
+        async with self._lock:
+            last = self._last_ts()
+            params: Dict = {"price_series": self.name}
+            since = ""
+            if last is not None:
+                since = " AND last_update > :since"
+                params["since"] = _EPOCH + timedelta(seconds=last)
+            new = await fetch_columns(
+                session,
+                f"""
+                    SELECT extract(epoch FROM last_update)::float8 AS ts, price::float8 AS price
+                    FROM market_parameters_minutes
+                    WHERE name = :price_series AND price IS NOT NULL{since}
+                    ORDER BY last_update
+                """,
+                params,
+                ("ts", "price"),
+            )
+            added = self._append(new["ts"], new["price"]) if new["ts"].size else 0
+            if added:
+                logger.info(f"Price store {self.name}: appended {added} row(s)")
+            return added
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Read-only (timestamps, prices) views over the files; empty if nothing is cached."""
+        count = self._count()
+        if count != self._mapped_count:
+            if count:
+                self._maps = (
+                    np.memmap(self.ts_path, dtype="<f8", mode="r", shape=(count,)),
+                    np.memmap(self.price_path, dtype="<f8", mode="r", shape=(count,)),
+                )
+            else:
+                self._maps = (np.empty(0), np.empty(0))
+            self._mapped_count = count
+        return self._maps
+
+    async def load(self, session: AsyncSession) -> Tuple[np.ndarray, np.ndarray]:
+        """Bring the mirror up to date and return its arrays."""
+        await self.refresh(session)
+        return self.arrays()
+
+
+_stores: Dict[str, PriceSeriesStore] = {}
+
+
+def get_price_store(name: str) -> PriceSeriesStore:
+    store = _stores.get(name)
+    if store is None:
+        store = _stores[name] = PriceSeriesStore(name)
+    return store
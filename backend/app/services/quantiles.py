@@ -0,0 +1,208 @@
+"""
+Mergeable per-day quantile sketches for median/p90/p99 KPIs.
+
+Exact `percentile_cont` over every row of a range is a full sort per request.
+Instead, each (table, token, day) keeps a DDSketch-style sketch per measure:
+positive values are counted in logarithmic buckets `ceil(log_gamma(v))` with
+`gamma = (1 + a) / (1 - a)`, `a` = QUANTILE_SKETCH_ACCURACY, and values <= 0
+in a separate zero count. A sketch is a pair of arrays (bucket keys, counts),
+so merging any number of days is one `np.unique` + `bincount`, and every
+quantile read from the merge is within relative error `a` of a true sample
+value — for any range, with no error growth from merging.
+
+    pending_txes     amount, price
+    pending_refunds  amount, refund_price
+
+Only successful rows (status '0') are sketched. Rows are read through the
+columnar fetch; closed days are sketched once and kept, open days are
+sketched live, and days with changed rows (`pending_refunds.updated_at`) are
+re-sketched, as for the rollups.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from app.config import settings
+from app.services.columnar import fetch_columns
+from app.services.date_utils import first_open_day, utc_today
+from app.services.rollups import changed_days, get_rollup
+import asyncio
+import numpy as np
+
+_MEASURES = {
+    "pending_txes": ("amount", "price"),
+    "pending_refunds": ("amount", "refund_price"),
+}
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class QuantileSketch(NamedTuple):
+    keys: np.ndarray  # sorted log-bucket indices (int64)
+    counts: np.ndarray  # values per bucket (int64)
+    zeros: int  # values <= 0
+
+
+# measure name -> sketch, for one day
+DaySketches = Dict[str, QuantileSketch]
+
+
+def gamma(accuracy: float) -> float:
+    return (1 + accuracy) / (1 - accuracy)
+
+
+def merge(sketches: Sequence[QuantileSketch]) -> QuantileSketch:
+    """One sketch counting every value of `sketches`."""
+    if not sketches:
+        return QuantileSketch(np.empty(0, np.int64), np.empty(0, np.int64), 0)
+    keys, inverse = np.unique(np.concatenate([s.keys for s in sketches]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([s.counts for s in sketches]), minlength=keys.size)
+    return QuantileSketch(keys, counts.astype(np.int64), sum(s.zeros for s in sketches))
+
+
+def quantiles(sketch: QuantileSketch, qs: Sequence[float], accuracy: float) -> Optional[List[float]]:
+    """Estimates of the `qs` quantiles (0..1), or None for an empty sketch."""
+    total = sketch.zeros + int(sketch.counts.sum())
+    if not total:
+        return None
+    g = gamma(accuracy)
+    cumulative = np.cumsum(sketch.counts)
+    out = []
+    for q in qs:
+        rank = q * (total - 1)
+        if rank < sketch.zeros:
+            out.append(0.0)
+            continue
+        index = min(int(np.searchsorted(cumulative, rank - sketch.zeros, side="right")), cumulative.size - 1)
+        # The bucket's relative midpoint: within `accuracy` of every value in it.
+        out.append(float(2 * g ** float(sketch.keys[index]) / (g + 1)))
+    return out
+
+
+class DailyQuantiles:
+    """Per-day quantile sketches of one table/token (successful rows only)."""
+
+    def __init__(self, table: str, token: str):
+        self.table = table
+        self.token = token
+        self.measures = _MEASURES[table]
+        self.accuracy = settings.QUANTILE_SKETCH_ACCURACY
+        self._changes = changed_days(table, token)
+        self._closed: Dict[date, Optional[DaySketches]] = {}
+        self._lock = asyncio.Lock()
+
+    async def _sketch(self, session: AsyncSession, start: date, end: date) -> Dict[date, DaySketches]:
+        # NULLs arrive as NaN (the columnar fetch needs non-NULL float8) and are skipped.
+        columns = await fetch_columns(
+            session,
+            f"""
+                SELECT
+                    (DATE(created_at) - DATE '1970-01-01')::float8 AS day,
+                    {", ".join(f"COALESCE({m}::float8, 'NaN') AS {m}" for m in self.measures)}
+                FROM {self.table}
+                WHERE status = '0' AND code = :token AND created_at >= :start AND created_at < :end
+            """,
+            {"token": self.token, "start": start, "end": end + timedelta(days=1)},
+            ("day", *self.measures),
+        )
+        if not columns["day"].size:
+            return {}
+
+        days, day_index = np.unique(columns["day"].astype(np.int64), return_inverse=True)
+        log_gamma = np.log(gamma(self.accuracy))
+        day_dates = [date.fromordinal(_EPOCH_ORDINAL + int(d)) for d in days]
+        out: Dict[date, DaySketches] = {d: {} for d in day_dates}
+        for name in self.measures:
+            values = columns[name]
+            valid = ~np.isnan(values)
+            positive = valid & (values > 0)
+            zeros = np.bincount(day_index[valid & ~positive], minlength=days.size)
+            keys = np.ceil(np.log(values[positive]) / log_gamma).astype(np.int64)
+            # Count each (day, key) pair through one packed int64, sorted by day then key.
+            low = int(keys.min()) if keys.size else 0
+            width = (int(keys.max()) - low + 1) if keys.size else 1
+            packed, counts = np.unique(day_index[positive] * width + (keys - low), return_counts=True)
+            pair_days, pair_keys = np.divmod(packed, width)
+            bounds = np.searchsorted(pair_days, np.arange(days.size + 1))
+            for i, d in enumerate(day_dates):
+                lo, hi = bounds[i], bounds[i + 1]
+                out[d][name] = QuantileSketch(pair_keys[lo:hi] + low, counts[lo:hi].astype(np.int64), int(zeros[i]))
+        return out
+
+    async def range(self, session: AsyncSession, start: date, end: date) -> List[DaySketches]:
+        """Sketches of every day in [start, end] that has rows."""
+        if start > end:
+            return []
+        first_open = first_open_day()
+        closed_end = min(end, first_open - timedelta(days=1))
+
+        out: List[DaySketches] = []
+        if start <= closed_end:
+            async with self._lock:
+                if self._changes is not None:
+                    for d in await self._changes.poll(session):
+                        self._closed.pop(d, None)
+                span = [start + timedelta(days=i) for i in range((closed_end - start).days + 1)]
+                missing = [d for d in span if d not in self._closed]
+                if missing:
+                    filled = await self._sketch(session, missing[0], missing[-1])
+                    for i in range((missing[-1] - missing[0]).days + 1):
+                        d = missing[0] + timedelta(days=i)
+                        self._closed[d] = filled.get(d)
+                out.extend(self._closed[d] for d in span if self._closed[d] is not None)
+
+        open_start = max(start, first_open)
+        if open_start <= end:
+            out.extend((await self._sketch(session, open_start, end)).values())
+        return out
+
+
+_quantiles: Dict[Tuple[str, str], DailyQuantiles] = {}
+
+
+def get_quantiles(table: str, token: str) -> DailyQuantiles:
+    key = (table, token)
+    sketches = _quantiles.get(key)
+    if sketches is None:
+        sketches = _quantiles[key] = DailyQuantiles(table, token)
+    return sketches
+
+
+async def load_quantiles(
+    session: AsyncSession,
+    table: str,
+    token: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    qs: Sequence[float] = (0.5, 0.9, 0.99),
+) -> Dict[str, Optional[List[float]]]:
+    """Quantile estimates per measure over a request's date range (all history without a start date)."""
+    sketches = get_quantiles(table, token)
+    end = date.fromisoformat(end_date) if end_date else utc_today()
+    if start_date:
+        start = date.fromisoformat(start_date)
+    else:
+        start = await get_rollup(table, token).first_day(session)
+        if start is None:
+            return {name: None for name in sketches.measures}
+    days = await sketches.range(session, start, end)
+    return {
+        name: quantiles(merge([d[name] for d in days]), qs, sketches.accuracy)
+        for name in sketches.measures
+    }
+
+
+_QUANTILE_CARDS = (("median", "میانه"), ("p90", "صدک ۹۰"), ("p99", "صدک ۹۹"))
+
+
+def quantile_kpis(estimates: Optional[List[float]], key: str, label: str, fmt: str) -> List[Dict]:
+    """Median/p90/p99 KPI cards of one measure, flagged as estimates within the sketch accuracy."""
+    return [
+        {
+            "key": f"{prefix}_{key}",
+            "label": f"{title} {label}",
+            "value": estimates[i] if estimates is not None else None,
+            "format": fmt,
+            "approximate": True,
+            "error_bound": settings.QUANTILE_SKETCH_ACCURACY,
+        }
+        for i, (prefix, title) in enumerate(_QUANTILE_CARDS)
+    ]
@@ -2,112 +2,110 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
 from app.logger import logger
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+from app.services.bucketing import averaged, load_buckets
+from app.services.candles import compute_candles
 from app.services.date_utils import build_date_filter
+from app.services.histogram import fetch_histogram
+from app.services.persian_format import bucket_labels
+from app.services.quantiles import load_quantiles, quantile_kpis
+from app.services.response_cache import cached
+from app.services.rollups import by_month, load_days, measure
 from app.services.token_utils import DEFAULT_TOKEN
 
 
+@cached("refunds.kpis", closed_is_final=False)
 async def get_kpis(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    quantiles: bool = False,
 ) -> Dict:
     try:
         df, params = build_date_filter(start_date, end_date)
         params["token"] = token
 
+        # One scan serves every card: the rows share the token and date filter
+        # and differ only by status, so each aggregate picks its own status with
+        # FILTER instead of re-reading the table once per card.
         result = await session.execute(
-            text(f"SELECT COUNT(*) AS total FROM pending_refunds WHERE status = '0' AND code = :token{df}"), params
-        )
-        total_completed = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COUNT(*) AS total FROM pending_refunds WHERE status = '1' AND code = :token{df}"), params
-        )
-        total_pending = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COALESCE(SUM(amount), 0) AS total FROM pending_refunds WHERE status = '1' AND code = :token{df}"), params
-        )
-        total_num_pending = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COALESCE(SUM(total_price), 0) AS total FROM pending_refunds WHERE status = '1' AND code = :token{df}"), params
-        )
-        pending_amount = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COALESCE(SUM(amount), 0) AS total FROM pending_refunds WHERE status = '0' AND code = :token{df}"), params
-        )
-        total_sold = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COALESCE(SUM(refund_price), 0) AS total FROM pending_refunds WHERE status = '0' AND code = :token{df}"), params
-        )
-        total_payout = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COALESCE(SUM(fee_price), 0) AS total FROM pending_refunds WHERE status = '0' AND code = :token{df}"), params
-        )
-        total_fees = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COALESCE(AVG(amount), 0) AS avg FROM pending_refunds WHERE status = '0' AND code = :token{df}"), params
-        )
-        avg_amount = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COUNT(DISTINCT public) AS total FROM pending_refunds WHERE status = '0' AND code = :token{df}"), params
+            text(f"""
+                SELECT
+                    COUNT(*) FILTER (WHERE status = '0') AS total_completed,
+                    COUNT(*) FILTER (WHERE status = '1') AS total_pending,
+                    COALESCE(SUM(amount) FILTER (WHERE status = '1'), 0) AS total_num_pending,
+                    COALESCE(SUM(total_price) FILTER (WHERE status = '1'), 0) AS pending_amount,
+                    COALESCE(SUM(amount) FILTER (WHERE status = '0'), 0) AS total_sold,
+                    COALESCE(SUM(refund_price) FILTER (WHERE status = '0'), 0) AS total_payout,
+                    COALESCE(SUM(fee_price) FILTER (WHERE status = '0'), 0) AS total_fees,
+                    COALESCE(AVG(amount) FILTER (WHERE status = '0'), 0) AS avg_amount,
+                    COUNT(DISTINCT public) FILTER (WHERE status = '0') AS unique_sellers
+                FROM pending_refunds
+                WHERE status IN ('0', '1') AND code = :token{df}
+            """),
+            params,
         )
-        unique_sellers = result.scalar() or 0
+        row = result.one()
+        total_completed = row.total_completed or 0
+        total_pending = row.total_pending or 0
+        total_num_pending = row.total_num_pending or 0
+        pending_amount = row.pending_amount or 0
+        total_sold = row.total_sold or 0
+        total_payout = row.total_payout or 0
+        total_fees = row.total_fees or 0
+        avg_amount = row.avg_amount or 0
+        unique_sellers = row.unique_sellers or 0
 
         # Every label carries the selected token, so a card is never ambiguous
         # once it has been read out of context (or exported / screenshotted).
-        return {
-            "kpis": [
-                {"key": "total_completed", "label": f"تعداد بازخریدهای تکمیل شده ({token})", "value": int(total_completed), "format": "number"},
-                {"key": "total_pending", "label": f"تعداد بازخریدهای در انتظار ({token})", "value": int(total_pending), "format": "number"},
-                {"key": "total_num_pmn_pending", "label": f"حجم کل در انتظار بازخرید ({token})", "value": int(total_num_pending), "format": "number"},
-                {"key": "pending_amount", "label": f"مجموع ریالی بازخریدهای در انتظار ({token})", "value": int(pending_amount), "format": "rial"},
-                {"key": "total_sold", "label": f"حجم کل بازخرید شده ({token})", "value": float(total_sold), "format": "number"},
-                {"key": "total_payout", "label": f"مجموع بازخرید به ریال ({token})", "value": int(total_payout), "format": "rial"},
-                {"key": "total_fees", "label": f"مجموع کارمزد ({token})", "value": int(total_fees), "format": "rial"},
-                {"key": "avg_amount", "label": f"میانگین مقدار بازخرید ({token})", "value": float(avg_amount), "format": "decimal"},
-                {"key": "unique_sellers", "label": f"تعداد بازخریدکنندگان منحصر به فرد ({token})", "value": int(unique_sellers), "format": "number"},
-            ]
-        }
+        kpis = [
+            {"key": "total_completed", "label": f"تعداد بازخریدهای تکمیل شده ({token})", "value": int(total_completed), "format": "number"},
+            {"key": "total_pending", "label": f"تعداد بازخریدهای در انتظار ({token})", "value": int(total_pending), "format": "number"},
+            {"key": "total_num_pmn_pending", "label": f"حجم کل در انتظار بازخرید ({token})", "value": int(total_num_pending), "format": "number"},
+            {"key": "pending_amount", "label": f"مجموع ریالی بازخریدهای در انتظار ({token})", "value": int(pending_amount), "format": "rial"},
+            {"key": "total_sold", "label": f"حجم کل بازخرید شده ({token})", "value": float(total_sold), "format": "number"},
+            {"key": "total_payout", "label": f"مجموع بازخرید به ریال ({token})", "value": int(total_payout), "format": "rial"},
+            {"key": "total_fees", "label": f"مجموع کارمزد ({token})", "value": int(total_fees), "format": "rial"},
+            {"key": "avg_amount", "label": f"میانگین مقدار بازخرید ({token})", "value": float(avg_amount), "format": "decimal"},
+        ]
+
+        # Whale refunds pull the average up; the quantiles come from per-day sketches.
+        if quantiles:
+            estimates = await load_quantiles(session, "pending_refunds", token, start_date, end_date)
+            kpis += quantile_kpis(estimates["amount"], "amount", f"مقدار بازخرید ({token})", "decimal")
+            kpis += quantile_kpis(estimates["refund_price"], "refund_price", f"مبلغ بازخرید به ریال ({token})", "rial")
+
+        kpis.append({"key": "unique_sellers", "label": f"تعداد بازخریدکنندگان منحصر به فرد ({token})", "value": int(unique_sellers), "format": "number"})
+
+        return {"kpis": kpis}
 
     except Exception as e:
         logger.error(f"Database error in refunds_service.get_kpis: {e}")
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("refunds.daily-count", closed_is_final=False)
 async def get_daily_count(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    granularity: Optional[str] = None,
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-        time_filter = df if df else " AND created_at >= NOW() - INTERVAL '12 months'"
+        if granularity:
+            buckets = await load_buckets(session, "pending_refunds", token, start_date, end_date, granularity, default_months=12)
+            return {"series": [{"date": label, "value": int(m["count"])} for label, m in buckets]}
 
-        result = await session.execute(
-            text(f"""
-                SELECT DATE(created_at) AS day, COUNT(*) AS count
-                FROM pending_refunds
-                WHERE status = '0' AND code = :token{time_filter}
-                GROUP BY DATE(created_at)
-                ORDER BY day
-            """),
-            params,
-        )
-        rows = result.fetchall()
+        days = await load_days(session, "pending_refunds", token, start_date, end_date, default_months=12)
 
         return {
-            "series": [{"date": str(row.day), "value": int(row.count)} for row in rows]
+            "series": [
+                {"date": str(day), "value": int(measure(r, "count"))}
+                for day, r in sorted(days.items())
+                if measure(r, "count")
+            ]
         }
 
     except Exception as e:
@@ -115,75 +113,71 @@ async def get_daily_count(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("refunds.monthly-trend", closed_is_final=False)
 async def get_monthly_trend(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    granularity: Optional[str] = None,
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-
-        result = await session.execute(
-            text(f"""
-                SELECT
-                    DATE_TRUNC('month', created_at) AS month,
-                    COUNT(*) AS count,
-                    COALESCE(SUM(amount), 0) AS total_amount,
-                    COALESCE(SUM(refund_price), 0) AS total_rials
-                FROM pending_refunds
-                WHERE status = '0' AND code = :token{df}
-                GROUP BY DATE_TRUNC('month', created_at)
-                ORDER BY month
-            """),
-            params,
-        )
-        rows = result.fetchall()
-
-        return {
-            "series": [
-                {
-                    "date": str(row.month.date()),
-                    "value": int(row.count),
-                    "count": int(row.count),
-                    "total_amount": float(row.total_amount),
-                    "total_rials": float(row.total_rials),
-                }
-                for row in rows
-            ]
-        }
+        if granularity:
+            buckets = await load_buckets(session, "pending_refunds", token, start_date, end_date, granularity)
+            return {
+                "series": [
+                    {"date": label, "value": int(m["count"]), "count": int(m["count"]),
+                     "total_amount": m["amount"], "total_rials": m["refund_price"]}
+                    for label, m in buckets
+                ]
+            }
+
+        months = by_month(await load_days(session, "pending_refunds", token, start_date, end_date))
+
+        series = []
+        for month, days in months.items():
+            count = sum(measure(r, "count") for r in days)
+            if count:
+                series.append({
+                    "date": str(month),
+                    "value": int(count),
+                    "count": int(count),
+                    "total_amount": sum(measure(r, "amount") for r in days),
+                    "total_rials": sum(measure(r, "refund_price") for r in days),
+                })
+        return {"series": series}
 
     except Exception as e:
         logger.error(f"Database error in refunds_service.get_monthly_trend: {e}")
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("refunds.rate-trend", closed_is_final=False)
 async def get_rate_trend(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    granularity: Optional[str] = None,
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-        time_filter = df if df else " AND created_at >= NOW() - INTERVAL '12 months'"
+        if granularity:
+            buckets = await load_buckets(session, "pending_refunds", token, start_date, end_date, granularity, default_months=12)
+            return {
+                "series": [
+                    {"date": label, "value": value, "count": count}
+                    for label, value, count in averaged(buckets, "rate_sum", "rate_count")
+                ]
+            }
 
-        result = await session.execute(
-            text(f"""
-                SELECT DATE(created_at) AS day, AVG(refund_rate) AS avg_rate
-                FROM pending_refunds
-                WHERE status = '0' AND code = :token AND refund_rate > 0{time_filter}
-                GROUP BY DATE(created_at)
-                ORDER BY day
-            """),
-            params,
-        )
-        rows = result.fetchall()
+        days = await load_days(session, "pending_refunds", token, start_date, end_date, default_months=12)
 
         return {
-            "series": [{"date": str(row.day), "value": float(row.avg_rate)} for row in rows]
+            "series": [
+                {"date": str(day), "value": measure(r, "rate_sum") / measure(r, "rate_count")}
+                for day, r in sorted(days.items())
+                if measure(r, "rate_count")
+            ]
         }
 
     except Exception as e:
@@ -191,52 +185,29 @@ async def get_rate_trend(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("refunds.rate-candlestick", closed_is_final=False)
 async def get_rate_candlestick(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    interval: str = "1d",
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-        time_filter = df if df else " AND created_at >= NOW() - INTERVAL '12 months'"
-
-        result = await session.execute(
-            text(f"""
-                SELECT
-                    DATE(created_at) AS day,
-                    (ARRAY_AGG(refund_rate ORDER BY created_at ASC))[1] AS open,
-                    (ARRAY_AGG(refund_rate ORDER BY created_at DESC))[1] AS close,
-                    MIN(refund_rate) AS low,
-                    MAX(refund_rate) AS high
-                FROM pending_refunds
-                WHERE status IN ('0', '1') AND code = :token AND refund_rate > 0{time_filter}
-                GROUP BY DATE(created_at)
-                ORDER BY day
-            """),
-            params,
-        )
-        rows = result.fetchall()
-
-        return {
-            "series": [
-                {
-                    "date": str(row.day),
-                    "open": float(row.open),
-                    "close": float(row.close),
-                    "low": float(row.low),
-                    "high": float(row.high),
-                }
-                for row in rows
-            ]
-        }
+        return {"series": await compute_candles(session, "refund", interval, start_date, end_date, token)}
 
     except Exception as e:
         logger.error(f"Database error in refunds_service.get_rate_candlestick: {e}")
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+_REFUND_STATUS_LABELS = {
+    "0": "تکمیل شده (پرداخت شده)",
+    "1": "در انتظار",
+}
+
+
+@cached("refunds.status-distribution", closed_is_final=False)
 async def get_status_distribution(
     session: AsyncSession,
     start_date: Optional[str] = None,
@@ -244,30 +215,14 @@ async def get_status_distribution(
     token: str = DEFAULT_TOKEN,
 ) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-
-        result = await session.execute(
-            text(f"""
-                SELECT
-                    status,
-                    CASE
-                        WHEN status = '0' THEN 'تکمیل شده (پرداخت شده)'
-                        WHEN status = '1' THEN 'در انتظار'
-                        ELSE status
-                    END AS status_label,
-                    COUNT(*) AS count
-                FROM pending_refunds
-                WHERE code = :token AND status IN ('0', '1'){df}
-                GROUP BY status
-                ORDER BY status
-            """),
-            params,
-        )
-        rows = result.fetchall()
+        days = await load_days(session, "pending_refunds", token, start_date, end_date)
 
         return {
-            "data": [{"name": row.status_label, "value": int(row.count)} for row in rows]
+            "data": [
+                {"name": label, "value": int(count)}
+                for status, label in _REFUND_STATUS_LABELS.items()
+                if (count := sum(measure(r, "count", (status,)) for r in days.values()))
+            ]
         }
 
     except Exception as e:
@@ -275,6 +230,7 @@ async def get_status_distribution(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("refunds.by-bank", closed_is_final=False)
 async def get_by_bank(
     session: AsyncSession,
     start_date: Optional[str] = None,
@@ -310,38 +266,44 @@ async def get_by_bank(
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+# Upper bounds of the default buckets (right-inclusive, last one open-ended).
+AMOUNT_EDGES = (10, 100, 1000, 10000)
+
+
+@cached("refunds.amount-distribution", closed_is_final=False)
 async def get_amount_distribution(
     session: AsyncSession,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     token: str = DEFAULT_TOKEN,
+    strategy: str = "edges",
+    edges: Optional[Tuple[float, ...]] = None,
+    bins: int = 5,
 ) -> Dict:
     try:
         df, params = build_date_filter(start_date, end_date)
         params["token"] = token
 
-        result = await session.execute(
-            text(f"""
-                SELECT
-                    CASE
-                        WHEN amount <= 10 THEN '۰-۱۰'
-                        WHEN amount <= 100 THEN '۱۰-۱۰۰'
-                        WHEN amount <= 1000 THEN '۱۰۰-۱٬۰۰۰'
-                        WHEN amount <= 10000 THEN '۱٬۰۰۰-۱۰٬۰۰۰'
-                        ELSE '۱۰٬۰۰۰+'
-                    END AS bucket,
-                    COUNT(*) AS count
+        hist = await fetch_histogram(
+            session,
+            f"""
+                SELECT amount::float8 AS value
                 FROM pending_refunds
-                WHERE status = '0' AND code = :token{df}
-                GROUP BY bucket
-                ORDER BY MIN(amount)
-            """),
+                WHERE status = '0' AND code = :token AND amount IS NOT NULL{df}
+            """,
             params,
+            strategy,
+            edges or AMOUNT_EDGES,
+            bins,
         )
-        rows = result.fetchall()
 
         return {
-            "data": [{"name": row.bucket, "value": int(row.count)} for row in rows]
+            "data": [
+                {"name": label, "value": count}
+                for label, count in zip(bucket_labels(hist.edges), hist.counts)
+                if count
+            ],
+            "percentiles": hist.percentiles,
         }
 
     except Exception as e:
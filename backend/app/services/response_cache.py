@@ -0,0 +1,244 @@
+"""
+In-process response cache for the analytics service functions.
+
+Results are keyed on the endpoint name plus every argument except the session —
+for the standard endpoints that is (endpoint, start_date, end_date, token).
+A range that ends before the first open day (`date_utils.is_closed_range`) can
+no longer change and is kept for CACHE_TTL_CLOSED_SECONDS; anything that
+reaches today, or has no end date, only for CACHE_TTL_OPEN_SECONDS. Endpoints
+that read pending_refunds opt out with `closed_is_final=False`: a refund is
+paid long after the day it was created on, so their closed days still change
+and every range gets the open TTL. The cache is LRU-bounded to CACHE_MAX_ENTRIES per worker process.
+
+Each worker holds its own cache, so invalidations are shared through an
+append-only log in DATA_DIR (`InvalidationLog`): `invalidate` appends the
+request, and every worker replays the lines it has not seen yet before its
+next lookup. Checking the log costs one stat() per lookup.
+
+On a miss the call goes through `single_flight.flights`: concurrent callers
+with the same key share one execution, which runs on its own session so that
+no caller's request-scoped session is used from another request's task.
+
+Only successful results are stored; an HTTPException passes straight through.
+Cached payloads are shared between requests and must not be mutated.
+"""
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.logger import logger
+from app.services.date_utils import is_closed_range
+from app.services.single_flight import flights
+import inspect
+import json
+import os
+import time
+
+MISSING = object()
+
+
+class TTLCache:
+    """LRU cache with a per-entry TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """The cached value, or `MISSING` when absent or expired."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """Drop every entry (or those whose key matches `predicate`); returns how many."""
+        if predicate is None:
+            dropped = len(self._entries)
+            self._entries.clear()
+            return dropped
+        doomed = [key for key in self._entries if predicate(key)]
+        for key in doomed:
+            del self._entries[key]
+        return len(doomed)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class InvalidationLog:
+    """
+    Invalidations shared by every worker through an append-only file.
+
+    Lines are `[endpoint, token]` JSON arrays, appended with O_APPEND so
+    writers from several workers never interleave. A worker starts reading at
+    the size the file had when it started: its cache was empty before then.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._offset = self._size()
+
+    def _size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def publish(self, endpoint: Optional[str], token: Optional[str]) -> None:
+        line = json.dumps([endpoint, token]) + "\n"
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    def unseen(self) -> List[Tuple[Optional[str], Optional[str]]]:
+        """Invalidations appended since the last call, oldest first."""
+        size = self._size()
+        if size == self._offset:
+            return []
+        if size < self._offset:
+            # Truncated or removed: what it held is unknown, so drop everything.
+            self._offset = size
+            return [(None, None)]
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+        # Leave a line that is still being written for the next call.
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        return [tuple(json.loads(line)) for line in complete.splitlines()]
+
+
+response_cache = TTLCache(settings.CACHE_MAX_ENTRIES)
+invalidation_log = InvalidationLog(os.path.join(settings.DATA_DIR, "response_cache", "invalidations.log"))
+# endpoint -> index of its `token` argument in the cache key
+_token_positions: Dict[str, int] = {}
+
+
+def ttl_for(end_date: Optional[str], closed_is_final: bool = True) -> int:
+    """Long TTL for ranges that are already closed, short for ones that include today."""
+    if closed_is_final and is_closed_range(end_date):
+        return settings.CACHE_TTL_CLOSED_SECONDS
+    return settings.CACHE_TTL_OPEN_SECONDS
+
+
+def cached(endpoint: str, closed_is_final: bool = True):
+    """
+    Cache and coalesce a service function `fn(session, ...)` under `endpoint`.
+
+    The key is `(endpoint, *arguments)` with defaults applied, so calls that
+    differ only in whether a default was spelled out share an entry. Pass
+    `closed_is_final=False` when a closed range can still change.
+    """
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        names = [name for name in signature.parameters if name != "session"]
+        if "token" in names:
+            _token_positions[endpoint] = 1 + names.index("token")
+
+        @wraps(fn)
+        async def wrapper(session, *args, **kwargs):
+            if not settings.CACHE_ENABLED and not settings.SINGLE_FLIGHT_ENABLED:
+                return await fn(session, *args, **kwargs)
+
+            bound = signature.bind(session, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            arguments.pop("session", None)
+            key = (endpoint, *arguments.values())
+
+            if settings.CACHE_ENABLED:
+                sync_invalidations()
+                value = response_cache.get(key)
+                if value is not MISSING:
+                    return value
+
+            if settings.SINGLE_FLIGHT_ENABLED:
+                async def run():
+                    async with AsyncSessionLocal() as own_session:
+                        return await fn(own_session, **arguments)
+
+                value = await flights.do(key, run)
+            else:
+                value = await fn(session, *args, **kwargs)
+
+            if settings.CACHE_ENABLED:
+                response_cache.set(key, value, ttl_for(arguments.get("end_date"), closed_is_final))
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def _drop(endpoint: Optional[str], token: Optional[str]) -> int:
+    """Drop this worker's entries matching `endpoint` (prefix) and `token`."""
+    if endpoint is None and token is None:
+        return response_cache.invalidate()
+
+    def matches(key: Tuple) -> bool:
+        if endpoint is not None and not key[0].startswith(endpoint):
+            return False
+        if token is None:
+            return True
+        # Only the token argument counts, not another argument that happens
+        # to hold the same string.
+        position = _token_positions.get(key[0])
+        return position is not None and position < len(key) and key[position] == token
+
+    return response_cache.invalidate(matches)
+
+
+def sync_invalidations() -> int:
+    """Apply the invalidations other workers (or this one) logged since the last check."""
+    try:
+        pending = invalidation_log.unseen()
+    except OSError as e:
+        logger.warning(f"Cannot read the cache invalidation log: {e}")
+        return 0
+    return sum(_drop(endpoint, token) for endpoint, token in pending)
+
+
+def invalidate(endpoint: Optional[str] = None, token: Optional[str] = None) -> int:
+    """
+    Drop cached responses in every worker. `endpoint` matches by prefix
+    ("buys." clears the whole buys router, "buys.kpis" one endpoint); `token`
+    limits the drop to entries computed for that token.
+
+    Returns how many entries this worker dropped; the others drop theirs
+    before their next lookup.
+    """
+    try:
+        invalidation_log.publish(endpoint, token)
+    except OSError as e:
+        logger.warning(f"Cannot write the cache invalidation log, invalidating this worker only: {e}")
+        return _drop(endpoint, token)
+    return sync_invalidations()
@@ -0,0 +1,254 @@
+"""
+Daily rollups of `pending_txes` and `pending_refunds`.
+
+For every (token, day, status) a rollup keeps the row count and the sums the
+charts need, so daily and monthly endpoints add up a few hundred small records
+instead of re-aggregating the raw table:
+
+    pending_txes     count, amount, price, rate_sum/rate_count (exchange_rate > 0)
+    pending_refunds  count, amount, refund_price, fee_price, total_price,
+                     rate_sum/rate_count (refund_rate > 0)
+
+Closed days (before `date_utils.first_open_day`) are aggregated once per
+worker, in a single GROUP BY over the missing span, and then served from
+memory; open days are always aggregated live and merged in. Days are
+`DATE(created_at)`, exactly as the old per-request queries grouped them.
+
+A closed day can still change when a row's status does — a pending refund that
+gets paid moves from status '1' to '0'. Tables with a change timestamp
+(`pending_refunds.updated_at`) are checked for rows touched since the last
+check — at most once every CHANGE_POLL_SECONDS per tracker, through the index
+of migrations/003_refund_change_index.sql — and only the days those rows
+belong to are re-aggregated. Rows never updated have a NULL `updated_at` and
+count as changed at `created_at`.
+`pending_txes` has no such column; its statuses are treated as final once a day
+has closed, like the fee ledger does.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.config import settings
+from app.logger import logger
+from app.services.date_utils import first_open_day, utc_today
+import asyncio
+import time
+
+# measures per status of one day: {"count": 12.0, "amount": 340.5, ...}
+DayRollup = Dict[Optional[str], Dict[str, float]]
+
+_TABLES = {
+    "pending_txes": {
+        "measures": {
+            "count": "COUNT(*)",
+            "amount": "COALESCE(SUM(amount), 0)",
+            "price": "COALESCE(SUM(price), 0)",
+            "rate_sum": "COALESCE(SUM(exchange_rate) FILTER (WHERE exchange_rate > 0), 0)",
+            "rate_count": "COUNT(*) FILTER (WHERE exchange_rate > 0)",
+        },
+        "changed_column": None,
+    },
+    "pending_refunds": {
+        "measures": {
+            "count": "COUNT(*)",
+            "amount": "COALESCE(SUM(amount), 0)",
+            "refund_price": "COALESCE(SUM(refund_price), 0)",
+            "fee_price": "COALESCE(SUM(fee_price), 0)",
+            "total_price": "COALESCE(SUM(total_price), 0)",
+            "rate_sum": "COALESCE(SUM(refund_rate) FILTER (WHERE refund_rate > 0), 0)",
+            "rate_count": "COUNT(*) FILTER (WHERE refund_rate > 0)",
+        },
+        "changed_column": "COALESCE(updated_at, created_at)",
+    },
+}
+
+
+def _days(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def months_ago(day: date, months: int) -> date:
+    """Same day-of-month `months` earlier, clamped to the month's length."""
+    month_index = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    for dom in range(day.day, 0, -1):
+        try:
+            return date(year, month, dom)
+        except ValueError:
+            continue
+    raise ValueError(day)
+
+
+class ChangedDays:
+    """
+    Closed days of one table/token whose rows were modified since the last poll.
+
+    Tracks a watermark on the table's change column (an SQL expression); the
+    first poll only sets it, since nothing derived from the table can be older
+    than that. Polls within CHANGE_POLL_SECONDS of the last one that reached
+    the database return no days; the changes are picked up by the next one.
+    """
+
+    def __init__(self, table: str, token: str, column: str):
+        self.table = table
+        self.token = token
+        self.column = column
+        self._watermark: Optional[datetime] = None
+        self._next_poll = 0.0
+
+    async def poll(self, session: AsyncSession) -> List[date]:
+        now = time.monotonic()
+        if now < self._next_poll:
+            return []
+        col = self.column
+        if self._watermark is None:
+            result = await session.execute(
+                text(f"SELECT MAX({col}) FROM {self.table} WHERE code = :token"), {"token": self.token}
+            )
+            self._watermark = result.scalar() or datetime.min
+            self._next_poll = now + settings.CHANGE_POLL_SECONDS
+            return []
+        result = await session.execute(
+            text(f"""
+                SELECT DATE(created_at) AS day, MAX({col}) AS changed
+                FROM {self.table}
+                WHERE code = :token AND {col} > :since
+                GROUP BY DATE(created_at)
+            """),
+            {"token": self.token, "since": self._watermark},
+        )
+        rows = result.fetchall()
+        self._next_poll = now + settings.CHANGE_POLL_SECONDS
+        for row in rows:
+            self._watermark = max(self._watermark, row.changed)
+        if rows:
+            logger.info(f"{self.table}/{self.token}: {len(rows)} closed day(s) changed since the last check")
+        return [row.day for row in rows]
+
+
+def changed_days(table: str, token: str) -> Optional[ChangedDays]:
+    """A change tracker for `table`, or None when its closed days are final."""
+    column = _TABLES[table]["changed_column"]
+    return ChangedDays(table, token, column) if column else None
+
+
+class DailyRollup:
+    """In-process per-day rollup of one table for one token."""
+
+    def __init__(self, table: str, token: str):
+        spec = _TABLES[table]
+        self.table = table
+        self.token = token
+        self.measures: Dict[str, str] = spec["measures"]
+        self._changes = changed_days(table, token)
+        self._closed: Dict[date, DayRollup] = {}
+        self._first_day: Optional[date] = None
+        self._lock = asyncio.Lock()
+
+    async def _aggregate(self, session: AsyncSession, start: date, end: date) -> Dict[date, DayRollup]:
+        select = ",\n".join(f"{expr} AS {name}" for name, expr in self.measures.items())
+        result = await session.execute(
+            text(f"""
+                SELECT DATE(created_at) AS day, status, {select}
+                FROM {self.table}
+                WHERE code = :token AND created_at >= :start AND created_at < :end
+                GROUP BY DATE(created_at), status
+            """),
+            {"token": self.token, "start": start, "end": end + timedelta(days=1)},
+        )
+        days: Dict[date, DayRollup] = {}
+        for row in result.fetchall():
+            days.setdefault(row.day, {})[row.status] = {
+                name: float(getattr(row, name) or 0) for name in self.measures
+            }
+        return days
+
+    async def first_day(self, session: AsyncSession) -> Optional[date]:
+        if self._first_day is None:
+            result = await session.execute(
+                text(f"SELECT MIN(created_at) FROM {self.table} WHERE code = :token"), {"token": self.token}
+            )
+            first = result.scalar()
+            self._first_day = first.date() if first is not None else None
+        return self._first_day
+
+    async def days(self, session: AsyncSession, start: date, end: date) -> Dict[date, DayRollup]:
+        """Rollups of every day in [start, end] that has rows."""
+        if start > end:
+            return {}
+        first_open = first_open_day()
+        closed_end = min(end, first_open - timedelta(days=1))
+
+        out: Dict[date, DayRollup] = {}
+        if start <= closed_end:
+            async with self._lock:
+                if self._changes is not None:
+                    for d in await self._changes.poll(session):
+                        self._closed.pop(d, None)
+                missing = [d for d in _days(start, closed_end) if d not in self._closed]
+                if missing:
+                    filled = await self._aggregate(session, missing[0], missing[-1])
+                    for d in _days(missing[0], missing[-1]):
+                        self._closed[d] = filled.get(d, {})
+                for d in _days(start, closed_end):
+                    if self._closed[d]:
+                        out[d] = self._closed[d]
+
+        open_start = max(start, first_open)
+        if open_start <= end:
+            out.update(await self._aggregate(session, open_start, end))
+        return out
+
+
+_rollups: Dict[Tuple[str, str], DailyRollup] = {}
+
+
+def get_rollup(table: str, token: str) -> DailyRollup:
+    key = (table, token)
+    rollup = _rollups.get(key)
+    if rollup is None:
+        rollup = _rollups[key] = DailyRollup(table, token)
+    return rollup
+
+
+async def load_days(
+    session: AsyncSession,
+    table: str,
+    token: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    default_months: Optional[int] = None,
+) -> Dict[date, DayRollup]:
+    """
+    Day rollups for the request's date range.
+
+    Without either date the range starts `default_months` before today when
+    given (the daily charts' trailing window); otherwise a missing
+    `start_date` means the first row, as an end-date-only filter always has.
+    """
+    rollup = get_rollup(table, token)
+    today = utc_today()
+    end = date.fromisoformat(end_date) if end_date else today
+    if start_date:
+        start = date.fromisoformat(start_date)
+    elif default_months is not None and not end_date:
+        start = months_ago(today, default_months)
+    else:
+        start = await rollup.first_day(session)
+        if start is None:
+            return {}
+    return await rollup.days(session, start, end)
+
+
+def measure(day: DayRollup, name: str, statuses: Iterable[str] = ("0",)) -> float:
+    """Sum of one measure over the given statuses of a day."""
+    return sum(day[s][name] for s in statuses if s in day)
+
+
+def by_month(days: Dict[date, DayRollup]) -> Dict[date, List[DayRollup]]:
+    """Group day rollups under the first day of their month, in order."""
+    months: Dict[date, List[DayRollup]] = {}
+    for d in sorted(days):
+        months.setdefault(d.replace(day=1), []).append(days[d])
+    return months
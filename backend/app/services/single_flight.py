@@ -0,0 +1,52 @@
+"""
+Single-flight: concurrent identical calls share one in-flight execution.
+
+The first caller for a key starts the work as a task; everyone who arrives
+with the same key while it is running awaits that same task instead of taking
+another pooled connection and re-running the query. The task is shielded, so
+a leader whose request is cancelled (client closed the tab) does not cancel
+the work the followers are waiting on.
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls per key and counts how many were collapsed."""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Task"] = {}
+        self.executed = 0
+        self.collapsed = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.collapsed += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(factory())
+        self._inflight[key] = task
+        self.executed += 1
+        task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: "asyncio.Task") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception retrieved: if every waiter was cancelled nobody
+        # else will, and asyncio would log it as "never retrieved".
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        calls = self.executed + self.collapsed
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "collapsed": self.collapsed,
+            "collapse_ratio": round(self.collapsed / calls, 4) if calls else None,
+        }
+
+
+flights = SingleFlight()
@@ -2,52 +2,65 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
 from app.logger import logger
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from datetime import date, timedelta
+from decimal import Decimal
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.services import hll
 from app.services.date_utils import build_date_filter
+from app.services.histogram import fetch_histogram
+from app.services.persian_format import bucket_labels
+from app.services.hll import load_sketches
+from app.services.response_cache import MISSING, TTLCache, cached
+from app.services.rollups import by_month, load_days, measure
 from app.services.token_utils import DEFAULT_TOKEN, SUPPORTED_TOKENS
-
-
+from app.services.identity_names import resolve_names
+from app.services.leaderboard import load_top
+from app.services.parallel import gather_queries
+from app.services.wallet_index import count_per_month, get_activity, get_first_seen
+import base64
+import numpy as np
+import csv
+import io
+import json
+
+
+@cached("users.kpis", closed_is_final=False)
 async def get_kpis(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
-                   token: str = DEFAULT_TOKEN) -> Dict:
+                   token: str = DEFAULT_TOKEN, approx: bool = False) -> Dict:
+    if approx:
+        return await _approx_kpis(session, start_date, end_date, token)
     try:
         df, params = build_date_filter(start_date, end_date)
         params["token"] = token
 
+        # Each side's distinct wallets are built once and full-outer-joined:
+        # a row per wallet that bought, sold or both, with NULL on the side it
+        # is missing from. All four cards are counts over that one set.
         result = await session.execute(
             text(f"""
-                SELECT COUNT(DISTINCT wallet) AS total_users FROM (
-                    SELECT public_key AS wallet FROM pending_txes WHERE code = :token AND status = '0'{df}
-                    UNION
-                    SELECT public AS wallet FROM pending_refunds WHERE code = :token AND status = '0'{df}
-                ) AS all_users
-            """),
-            params,
-        )
-        total_users = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"""
-                SELECT COUNT(*) AS both_side_users FROM (
-                    SELECT public_key AS wallet FROM pending_txes WHERE code = :token AND status = '0'{df}
-                    INTERSECT
-                    SELECT public AS wallet FROM pending_refunds WHERE code = :token AND status = '0'{df}
-                ) AS combined_users
+                SELECT
+                    COUNT(*) AS total_users,
+                    COUNT(b.wallet) AS buyers,
+                    COUNT(s.wallet) AS sellers,
+                    COUNT(*) FILTER (WHERE b.wallet IS NOT NULL AND s.wallet IS NOT NULL) AS both_side_users
+                FROM (
+                    SELECT DISTINCT public_key AS wallet FROM pending_txes
+                    WHERE code = :token AND status = '0' AND public_key IS NOT NULL{df}
+                ) b
+                FULL OUTER JOIN (
+                    SELECT DISTINCT public AS wallet FROM pending_refunds
+                    WHERE code = :token AND status = '0' AND public IS NOT NULL{df}
+                ) s ON s.wallet = b.wallet
             """),
             params,
         )
-        both_side = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COUNT(DISTINCT public_key) FROM pending_txes WHERE code = :token AND status = '0'{df}"),
-            params,
-        )
-        buyers = result.scalar() or 0
-
-        result = await session.execute(
-            text(f"SELECT COUNT(DISTINCT public) FROM pending_refunds WHERE code = :token AND status = '0'{df}"),
-            params,
-        )
-        sellers = result.scalar() or 0
+        row = result.one()
+        total_users = row.total_users or 0
+        buyers = row.buyers or 0
+        sellers = row.sellers or 0
+        both_side = row.both_side_users or 0
 
         # The four numbers form a self-checking set:
         #   buyers + sellers - both_side == total_users
@@ -69,31 +82,63 @@ async def get_kpis(session: AsyncSession, start_date: Optional[str] = None, end_
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
-async def get_new_per_month(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
-                   token: str = DEFAULT_TOKEN) -> Dict:
+async def _approx_kpis(session: AsyncSession, start_date: Optional[str], end_date: Optional[str],
+                       token: str) -> Dict:
+    """get_kpis from merged HyperLogLog day sketches; each value carries its error bound."""
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
+        precision = settings.HLL_PRECISION
+        buy_days = await load_sketches(session, "pending_txes", token, start_date, end_date)
+        sell_days = await load_sketches(session, "pending_refunds", token, start_date, end_date)
+        buy_set = hll.merge(buy_days.values(), precision)
+        sell_set = hll.merge(sell_days.values(), precision)
+
+        buyers = hll.estimate(buy_set)
+        sellers = hll.estimate(sell_set)
+        total_users = hll.estimate(np.maximum(buy_set, sell_set))
+        # Inclusion-exclusion: the intersection inherits the absolute error of
+        # all three estimates, so its relative bound is reported separately.
+        both_side = max(buyers + sellers - total_users, 0.0)
+
+        error = hll.relative_error(precision)
+        both_error = error * (buyers + sellers + total_users) / both_side if both_side else None
+
+        def card(key: str, label: str, value: float, bound: Optional[float]) -> Dict:
+            return {"key": key, "label": label, "value": int(round(value)), "format": "number",
+                    "approximate": True, "error_bound": round(bound, 4) if bound is not None else None}
 
-        result = await session.execute(
-            text(f"""
-                SELECT DATE_TRUNC('month', first_buy) AS month, COUNT(*) AS new_users
-                FROM (
-                    SELECT public_key, MIN(created_at) AS first_buy
-                    FROM pending_txes
-                    WHERE status = '0' AND code = :token
-                    GROUP BY public_key
-                ) AS first_purchases
-                WHERE 1=1{df.replace('created_at', 'first_buy')}
-                GROUP BY DATE_TRUNC('month', first_buy)
-                ORDER BY month
-            """),
-            params,
-        )
-        rows = result.fetchall()
+        return {
+            "kpis": [
+                card("total_users", f"تعداد کل کاربران منحصر به فرد ({token})", total_users, error),
+                card("total_buyers", f"تعداد خریداران ({token})", buyers, error),
+                card("total_sellers", f"تعداد فروشندگان ({token})", sellers, error),
+                card("both_side_users", f"کاربران دوطرفه ({token})", both_side, both_error),
+            ]
+        }
+
+    except Exception as e:
+        logger.error(f"Database error in users_service.get_kpis (approx): {e}")
+        raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
+
+
+@cached("users.new-per-month", closed_is_final=False)
+async def get_new_per_month(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                   token: str = DEFAULT_TOKEN, side: str = "buy") -> Dict:
+    """
+    Wallets per month of their first successful buy (or sell, `side="sell"`).
+
+    Served from the maintained first-seen index, so only the months inside the
+    range are counted however long the history is.
+    """
+    try:
+        index = await get_first_seen(session, token, side)
+        start = np.datetime64(date.fromisoformat(start_date), "us") if start_date else None
+        end = np.datetime64(date.fromisoformat(end_date) + timedelta(days=1), "us") if end_date else None
 
         return {
-            "series": [{"date": str(row.month.date()), "value": int(row.new_users)} for row in rows]
+            "series": [
+                {"date": month, "value": count}
+                for month, count in count_per_month(index.first_seen(side), start, end)
+            ]
         }
 
     except Exception as e:
@@ -101,130 +146,110 @@ async def get_new_per_month(session: AsyncSession, start_date: Optional[str] = N
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
-"""
-Top-10 wallets with the account holder's name attached.
+@cached("users.retention", closed_is_final=False)
+async def get_retention(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                        token: str = DEFAULT_TOKEN, side: str = "buy", max_months: int = 12) -> Dict:
+    """
+    Cohort retention grid: wallets by first active month × months since.
 
-Two things this SQL is careful about:
+    `start_date`/`end_date` select the cohorts; later activity of those
+    wallets counts regardless of the range.
+    """
+    try:
+        index = await get_activity(session, token, side)
+        start = int(np.datetime64(start_date[:7], "M").astype(np.int64)) if start_date else None
+        end = int(np.datetime64(end_date[:7], "M").astype(np.int64)) if end_date else None
+
+        cohorts = []
+        for cohort, retained in index.retention(side, start, end, max_months):
+            size = retained[0]
+            cohorts.append({
+                "cohort": cohort,
+                "size": size,
+                "retained": retained,
+                "rates": [round(count / size * 100, 2) for count in retained],
+            })
+        return {"side": side, "cohorts": cohorts}
 
-  * The ranking is computed in `top` and the identity tables are joined only
-    afterwards, with LEFT JOINs. An inner join would silently drop any wallet
-    that has no federation/identity record and quietly change the leaderboard.
-  * `federation.public` is not unique (8 duplicates at the time of writing), so
-    the join can fan out. `DISTINCT ON (wallet)` collapses it back, guaranteeing
-    exactly one row per wallet and never more than ten bars.
-"""
-_TOP_USERS_CTE = """
-WITH top AS (
-    SELECT {wallet_col} AS wallet, SUM(amount) AS total_amount, COUNT(*) AS tx_count
-    FROM {table}
-    WHERE status = '0' AND code = :token{date_filter}
-    GROUP BY {wallet_col}
-    ORDER BY total_amount DESC
-    LIMIT 10
-),
-named AS (
-    SELECT DISTINCT ON (t.wallet)
-           t.wallet, t.total_amount, t.tx_count, i.first_name, i.last_name
-    FROM top t
-    LEFT JOIN federation f ON f.public = t.wallet
-    LEFT JOIN kuknos_user ku ON ku.id = f.user_id
-    LEFT JOIN identity i ON i.national_id = ku.national_id
-    ORDER BY t.wallet, i.last_name NULLS LAST
-)
-"""
+    except Exception as e:
+        logger.error(f"Database error in users_service.get_retention: {e}")
+        raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
-def _top_user_to_dict(row) -> Dict:
-    full_name = " ".join(p for p in (row.first_name, row.last_name) if p).strip()
+def _top_user_to_dict(wallet: str, total_amount: float, tx_count: int, name: Optional[str]) -> Dict:
     return {
-        "wallet": row.wallet,
-        "total_amount": float(row.total_amount),
-        "tx_count": int(row.tx_count),
-        # None rather than "" so the frontend can fall back to the wallet
-        "name": full_name or None,
+        "wallet": wallet,
+        "total_amount": total_amount,
+        "tx_count": tx_count,
+        "name": name,
     }
 
 
-async def get_top_buyers(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
-                   token: str = DEFAULT_TOKEN) -> Dict:
-    try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
+async def _top_users(session: AsyncSession, table: str, start_date: Optional[str], end_date: Optional[str],
+                     token: str, limit: int) -> Dict:
+    """Top wallets by successful volume from the leaderboard, with cached display names."""
+    top = await load_top(session, table, token, start_date, end_date, limit)
+    names = await resolve_names(session, [wallet for wallet, _, _ in top])
+    return {"data": [_top_user_to_dict(wallet, total, count, names.get(wallet)) for wallet, total, count in top]}
 
-        result = await session.execute(
-            text(f"""
-                {_TOP_USERS_CTE.format(
-                    wallet_col="public_key", table="pending_txes", date_filter=df
-                )}
-                SELECT * FROM named ORDER BY total_amount DESC
-            """),
-            params,
-        )
-        rows = result.fetchall()
 
-        return {"data": [_top_user_to_dict(row) for row in rows]}
+@cached("users.top-buyers")
+async def get_top_buyers(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                   token: str = DEFAULT_TOKEN, limit: int = 10) -> Dict:
+    try:
+        return await _top_users(session, "pending_txes", start_date, end_date, token, limit)
 
     except Exception as e:
         logger.error(f"Database error in users_service.get_top_buyers: {e}")
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("users.top-sellers", closed_is_final=False)
 async def get_top_sellers(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
-                   token: str = DEFAULT_TOKEN) -> Dict:
+                   token: str = DEFAULT_TOKEN, limit: int = 10) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-
-        result = await session.execute(
-            text(f"""
-                {_TOP_USERS_CTE.format(
-                    wallet_col="public", table="pending_refunds", date_filter=df
-                )}
-                SELECT * FROM named ORDER BY total_amount DESC
-            """),
-            params,
-        )
-        rows = result.fetchall()
-
-        return {"data": [_top_user_to_dict(row) for row in rows]}
+        return await _top_users(session, "pending_refunds", start_date, end_date, token, limit)
 
     except Exception as e:
         logger.error(f"Database error in users_service.get_top_sellers: {e}")
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+# Upper bounds of the default buckets (right-inclusive, last one open-ended).
+ACTIVITY_EDGES = (1, 5, 20, 100)
+
+
+@cached("users.activity-distribution")
 async def get_activity_distribution(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
-                   token: str = DEFAULT_TOKEN) -> Dict:
+                   token: str = DEFAULT_TOKEN, strategy: str = "edges", edges: Optional[Tuple[float, ...]] = None,
+                   bins: int = 5) -> Dict:
+    """Wallets by their number of successful purchases in the range."""
     try:
         df, params = build_date_filter(start_date, end_date)
         params["token"] = token
 
-        result = await session.execute(
-            text(f"""
-                SELECT
-                    CASE
-                        WHEN tx_count = 1 THEN '۱'
-                        WHEN tx_count BETWEEN 2 AND 5 THEN '۲-۵'
-                        WHEN tx_count BETWEEN 6 AND 20 THEN '۶-۲۰'
-                        WHEN tx_count BETWEEN 21 AND 100 THEN '۲۱-۱۰۰'
-                        ELSE '۱۰۰+'
-                    END AS activity_bucket,
-                    COUNT(*) AS user_count
-                FROM (
-                    SELECT public_key, COUNT(*) AS tx_count
-                    FROM pending_txes
-                    WHERE status = '0' AND code = :token{df}
-                    GROUP BY public_key
-                ) AS user_activity
-                GROUP BY activity_bucket
-                ORDER BY MIN(tx_count)
-            """),
+        hist = await fetch_histogram(
+            session,
+            f"""
+                SELECT COUNT(*)::float8 AS value
+                FROM pending_txes
+                WHERE status = '0' AND code = :token{df}
+                GROUP BY public_key
+            """,
             params,
+            strategy,
+            edges or ACTIVITY_EDGES,
+            bins,
+            discrete=True,
         )
-        rows = result.fetchall()
 
         return {
-            "data": [{"name": row.activity_bucket, "value": int(row.user_count)} for row in rows]
+            "data": [
+                {"name": label, "value": count}
+                for label, count in zip(bucket_labels(hist.edges, lower=1, discrete=True), hist.counts)
+                if count
+            ],
+            "percentiles": hist.percentiles,
         }
 
     except Exception as e:
@@ -232,9 +257,24 @@ async def get_activity_distribution(session: AsyncSession, start_date: Optional[
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("users.monthly-active")
 async def get_monthly_active(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
-                   token: str = DEFAULT_TOKEN) -> Dict:
+                   token: str = DEFAULT_TOKEN, approx: bool = False) -> Dict:
     try:
+        if approx:
+            days = await load_sketches(session, "pending_txes", token, start_date, end_date)
+            months: Dict = {}
+            for day in sorted(days):
+                months.setdefault(day.replace(day=1), []).append(days[day])
+            return {
+                "series": [
+                    {"date": str(month), "value": int(round(hll.estimate(hll.merge(sketches, settings.HLL_PRECISION))))}
+                    for month, sketches in months.items()
+                ],
+                "approximate": True,
+                "error_bound": round(hll.relative_error(settings.HLL_PRECISION), 4),
+            }
+
         df, params = build_date_filter(start_date, end_date)
         params["token"] = token
 
@@ -259,44 +299,24 @@ async def get_monthly_active(session: AsyncSession, start_date: Optional[str] =
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
 
 
+@cached("users.buy-sell-comparison", closed_is_final=False)
 async def get_buy_sell_comparison(session: AsyncSession, start_date: Optional[str] = None, end_date: Optional[str] = None,
                    token: str = DEFAULT_TOKEN) -> Dict:
     try:
-        df, params = build_date_filter(start_date, end_date)
-        params["token"] = token
-
-        result = await session.execute(
-            text(f"""
-                SELECT
-                    COALESCE(b.month, s.month) AS month,
-                    COALESCE(b.buy_amount, 0) AS buy_amount,
-                    COALESCE(s.sell_amount, 0) AS sell_amount
-                FROM (
-                    SELECT DATE_TRUNC('month', created_at) AS month, SUM(amount) AS buy_amount
-                    FROM pending_txes WHERE status = '0' AND code = :token{df}
-                    GROUP BY month
-                ) b
-                FULL OUTER JOIN (
-                    SELECT DATE_TRUNC('month', created_at) AS month, SUM(amount) AS sell_amount
-                    FROM pending_refunds WHERE status = '0' AND code = :token{df}
-                    GROUP BY month
-                ) s ON b.month = s.month
-                ORDER BY month
-            """),
-            params,
-        )
-        rows = result.fetchall()
-
-        return {
-            "series": [
-                {
-                    "month": str(row.month.date()),
-                    "buy_amount": float(row.buy_amount) if row.buy_amount else 0,
-                    "sell_amount": float(row.sell_amount) if row.sell_amount else 0,
-                }
-                for row in rows
-            ]
-        }
+        buys = by_month(await load_days(session, "pending_txes", token, start_date, end_date))
+        sells = by_month(await load_days(session, "pending_refunds", token, start_date, end_date))
+
+        series = []
+        for month in sorted(set(buys) | set(sells)):
+            buy_days, sell_days = buys.get(month, []), sells.get(month, [])
+            if not any(measure(r, "count") for r in buy_days + sell_days):
+                continue
+            series.append({
+                "month": str(month),
+                "buy_amount": sum(measure(r, "amount") for r in buy_days),
+                "sell_amount": sum(measure(r, "amount") for r in sell_days),
+            })
+        return {"series": series}
 
     except Exception as e:
         logger.error(f"Database error in users_service.get_buy_sell_comparison: {e}")
@@ -314,8 +334,33 @@ PENDING_USERS_FILTERABLE_COLUMNS = {
     "mobile": "ku.mobile",
 }
 
+# How each filter matches, chosen so an index can serve it (see
+# backend/migrations/001_pending_user_search_indexes.sql):
+#   prefix    — `col::text LIKE 'v%'`, a B-tree `text_pattern_ops` range scan.
+#               For numeric-like identifiers, which are typed from the start.
+#   substring — `col::text ILIKE '%v%'`, served by a `pg_trgm` GIN index.
+PENDING_USERS_MATCH_MODES = {
+    "token": "prefix",
+    "public": "substring",
+    "national_id": "prefix",
+    "first_name": "substring",
+    "last_name": "substring",
+    "iban": "prefix",
+    "cardnumber": "prefix",
+    "mobile": "prefix",
+}
+
+# Prefix columns are stored upper-case (codes, IBANs) or as ASCII digits, so the
+# typed value is normalised the same way — including Persian/Arabic digits.
+_TO_ASCII_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
 PENDING_USERS_SELECT = """
     SELECT
+        pr.id,
         pr.code AS token,
         pr.public,
         i.national_id,
@@ -351,14 +396,60 @@ def _build_pending_filters(filters: Optional[Dict[str, str]]):
             if value and key in PENDING_USERS_FILTERABLE_COLUMNS:
                 col = PENDING_USERS_FILTERABLE_COLUMNS[key]
                 param_name = f"f_{key}"
-                where_clauses.append(f"{col}::text ILIKE :{param_name}")
-                params[param_name] = f"%{value}%"
+                value = value.strip()
+                if PENDING_USERS_MATCH_MODES[key] == "prefix":
+                    value = value.translate(_TO_ASCII_DIGITS).upper()
+                    where_clauses.append(f"{col}::text LIKE :{param_name}")
+                    params[param_name] = f"{_escape_like(value)}%"
+                else:
+                    where_clauses.append(f"{col}::text ILIKE :{param_name}")
+                    params[param_name] = f"%{_escape_like(value)}%"
     extra_where = ""
     if where_clauses:
         extra_where = " AND " + " AND ".join(where_clauses)
     return extra_where, params
 
 
+# refund_price can be NULL; NULLS LAST keeps those rows at the end, and pr.id
+# makes the order total so keyset pages neither skip nor repeat rows.
+PENDING_USERS_ORDER = "ORDER BY pr.refund_price DESC NULLS LAST, pr.id DESC"
+
+# Rows fetched from the server-side cursor per export chunk.
+EXPORT_CHUNK_ROWS = 2000
+
+# Totals per filter set: the COUNT over the four-table join is as expensive as
+# the page itself, and paging through one filter set must not repeat it.
+_pending_totals = TTLCache(max_entries=256)
+
+
+def _encode_cursor(row, page: int) -> str:
+    price = str(row.refund_price) if row.refund_price is not None else None
+    raw = json.dumps({"p": price, "i": row.id, "n": page}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[Optional[Decimal], int, int]:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        price = Decimal(raw["p"]) if raw["p"] is not None else None
+        return price, int(raw["i"]), int(raw["n"])
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        raise HTTPException(status_code=400, detail="نشانگر صفحه نامعتبر است")
+
+
+def _keyset_after(price: Optional[Decimal], row_id: int, params: Dict) -> str:
+    """WHERE fragment selecting the rows that follow (price, id) in PENDING_USERS_ORDER."""
+    params["cursor_id"] = row_id
+    if price is None:
+        return " AND pr.refund_price IS NULL AND pr.id < :cursor_id"
+    params["cursor_price"] = price
+    return (
+        " AND (pr.refund_price < :cursor_price"
+        " OR (pr.refund_price = :cursor_price AND pr.id < :cursor_id)"
+        " OR pr.refund_price IS NULL)"
+    )
+
+
 def _row_to_dict(row):
     return {
         "token": row.token,
@@ -380,36 +471,67 @@ async def get_pending_users(
     page: int = 1,
     page_size: int = 50,
     filters: Optional[Dict[str, str]] = None,
+    cursor: Optional[str] = None,
 ) -> Dict:
+    """
+    One page of the pending-refunds table.
+
+    With a `cursor` (the previous page's `next_cursor`) the page is found by
+    keyset on (refund_price, id), so page N costs the same as page 1; `page`
+    is then taken from the cursor. Without one, `page` is served by OFFSET.
+    """
+    # Decoded outside the try, so a bad cursor is a 400 rather than a 503.
+    after = _decode_cursor(cursor) if cursor else None
     try:
         extra_where, params = _build_pending_filters(filters)
         base = PENDING_USERS_FROM + extra_where
 
-        count_result = await session.execute(
-            text(f"SELECT COUNT(*) {base}"), params
-        )
-        total = count_result.scalar() or 0
-
-        offset = (page - 1) * page_size
-        params["limit_val"] = page_size
-        params["offset_val"] = offset
-
-        result = await session.execute(
-            text(f"""
-                {PENDING_USERS_SELECT}
-                {base}
-                ORDER BY pr.refund_price DESC
-                LIMIT :limit_val OFFSET :offset_val
-            """),
-            params,
-        )
-        rows = result.fetchall()
-
+        count_sql, count_params = f"SELECT COUNT(*) {base}", dict(params)
+
+        # One row past the page tells whether there is a next one.
+        params["limit_val"] = page_size + 1
+        if after is not None:
+            price, row_id, page = after
+            page_clause = "LIMIT :limit_val"
+            base += _keyset_after(price, row_id, params)
+        else:
+            params["offset_val"] = (page - 1) * page_size
+            page_clause = "LIMIT :limit_val OFFSET :offset_val"
+
+        async def fetch_page(s: AsyncSession):
+            result = await s.execute(
+                text(f"""
+                    {PENDING_USERS_SELECT}
+                    {base}
+                    {PENDING_USERS_ORDER}
+                    {page_clause}
+                """),
+                params,
+            )
+            return result.fetchall()
+
+        async def fetch_total(s: AsyncSession):
+            count_result = await s.execute(text(count_sql), count_params)
+            return count_result.scalar() or 0
+
+        # The count and the page are independent: run them side by side
+        # unless the count is still cached for this filter set.
+        total_key = tuple(sorted((filters or {}).items()))
+        total = _pending_totals.get(total_key)
+        if total is MISSING:
+            total, rows = await gather_queries(session, fetch_total, fetch_page)
+            _pending_totals.set(total_key, total, settings.PENDING_TOTAL_TTL_SECONDS)
+        else:
+            rows = await fetch_page(session)
+
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
         return {
             "data": [_row_to_dict(row) for row in rows],
             "total": total,
             "page": page,
             "page_size": page_size,
+            "next_cursor": _encode_cursor(rows[-1], page + 1) if has_next else None,
         }
 
     except Exception as e:
@@ -429,7 +551,7 @@ async def get_pending_users_export(
             text(f"""
                 {PENDING_USERS_SELECT}
                 {base}
-                ORDER BY pr.refund_price DESC
+                {PENDING_USERS_ORDER}
             """),
             params,
         )
@@ -439,3 +561,62 @@ async def get_pending_users_export(
     except Exception as e:
         logger.error(f"Database error in users_service.get_pending_users_export: {e}")
         raise HTTPException(status_code=503, detail="خطا در اتصال به پایگاه داده")
+
+
+PENDING_USERS_EXPORT_COLUMNS = (
+    "token", "public", "national_id", "first_name", "last_name",
+    "iban", "cardnumber", "mobile", "refund_price", "amount", "updated_at",
+)
+
+
+def _csv_line(values) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
+
+
+async def stream_pending_users_export(
+    filters: Optional[Dict[str, str]] = None,
+    fmt: str = "csv",
+) -> AsyncIterator[str]:
+    """
+    The pending-users export as CSV or NDJSON chunks, read through a server-side
+    cursor so memory stays flat however large the backlog is.
+
+    The generator owns its session: a StreamingResponse outlives the request's
+    dependencies. The CSV starts with a UTF-8 BOM so Excel detects the encoding
+    of the Persian names. The header (CSV) is sent before the query runs, so a
+    database error can no longer become a 503: it is logged and re-raised,
+    which aborts the response instead of ending it like a complete file.
+    """
+    extra_where, params = _build_pending_filters(filters)
+    if fmt == "csv":
+        yield "\ufeff" + _csv_line(PENDING_USERS_EXPORT_COLUMNS)
+
+    try:
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(
+                text(f"""
+                    {PENDING_USERS_SELECT}
+                    {PENDING_USERS_FROM + extra_where}
+                    {PENDING_USERS_ORDER}
+                """),
+                params,
+                execution_options={"yield_per": EXPORT_CHUNK_ROWS},
+            )
+            async for rows in result.partitions():
+                records = [_row_to_dict(row) for row in rows]
+                if fmt == "csv":
+                    buf = io.StringIO()
+                    writer = csv.writer(buf)
+                    for record in records:
+                        writer.writerow(
+                            "" if record[col] is None else record[col] for col in PENDING_USERS_EXPORT_COLUMNS
+                        )
+                    yield buf.getvalue()
+                else:
+                    yield "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+    except Exception as e:
+        logger.error(f"Database error in users_service.stream_pending_users_export: {e}")
+        raise
@@ -0,0 +1,274 @@
+"""
+Wallet index: integer ids for wallets and each wallet's first activity.
+
+`wallets` interns wallet strings to dense integer ids shared by every token
+and side, so per-wallet data can live in NumPy arrays indexed by id instead of
+dicts keyed by 56-character strings.
+
+`FirstSeenIndex` keeps, per token, every wallet's first successful buy and
+first successful sell as `datetime64[us]` arrays (NaT when it never did). It
+is built once with a GROUP BY over the whole table and then maintained
+incrementally: each use fetches only the wallets with rows past the last
+watermark and folds them in with `fmin`. Sides are refreshed separately, and
+only the side a request reads is brought up to date.
+
+`ActivityIndex` keeps, per token and side, a bitmap of the months each wallet
+was active in: one row of `np.packbits` bits per wallet id, one bit per month.
+Cohort retention for every cohort and offset is then a single vectorized pass.
+
+Both indexes follow the same watermark scheme. The watermark column is the one whose growth reveals new successful rows:
+`created_at` for purchases (re-read with a one-day lookback for late inserts)
+and `updated_at` for refunds, whose rows turn successful when paid. A refund
+row that was never updated has a NULL `updated_at`, so it is watermarked by
+`COALESCE(updated_at, created_at)` — a bare `updated_at > :since` would skip
+it forever. That lookup is served by migrations/003_refund_change_index.sql;
+after the first build each side is re-checked at most once every
+CHANGE_POLL_SECONDS.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.config import settings
+from app.logger import logger
+import asyncio
+import numpy as np
+import time
+
+NAT = np.datetime64("NaT", "us")
+
+# side -> (table, wallet column, watermark expression, lookback)
+_SIDES = {
+    "buy": ("pending_txes", "public_key", "created_at", timedelta(days=1)),
+    "sell": ("pending_refunds", "public", "COALESCE(updated_at, created_at)", timedelta(0)),
+}
+
+
+class WalletInterner:
+    """Dense integer ids for wallet strings, stable for the life of the process."""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._wallets: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._wallets)
+
+    def ids(self, wallets: Iterable[str]) -> np.ndarray:
+        out = []
+        for wallet in wallets:
+            wallet_id = self._ids.get(wallet)
+            if wallet_id is None:
+                wallet_id = self._ids[wallet] = len(self._wallets)
+                self._wallets.append(wallet)
+            out.append(wallet_id)
+        return np.asarray(out, dtype=np.intp)
+
+    def wallet(self, wallet_id: int) -> str:
+        return self._wallets[wallet_id]
+
+
+wallets = WalletInterner()
+
+
+def grow(values: np.ndarray, size: int, fill) -> np.ndarray:
+    """`values` extended with `fill` up to `size` entries (ids issued since it was sized)."""
+    if values.shape[0] >= size:
+        return values
+    extra = np.full((size - values.shape[0],) + values.shape[1:], fill, dtype=values.dtype)
+    return np.concatenate([values, extra])
+
+
+class FirstSeenIndex:
+    """First successful buy and sell per wallet id for one token."""
+
+    def __init__(self, token: str):
+        self.token = token
+        self.first: Dict[str, np.ndarray] = {side: np.empty(0, dtype="datetime64[us]") for side in _SIDES}
+        self._watermark: Dict[str, Optional[datetime]] = {side: None for side in _SIDES}
+        self._next_update: Dict[str, float] = {side: 0.0 for side in _SIDES}
+        self._lock = asyncio.Lock()
+
+    async def _update_side(self, session: AsyncSession, side: str) -> None:
+        now = time.monotonic()
+        if now < self._next_update[side]:
+            return
+        table, wallet_col, since_col, lookback = _SIDES[side]
+        watermark = self._watermark[side]
+        since = watermark - lookback if watermark is not None else datetime.min
+        result = await session.execute(
+            text(f"""
+                SELECT {wallet_col} AS wallet, MIN(created_at) AS first_at, MAX({since_col}) AS seen
+                FROM {table}
+                WHERE status = '0' AND code = :token AND {wallet_col} IS NOT NULL AND {since_col} > :since
+                GROUP BY {wallet_col}
+            """),
+            {"token": self.token, "since": since},
+        )
+        rows = result.fetchall()
+        self._next_update[side] = now + settings.CHANGE_POLL_SECONDS
+        if not rows:
+            return
+
+        ids = wallets.ids(row.wallet for row in rows)
+        self.add(side, ids, np.array([row.first_at for row in rows], dtype="datetime64[us]"))
+
+        seen = max(row.seen for row in rows)
+        self._watermark[side] = seen if watermark is None else max(watermark, seen)
+        if watermark is None:
+            logger.info(f"First-seen index {self.token}/{side}: built for {len(rows)} wallet(s)")
+
+    def add(self, side: str, ids: np.ndarray, first_at: np.ndarray) -> None:
+        """Fold in activity of wallet `ids` starting at `first_at`; earlier firsts are kept."""
+        current = grow(self.first[side], len(wallets), NAT)
+        current[ids] = np.fmin(current[ids], first_at)
+        self.first[side] = current
+
+    async def refresh(self, session: AsyncSession, side: str) -> None:
+        async with self._lock:
+            await self._update_side(session, side)
+
+    def first_seen(self, side: str) -> np.ndarray:
+        """First-activity timestamps indexed by wallet id (NaT: never), sized to all ids."""
+        return grow(self.first[side], len(wallets), NAT)
+
+
+_indexes: Dict[str, FirstSeenIndex] = {}
+_activity: Dict[str, "ActivityIndex"] = {}
+
+
+async def get_first_seen(session: AsyncSession, token: str, side: str) -> FirstSeenIndex:
+    """The token's first-seen index, with `side` brought up to date."""
+    index = _indexes.get(token)
+    if index is None:
+        index = _indexes[token] = FirstSeenIndex(token)
+    await index.refresh(session, side)
+    return index
+
+
+class ActivityIndex:
+    """Per-wallet monthly activity bitmaps (buy and sell) for one token."""
+
+    def __init__(self, token: str):
+        self.token = token
+        # Month number (months since 1970-01) of bit 0; None until the first build.
+        self.base_month: Optional[int] = None
+        self.n_months = 0
+        self.bits: Dict[str, np.ndarray] = {side: np.zeros((0, 0), dtype=np.uint8) for side in _SIDES}
+        self._watermark: Dict[str, Optional[datetime]] = {side: None for side in _SIDES}
+        self._next_update: Dict[str, float] = {side: 0.0 for side in _SIDES}
+        self._lock = asyncio.Lock()
+
+    def _resize(self, first_month: int, last_month: int) -> None:
+        """Widen every bitmap so months [first_month, last_month] have a bit."""
+        base = first_month if self.base_month is None else min(self.base_month, first_month)
+        end = last_month + 1 if self.base_month is None else max(self.base_month + self.n_months, last_month + 1)
+        if base == self.base_month and end - base == self.n_months:
+            return
+        shift = 0 if self.base_month is None else self.base_month - base
+        for side, packed in self.bits.items():
+            unpacked = np.zeros((packed.shape[0], end - base), dtype=np.uint8)
+            if self.n_months:
+                unpacked[:, shift:shift + self.n_months] = np.unpackbits(packed, axis=1, count=self.n_months)
+            self.bits[side] = np.packbits(unpacked, axis=1)
+        self.base_month, self.n_months = base, end - base
+
+    async def _update_side(self, session: AsyncSession, side: str) -> None:
+        now = time.monotonic()
+        if now < self._next_update[side]:
+            return
+        table, wallet_col, since_col, lookback = _SIDES[side]
+        watermark = self._watermark[side]
+        since = watermark - lookback if watermark is not None else datetime.min
+        result = await session.execute(
+            text(f"""
+                SELECT {wallet_col} AS wallet, DATE_TRUNC('month', created_at) AS month, MAX({since_col}) AS seen
+                FROM {table}
+                WHERE status = '0' AND code = :token AND {wallet_col} IS NOT NULL AND {since_col} > :since
+                GROUP BY {wallet_col}, DATE_TRUNC('month', created_at)
+            """),
+            {"token": self.token, "since": since},
+        )
+        rows = result.fetchall()
+        self._next_update[side] = now + settings.CHANGE_POLL_SECONDS
+        if not rows:
+            return
+
+        ids = wallets.ids(row.wallet for row in rows)
+        self.add(side, ids, np.array([row.month for row in rows], dtype="datetime64[M]").astype(np.int64))
+
+        seen = max(row.seen for row in rows)
+        self._watermark[side] = seen if watermark is None else max(watermark, seen)
+        if watermark is None:
+            logger.info(f"Activity index {self.token}/{side}: built from {len(rows)} wallet-month(s)")
+
+    def add(self, side: str, ids: np.ndarray, months: np.ndarray) -> None:
+        """Mark wallet `ids` active in `months` (months since 1970-01), pairwise."""
+        self._resize(int(months.min()), int(months.max()))
+        for name in self.bits:
+            self.bits[name] = grow(self.bits[name], len(wallets), 0)
+
+        # Set bit (month - base) of each wallet's row: byte column and big-endian bit.
+        offset = months - self.base_month
+        packed = self.bits[side]
+        np.bitwise_or.at(packed, (ids, offset >> 3), (0x80 >> (offset & 7)).astype(np.uint8))
+
+    async def refresh(self, session: AsyncSession, side: str) -> None:
+        async with self._lock:
+            await self._update_side(session, side)
+
+    def retention(self, side: str, start_month: Optional[int] = None, end_month: Optional[int] = None,
+                  max_offset: int = 12) -> List[Tuple[str, List[int]]]:
+        """
+        (cohort month, active wallets at offsets 0..max_offset) per cohort.
+
+        A wallet's cohort is its first active month on `side`; offset 0 is the
+        cohort size. Cohorts outside [start_month, end_month] are skipped.
+        """
+        if self.base_month is None or not self.bits[side].shape[0]:
+            return []
+        active = np.unpackbits(self.bits[side], axis=1, count=self.n_months).astype(bool)
+        ever = active.any(axis=1)
+        first = active.argmax(axis=1)
+
+        rows, cols = np.nonzero(active[ever])
+        cohort = first[ever][rows]
+        offset = cols - cohort
+        keep = offset <= max_offset
+        if start_month is not None:
+            keep &= cohort + self.base_month >= start_month
+        if end_month is not None:
+            keep &= cohort + self.base_month <= end_month
+        width = max_offset + 1
+        grid = np.bincount(cohort[keep] * width + offset[keep], minlength=self.n_months * width)
+        grid = grid.reshape(self.n_months, width)
+
+        out = []
+        for index in np.flatnonzero(grid[:, 0]):
+            month = np.datetime64(int(self.base_month + index), "M")
+            # Offsets that fall after the last tracked month have not happened yet.
+            observed = min(width, self.n_months - index)
+            out.append((str(month.astype("datetime64[D]")), [int(v) for v in grid[index, :observed]]))
+        return out
+
+
+async def get_activity(session: AsyncSession, token: str, side: str) -> ActivityIndex:
+    """The token's activity index, with `side` brought up to date."""
+    index = _activity.get(token)
+    if index is None:
+        index = _activity[token] = ActivityIndex(token)
+    await index.refresh(session, side)
+    return index
+
+
+def count_per_month(
+    timestamps: np.ndarray, start: Optional[np.datetime64] = None, end: Optional[np.datetime64] = None
+) -> List[Tuple[str, int]]:
+    """(YYYY-MM-01, count) of the non-NaT timestamps in [start, end), by month."""
+    keep = ~np.isnat(timestamps)
+    if start is not None:
+        keep &= timestamps >= start
+    if end is not None:
+        keep &= timestamps < end
+    months, counts = np.unique(timestamps[keep].astype("datetime64[M]"), return_counts=True)
+    return [(str(month.astype("datetime64[D]")), int(count)) for month, count in zip(months, counts)]
@@ -0,0 +1,46 @@
+-- Indexes behind the pending-users filters and pagination
+-- (users_service.PENDING_USERS_MATCH_MODES, PENDING_USERS_ORDER).
+--
+-- The dashboard itself only reads; apply this once as a role that may create
+-- indexes. CREATE INDEX CONCURRENTLY cannot run inside a transaction, so run
+-- the file with autocommit, e.g.:
+--
+--     psql "$DATABASE_URL" -f backend/migrations/001_pending_user_search_indexes.sql
+--
+-- The expressions must match the filters exactly (`col::text`), or the planner
+-- will not consider the index.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Prefix filters: `col::text LIKE 'value%'`. text_pattern_ops makes LIKE
+-- prefixes B-tree range scans regardless of the database collation.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS identity_national_id_prefix_idx
+    ON identity ((national_id::text) text_pattern_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS identity_iban_prefix_idx
+    ON identity ((iban::text) text_pattern_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS identity_cardnumber_prefix_idx
+    ON identity ((cardnumber::text) text_pattern_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS kuknos_user_mobile_prefix_idx
+    ON kuknos_user ((mobile::text) text_pattern_ops);
+
+-- Substring filters: `col::text ILIKE '%value%'`.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS identity_first_name_trgm_idx
+    ON identity USING gin ((first_name::text) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS identity_last_name_trgm_idx
+    ON identity USING gin ((last_name::text) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS pending_refunds_pending_public_trgm_idx
+    ON pending_refunds USING gin ((public::text) gin_trgm_ops)
+    WHERE status = '1';
+
+-- Pending-users order and keyset pagination:
+-- ORDER BY refund_price DESC NULLS LAST, id DESC over status = '1'.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS pending_refunds_pending_order_idx
+    ON pending_refunds (refund_price DESC NULLS LAST, id DESC)
+    WHERE status = '1';
+
+-- tests/test_pending_user_indexes.py applies this file and EXPLAINs every
+-- filter and the order against it (set TEST_DATABASE_URL). By hand, expect a
+-- Bitmap/Index Scan on the index named above rather than a Seq Scan:
+--
+--     EXPLAIN SELECT 1 FROM identity i WHERE i.national_id::text LIKE '0012%';
+--     EXPLAIN SELECT 1 FROM identity i WHERE i.last_name::text ILIKE '%رضا%';
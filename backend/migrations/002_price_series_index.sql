@@ -0,0 +1,15 @@
+-- Index behind the buy-fee price lookups (fee_engine, price_store).
+--
+-- The SQL fee engine (FEE_ENGINE=sql) probes the price series twice per
+-- purchase: the last point at or before it and the first one after it, each
+-- `WHERE name = ... ORDER BY last_update LIMIT 1`. With this index each probe
+-- is one B-tree descent; without it each is a scan of the series. The price
+-- store's incremental refresh (`last_update > :since`) uses it as well.
+--
+-- Apply once with autocommit (CREATE INDEX CONCURRENTLY cannot run inside a
+-- transaction):
+--
+--     psql "$DATABASE_URL" -f backend/migrations/002_price_series_index.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS market_parameters_minutes_name_last_update_idx
+    ON market_parameters_minutes (name, last_update);
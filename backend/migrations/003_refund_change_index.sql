@@ -0,0 +1,15 @@
+-- Index behind the refund change tracking (rollups.ChangedDays, wallet_index).
+--
+-- Closed days of pending_refunds change when a refund is paid, so the daily
+-- rollups, HLL sketches, leaderboard, quantile sketches and the sell side of
+-- the wallet indexes look for rows touched since their last check:
+-- `WHERE code = ... AND COALESCE(updated_at, created_at) > :since`. The
+-- expression must match the services' exactly, or the planner cannot use it.
+--
+-- Apply once with autocommit (CREATE INDEX CONCURRENTLY cannot run inside a
+-- transaction):
+--
+--     psql "$DATABASE_URL" -f backend/migrations/003_refund_change_index.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS pending_refunds_code_changed_idx
+    ON pending_refunds (code, (COALESCE(updated_at, created_at)));
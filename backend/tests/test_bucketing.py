@@ -0,0 +1,50 @@
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+from app.config import settings
+from app.services import bucketing
+from app.services.rollups import months_ago
+import asyncio
+import pytest
+
+FIRST_ROW = date(2021, 6, 1)
+
+
+class FakeRollup:
+    async def first_day(self, session):
+        return FIRST_ROW
+
+
+@pytest.fixture(autouse=True)
+def rollup(monkeypatch):
+    monkeypatch.setattr(bucketing, "get_rollup", lambda table, token: FakeRollup())
+
+
+def _range(start_date, end_date, default_months=12):
+    return asyncio.run(bucketing._local_range(None, "pending_refunds", "PMN", start_date, end_date, default_months))
+
+
+def test_default_window_only_without_either_date():
+    today = datetime.now(ZoneInfo(settings.ANALYTICS_TIMEZONE)).date()
+    assert _range(None, None) == (months_ago(today, 12), today + timedelta(days=1))
+    # An end date alone means everything up to then, as in rollups.load_days.
+    assert _range(None, "2023-02-10") == (FIRST_ROW, date(2023, 2, 11))
+    assert _range("2023-01-01", "2023-02-10") == (date(2023, 1, 1), date(2023, 2, 11))
+
+
+def test_no_default_starts_at_first_row():
+    assert _range(None, "2023-02-10", None) == (FIRST_ROW, date(2023, 2, 11))
+
+
+def test_averaged_keeps_every_bucket():
+    buckets = [
+        ("2024-01-01", {"rate_sum": 0.0, "rate_count": 0.0}),
+        ("2024-01-02", {"rate_sum": 300.0, "rate_count": 2.0}),
+        ("2024-01-03", {"rate_sum": 0.0, "rate_count": 0.0}),
+        ("2024-01-04", {"rate_sum": 160.0, "rate_count": 1.0}),
+    ]
+    assert bucketing.averaged(buckets, "rate_sum", "rate_count") == [
+        ("2024-01-01", 0.0, 0),
+        ("2024-01-02", 150.0, 2),
+        ("2024-01-03", 0.0, 0),
+        ("2024-01-04", 160.0, 1),
+    ]
@@ -0,0 +1,43 @@
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from app.services.date_utils import first_open_day, is_closed_range, utc_today
+import time
+import pytest
+
+
+@pytest.fixture
+def local_zone(monkeypatch):
+    """Switch the process's local time zone for the duration of a test."""
+
+    def use(name: str):
+        monkeypatch.setenv("TZ", name)
+        time.tzset()
+
+    yield use
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_day_is_still_open_just_after_local_midnight():
+    # 01:30 in Tehran (+03:30) is 22:00 UTC on the previous day, which is
+    # the day created_at still lands on: 03-09 is open, not closed.
+    now = datetime(2024, 3, 10, 1, 30, tzinfo=ZoneInfo("Asia/Tehran"))
+    assert first_open_day(now) == date(2024, 3, 9)
+    assert first_open_day(datetime(2024, 3, 9, 22, 0)) == date(2024, 3, 9)
+
+
+def test_settle_period_keeps_the_previous_utc_day_open():
+    assert first_open_day(datetime(2024, 3, 10, 0, 30, tzinfo=timezone.utc)) == date(2024, 3, 9)
+    assert first_open_day(datetime(2024, 3, 10, 1, 0, tzinfo=timezone.utc)) == date(2024, 3, 10)
+
+
+@pytest.mark.parametrize("zone", ["Asia/Tehran", "Pacific/Kiritimati", "America/Los_Angeles"])
+def test_defaults_ignore_the_server_zone(local_zone, zone):
+    local_zone(zone)
+    before = datetime.now(timezone.utc)
+    open_day, today = first_open_day(), utc_today()
+    after = datetime.now(timezone.utc)
+    assert open_day in {(before - timedelta(hours=1)).date(), (after - timedelta(hours=1)).date()}
+    assert today in {before.date(), after.date()}
+    assert not is_closed_range(str(open_day))
+    assert is_closed_range(str(open_day - timedelta(days=1)))
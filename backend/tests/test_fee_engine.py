@@ -0,0 +1,110 @@
+from sqlalchemy import text
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from app.config import settings
+from app.services import fee_engine
+import asyncio
+import math
+import numpy as np
+import pathlib
+import pytest
+import re
+
+PRICES = [
+    # last_update, price
+    ("2024-01-01 09:59", "1000"),
+    ("2024-01-01 10:00", None),
+    ("2024-01-01 10:02", "1050.5"),
+    ("2024-01-01 23:58", "1149.99"),
+    ("2024-01-02 00:30", "1200"),
+]
+
+PURCHASES = [
+    # created_at, amount
+    *[("2024-01-01 10:00", "0.1")] * 10,
+    ("2024-01-01 10:01", "3.1415926"),
+    ("2024-01-01 10:01:30", "12345678.1234567"),
+    ("2024-01-01 23:59:59", "0.0000001"),
+    ("2024-01-02 00:00:01", "7"),
+    ("2024-01-02 12:00", "2.5"),
+]
+
+
+def _epoch(ts: str) -> float:
+    return datetime.fromisoformat(ts).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _expected() -> dict:
+    """The rule in Decimal arithmetic: amount * floor(0.02 * nearest non-NULL price)."""
+    points = [(_epoch(t), Decimal(p)) for t, p in PRICES if p is not None]
+    out = {}
+    for created_at, amount in PURCHASES:
+        ts = _epoch(created_at)
+        before = [p for p in points if p[0] <= ts]
+        after = [p for p in points if p[0] > ts]
+        prv, nxt = (before[-1] if before else None), (after[0] if after else None)
+        if nxt is None or (prv is not None and not nxt[0] - ts < ts - prv[0]):
+            price = prv[1]
+        else:
+            price = nxt[1]
+        day = datetime.fromisoformat(created_at).date()
+        out[day] = out.get(day, 0) + Decimal(amount) * math.floor(Decimal("0.02") * price)
+    return {d: float(v) for d, v in out.items()}
+
+
+async def _fake_fetch_columns(session, sql, params, names):
+    """What the columnar fetch returns for the two queries of the NumPy engine."""
+    if "pending_txes" in sql:
+        rows = [
+            (_epoch(t), float(Decimal(a) * fee_engine._AMOUNT_SCALE),
+             (datetime.fromisoformat(t).date() - date(1970, 1, 1)).days)
+            for t, a in PURCHASES
+        ]
+    else:
+        rows = [(_epoch(t), float(p)) for t, p in PRICES if p is not None]
+    return {name: np.array([r[i] for r in rows], dtype=np.float64) for i, name in enumerate(names)}
+
+
+def test_numpy_fees_are_exact(monkeypatch):
+    monkeypatch.setattr(fee_engine, "fetch_columns", _fake_fetch_columns)
+    monkeypatch.setattr(settings, "PRICE_STORE_ENABLED", False)
+    daily = asyncio.run(fee_engine._daily_fees_numpy(None, "pmn_price", "PMN", None, None))
+    # Exact equality: ten purchases of 0.1 at a fee of 20 are 20, not 19.999999999999996.
+    assert daily == _expected()
+
+
+def test_sql_and_numpy_engines_agree(pg, monkeypatch):
+    monkeypatch.setattr(settings, "PRICE_STORE_ENABLED", False)
+
+    async def check(session):
+        await session.execute(
+            text("INSERT INTO market_parameters_minutes (name, price, last_update) VALUES ('pmn_price', CAST(:p AS numeric), CAST(:t AS timestamp))"),
+            [{"t": t, "p": p} for t, p in PRICES],
+        )
+        await session.execute(
+            text("INSERT INTO pending_txes (code, status, amount, created_at) VALUES ('PMN', '0', CAST(:a AS numeric), CAST(:t AS timestamp))"),
+            [{"t": t, "a": a} for t, a in PURCHASES],
+        )
+        await session.commit()
+        for start_date, end_date in ((None, None), ("2024-01-02", None), (None, "2024-01-01")):
+            numpy_fees = await fee_engine._daily_fees_numpy(session, "pmn_price", "PMN", start_date, end_date)
+            sql_fees = await fee_engine._daily_fees_sql(session, "pmn_price", "PMN", start_date, end_date)
+            assert numpy_fees == sql_fees
+        assert numpy_fees == {d: v for d, v in _expected().items() if d <= date(2024, 1, 1)}
+
+    pg.run(("pending_txes", "market_parameters_minutes"), check)
+
+
+def test_sql_engine_probes_use_price_series_index(pg):
+    migration = pathlib.Path(__file__).parent.parent / "migrations" / "002_price_series_index.sql"
+
+    async def check(session):
+        conn = await session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+        await conn.exec_driver_sql(re.sub(r"--[^\n]*", "", migration.read_text(encoding="utf-8")))
+        await conn.exec_driver_sql("SET enable_seqscan = off")
+        sql = fee_engine._FEES_SQL.format(df="").replace(":price_series", "'PMN'").replace(":token", "'PMN'")
+        result = await conn.exec_driver_sql(f"EXPLAIN {sql}")
+        plan = "\n".join(row[0] for row in result.fetchall())
+        assert plan.count("market_parameters_minutes_name_last_update_idx") == 2, plan
+
+    pg.run(("pending_txes", "market_parameters_minutes"), check)
@@ -0,0 +1,29 @@
+from pydantic import ValidationError
+from app.config import Settings
+from app.services import hll
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("precision", [12, 14, 18])
+def test_rank_is_leading_zeros_plus_one(precision):
+    tail_bits = 64 - precision
+    tails = [1, 2, 3, (1 << 40) + 12345, (1 << tail_bits) - 1, (1 << (tail_bits - 1)) + 1]
+    hashes = np.array([(7 << tail_bits) | t for t in tails], dtype=np.uint64)
+    index, rank = hll.register_updates(hashes, precision)
+    assert index.tolist() == [7] * len(tails)
+    assert rank.tolist() == [tail_bits - t.bit_length() + 1 for t in tails]
+
+
+@pytest.mark.parametrize("precision", [4, 11, 19])
+def test_precision_outside_exact_range_is_rejected(precision):
+    with pytest.raises(ValidationError):
+        Settings(DATABASE_URL="postgresql://u:p@h/d", HLL_PRECISION=precision)
+
+
+def test_estimate_within_error():
+    hashes = hll.hash_wallets(f"G{i}" for i in range(50_000))
+    index, rank = hll.register_updates(hashes, 12)
+    registers = np.zeros(1 << 12, dtype=np.uint8)
+    np.maximum.at(registers, index, rank)
+    assert abs(hll.estimate(registers) / 50_000 - 1) < 4 * hll.relative_error(12)
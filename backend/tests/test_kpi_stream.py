@@ -0,0 +1,95 @@
+from fastapi import HTTPException
+from app.routers.buys import _KpiStreamResponse
+from app.services import buys_service
+import asyncio
+import pytest
+
+
+class FakeSession:
+    open_sessions = 0
+
+    async def __aenter__(self):
+        FakeSession.open_sessions += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        FakeSession.open_sessions -= 1
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    """open_kpi_stream with a slow side-by-side fee task it can be watched through."""
+    FakeSession.open_sessions = 0
+    state = {"fee_finished": False, "quantiles": None}
+
+    async def slow_fee(fn):
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            state["fee_finished"] = True
+
+    async def get_kpis(session, start_date, end_date, token, quantiles=False):
+        assert FakeSession.open_sessions == 1
+        state["quantiles"] = quantiles
+        await asyncio.sleep(0)  # the fee task starts while the cards query
+        if state.get("kpis_fail"):
+            raise HTTPException(status_code=503, detail="down")
+        return {"kpis": []}
+
+    monkeypatch.setattr(buys_service, "AsyncSessionLocal", FakeSession)
+    monkeypatch.setattr(buys_service, "can_fan_out", lambda n: True)
+    monkeypatch.setattr(buys_service, "run_in_own_session", slow_fee)
+    monkeypatch.setattr(buys_service, "get_kpis", get_kpis)
+    return state
+
+
+def test_failed_cards_cancel_and_await_the_fee(stream):
+    stream["kpis_fail"] = True
+
+    async def run():
+        with pytest.raises(HTTPException):
+            await buys_service.open_kpi_stream(token="PMN")
+        # Awaited, not just cancelled: its cleanup has already run.
+        assert stream["fee_finished"]
+        assert FakeSession.open_sessions == 0
+
+    asyncio.run(run())
+
+
+def test_early_disconnect_releases_everything(stream):
+    async def run():
+        kpi_stream = await buys_service.open_kpi_stream(token="PMN")
+        assert FakeSession.open_sessions == 0
+        lines = kpi_stream.lines()
+        assert await lines.__anext__() == '{"kpis": []}\n'
+        await lines.aclose()
+        assert stream["fee_finished"]
+        assert FakeSession.open_sessions == 0
+
+    asyncio.run(run())
+
+
+def test_unsent_response_still_cancels_the_fee(stream):
+    async def run():
+        response = _KpiStreamResponse(await buys_service.open_kpi_stream(token="PMN"))
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            raise OSError("client went away")  # before the first byte
+
+        with pytest.raises(Exception):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+        assert stream["fee_finished"]
+
+    asyncio.run(run())
+
+
+def test_quantiles_flag_reaches_the_cards(stream):
+    async def run():
+        kpi_stream = await buys_service.open_kpi_stream(token="IRT", quantiles=True)
+        assert [line async for line in kpi_stream.lines()] == ['{"kpis": []}\n']
+
+    asyncio.run(run())
+    assert stream["quantiles"] is True
@@ -0,0 +1,94 @@
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+from app.services import users_service
+import asyncio
+import pytest
+import tracemalloc
+
+Row = namedtuple(
+    "Row",
+    "id token public national_id first_name last_name iban cardnumber mobile refund_price amount updated_at",
+)
+
+# Enough for an export held in memory to dwarf one chunk, few enough to run
+# under tracemalloc.
+TOTAL_ROWS = 200_000
+
+
+class FakeStreamResult:
+    def __init__(self, total: int, chunk: int, fail_after: int):
+        self.total, self.chunk, self.fail_after = total, chunk, fail_after
+
+    async def partitions(self):
+        # Rows are made per chunk, as a server-side cursor hands them over.
+        stamp = datetime(2024, 1, 1, 12, 0)
+        for start in range(0, self.total, self.chunk):
+            if start >= self.fail_after:
+                raise ConnectionError("connection reset by peer")
+            yield [
+                Row(i, "PMN", f"G{i:055d}", f"{i:010d}", "علی", "رضایی", f"IR{i:024d}",
+                    f"{i:016d}", f"09{i:09d}", Decimal(i), Decimal("1.5"), stamp)
+                for i in range(start, min(start + self.chunk, self.total))
+            ]
+
+
+class FakeSession:
+    def __init__(self, result: FakeStreamResult):
+        self.result = result
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def stream(self, statement, params, execution_options):
+        assert execution_options["yield_per"] == self.result.chunk
+        return self.result
+
+
+@pytest.fixture
+def pending_rows(monkeypatch):
+    def use(total: int, fail_after: int = None):
+        result = FakeStreamResult(total, users_service.EXPORT_CHUNK_ROWS, total if fail_after is None else fail_after)
+        monkeypatch.setattr(users_service, "AsyncSessionLocal", lambda: FakeSession(result))
+
+    return use
+
+
+def test_export_streams_in_bounded_memory(pending_rows):
+    pending_rows(TOTAL_ROWS)
+
+    async def consume():
+        lines = size = 0
+        async for chunk in users_service.stream_pending_users_export(None, "csv"):
+            lines += chunk.count("\n")
+            size += len(chunk)
+        return lines, size
+
+    tracemalloc.start()
+    try:
+        lines, size = asyncio.run(consume())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert lines == TOTAL_ROWS + 1  # plus the header
+    # The file is ~40 MB; only about one chunk may be held at a time.
+    assert size > 30 * 2 ** 20
+    assert peak < 8 * 2 ** 20, peak
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_database_error_aborts_the_stream(pending_rows, fmt):
+    pending_rows(10_000, fail_after=4_000)
+
+    async def consume():
+        chunks = []
+        with pytest.raises(ConnectionError):
+            async for chunk in users_service.stream_pending_users_export(None, fmt):
+                chunks.append(chunk)
+        return chunks
+
+    chunks = asyncio.run(consume())
+    assert sum(chunk.count("\n") for chunk in chunks) == 4_000 + (fmt == "csv")
@@ -0,0 +1,86 @@
+"""
+The filters and the order of the pending-users table must be servable by the
+indexes of migrations/001_pending_user_search_indexes.sql: the expressions in
+users_service have to match the indexed ones exactly, or the planner ignores
+the index.
+"""
+from sqlalchemy import text
+from app.services import users_service
+import pathlib
+import pytest
+import re
+
+MIGRATION = pathlib.Path(__file__).parent.parent / "migrations" / "001_pending_user_search_indexes.sql"
+
+ALIASES = {"i": "identity", "ku": "kuknos_user", "pr": "pending_refunds"}
+
+# filter -> (value typed by the user, index expected to serve it)
+FILTER_INDEXES = {
+    "national_id": ("۰۰۱۲", "identity_national_id_prefix_idx"),
+    "iban": ("ir12", "identity_iban_prefix_idx"),
+    "cardnumber": ("6037", "identity_cardnumber_prefix_idx"),
+    "mobile": ("0912", "kuknos_user_mobile_prefix_idx"),
+    "first_name": ("محمد", "identity_first_name_trgm_idx"),
+    "last_name": ("رضایی", "identity_last_name_trgm_idx"),
+    "public": ("GABC", "pending_refunds_pending_public_trgm_idx"),
+}
+
+
+def _statements(sql: str):
+    sql = re.sub(r"--[^\n]*", "", sql)
+    return [s.strip() for s in sql.split(";") if s.strip()]
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+async def _migrated(session):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    conn = await session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+    statements = _statements(MIGRATION.read_text(encoding="utf-8"))
+    try:
+        await conn.exec_driver_sql(statements[0])
+    except Exception as e:
+        pytest.skip(f"pg_trgm is not available: {e}")
+    for statement in statements[1:]:
+        await conn.exec_driver_sql(statement)
+    # Empty tables are cheapest to scan; ask whether the index can be used at all.
+    await conn.exec_driver_sql("SET enable_seqscan = off")
+    return conn
+
+
+async def _plan(conn, sql: str) -> str:
+    result = await conn.exec_driver_sql(f"EXPLAIN {sql}")
+    return "\n".join(row[0] for row in result.fetchall())
+
+
+@pytest.mark.parametrize("name", sorted(FILTER_INDEXES))
+def test_filter_uses_its_index(pg, name):
+    value, index = FILTER_INDEXES[name]
+
+    async def check(session):
+        conn = await _migrated(session)
+        where, params = users_service._build_pending_filters({name: value})
+        # The filter exactly as the service builds it, bound value inlined so
+        # the planner sees the LIKE prefix.
+        clause = re.sub(r":(f_\w+)", lambda m: _literal(params[m.group(1)]), where.removeprefix(" AND "))
+        alias = clause.split(".", 1)[0]
+        status = " AND pr.status = '1'" if alias == "pr" else ""
+        plan = await _plan(conn, f"SELECT 1 FROM {ALIASES[alias]} {alias} WHERE {clause}{status}")
+        assert index in plan, plan
+
+    pg.run(("pending_refunds", "federation", "kuknos_user", "identity"), check)
+
+
+def test_order_uses_keyset_index(pg):
+    async def check(session):
+        conn = await _migrated(session)
+        plan = await _plan(
+            conn,
+            f"SELECT pr.id FROM pending_refunds pr WHERE pr.status = '1' {users_service.PENDING_USERS_ORDER} LIMIT 50",
+        )
+        assert "pending_refunds_pending_order_idx" in plan, plan
+        assert "Sort" not in plan, plan
+
+    pg.run(("pending_refunds", "federation", "kuknos_user", "identity"), check)
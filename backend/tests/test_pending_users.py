@@ -0,0 +1,51 @@
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from app.services import users_service
+import asyncio
+import pytest
+
+Row = namedtuple(
+    "Row",
+    "id token public national_id first_name last_name iban cardnumber mobile refund_price amount updated_at",
+)
+
+
+class FakeSession:
+    """The pending-users count and page queries over `rows`, already in table order."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def execute(self, statement, params):
+        if "COUNT(*)" in str(statement):
+            return SimpleNamespace(scalar=lambda: len(self.rows))
+        start = params.get("offset_val", 0)
+        page = self.rows[start:start + params["limit_val"]]
+        return SimpleNamespace(fetchall=lambda: page)
+
+
+@pytest.fixture(autouse=True)
+def no_cached_totals():
+    users_service._pending_totals.invalidate()
+    yield
+    users_service._pending_totals.invalidate()
+
+
+def _rows(n: int):
+    stamp = datetime(2024, 1, 1, 12, 0)
+    return [
+        Row(i, "PMN", f"G{i:055d}", f"{i:010d}", "علی", "رضایی", f"IR{i:024d}",
+            f"{i:016d}", f"09{i:09d}", Decimal(n - i), Decimal("1.5"), stamp)
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize("total, pages_with_cursor", [(4, [1]), (5, [1, 2]), (1, [])])
+def test_next_cursor_only_when_a_row_follows(total, pages_with_cursor):
+    session = FakeSession(_rows(total))
+    pages = [asyncio.run(users_service.get_pending_users(session, page=page, page_size=2)) for page in (1, 2, 3)]
+
+    assert [len(p["data"]) for p in pages] == [min(2, max(total - 2 * i, 0)) for i in range(3)]
+    assert [p["page"] for p in pages if p["next_cursor"]] == pages_with_cursor
@@ -0,0 +1,42 @@
+from fastapi import HTTPException
+from app.services.histogram import parse_edges
+from app.services.persian_format import bucket_labels, format_number
+import pytest
+
+
+@pytest.mark.parametrize(
+    "value, text",
+    [
+        (10000, "۱۰٬۰۰۰"),
+        (1234.5678, "۱٬۲۳۴٫۵۷"),
+        (0.5, "۰٫۵"),
+        (0.0012, "۰٫۰۰۱۲"),
+        (0.00123456, "۰٫۰۰۱۲۳"),
+        (0.1 + 0.2, "۰٫۳"),
+    ],
+)
+def test_format_number_keeps_significant_digits(value, text):
+    assert format_number(value) == text
+
+
+def test_small_edges_get_distinct_labels():
+    assert bucket_labels([0.0012, 0.0052]) == ["۰-۰٫۰۰۱۲", "۰٫۰۰۱۲-۰٫۰۰۵۲", "۰٫۰۰۵۲+"]
+    labels = bucket_labels([1000.001, 1000.002])
+    assert len(set(labels)) == len(labels)
+
+
+def test_whole_number_labels_are_unchanged():
+    assert bucket_labels([1, 5, 20, 100], lower=1, discrete=True) == ["۱", "۲-۵", "۶-۲۰", "۲۱-۱۰۰", "۱۰۰+"]
+    assert bucket_labels([10, 100]) == ["۰-۱۰", "۱۰-۱۰۰", "۱۰۰+"]
+
+
+@pytest.mark.parametrize("raw", ["nan", "1,nan,5", "1,inf", "-inf,0", "1,1e400", "5,1", "a,b"])
+def test_invalid_edges_are_a_400(raw):
+    with pytest.raises(HTTPException) as e:
+        parse_edges(raw)
+    assert e.value.status_code == 400
+
+
+def test_parse_edges():
+    assert parse_edges("0.0012,0.0052,1e3") == (0.0012, 0.0052, 1000.0)
+    assert parse_edges(None) is None
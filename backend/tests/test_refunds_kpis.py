@@ -0,0 +1,68 @@
+from sqlalchemy import text
+from app.services import refunds_service
+from app.services.date_utils import build_date_filter
+import pytest
+
+# The per-status statements get_kpis ran before it was fused into one
+# FILTER scan; each card must still come out the same.
+LEGACY_KPI_QUERIES = {
+    "total_completed": "SELECT COUNT(*) FROM pending_refunds WHERE status = '0' AND code = :token{df}",
+    "total_pending": "SELECT COUNT(*) FROM pending_refunds WHERE status = '1' AND code = :token{df}",
+    "total_num_pmn_pending": "SELECT COALESCE(SUM(amount), 0) FROM pending_refunds WHERE status = '1' AND code = :token{df}",
+    "pending_amount": "SELECT COALESCE(SUM(total_price), 0) FROM pending_refunds WHERE status = '1' AND code = :token{df}",
+    "total_sold": "SELECT COALESCE(SUM(amount), 0) FROM pending_refunds WHERE status = '0' AND code = :token{df}",
+    "total_payout": "SELECT COALESCE(SUM(refund_price), 0) FROM pending_refunds WHERE status = '0' AND code = :token{df}",
+    "total_fees": "SELECT COALESCE(SUM(fee_price), 0) FROM pending_refunds WHERE status = '0' AND code = :token{df}",
+    "avg_amount": "SELECT COALESCE(AVG(amount), 0) FROM pending_refunds WHERE status = '0' AND code = :token{df}",
+    "unique_sellers": "SELECT COUNT(DISTINCT public) FROM pending_refunds WHERE status = '0' AND code = :token{df}",
+}
+
+ROWS = [
+    # public, code, status, amount, total_price, refund_price, fee_price, created_at
+    ("GA", "PMN", "0", 10.5, 1000, 980, 20, "2024-01-01 10:00"),
+    ("GA", "PMN", "0", 3.25, 300, 294, 6, "2024-01-02 23:59:59"),
+    ("GB", "PMN", "0", None, 50, None, None, "2024-01-03 00:00"),
+    ("GC", "PMN", "1", 7, 700, 686, 14, "2024-01-02 12:00"),
+    ("GD", "PMN", "1", 1.5, None, None, None, "2024-01-05 08:00"),
+    ("GE", "PMN", "2", 99, 9900, 9702, 198, "2024-01-02 12:00"),
+    ("GA", "GOLD", "0", 4, 400, 392, 8, "2024-01-02 12:00"),
+    ("GF", "PMN", "0", 2, 200, 196, 4, "2023-12-31 23:00"),
+]
+
+
+async def _seed(session):
+    await session.execute(
+        text("""
+            INSERT INTO pending_refunds (public, code, status, amount, total_price, refund_price, fee_price, created_at)
+            VALUES (:public, :code, :status, :amount, :total_price, :refund_price, :fee_price, CAST(:created_at AS timestamp))
+        """),
+        [
+            dict(zip(("public", "code", "status", "amount", "total_price", "refund_price", "fee_price", "created_at"), row))
+            for row in ROWS
+        ],
+    )
+    await session.commit()
+
+
+@pytest.mark.parametrize(
+    "start_date, end_date, token",
+    [
+        (None, None, "PMN"),
+        ("2024-01-01", "2024-01-02", "PMN"),
+        ("2024-01-03", None, "PMN"),
+        (None, "2024-01-01", "GOLD"),
+        (None, None, "USDT"),
+    ],
+)
+def test_fused_kpis_match_per_status_queries(pg, start_date, end_date, token):
+    async def check(session):
+        await _seed(session)
+        fused = await refunds_service.get_kpis(session, start_date, end_date, token)
+        df, params = build_date_filter(start_date, end_date)
+        params["token"] = token
+        for kpi in fused["kpis"]:
+            legacy = (await session.execute(text(LEGACY_KPI_QUERIES[kpi["key"]].format(df=df)), params)).scalar() or 0
+            assert kpi["value"] == pytest.approx(float(legacy)), kpi["key"]
+        assert {kpi["key"] for kpi in fused["kpis"]} == set(LEGACY_KPI_QUERIES)
+
+    pg.run(("pending_refunds",), check)
@@ -0,0 +1,95 @@
+from app.config import settings
+from app.services import response_cache
+from app.services.response_cache import InvalidationLog, cached, invalidate
+import asyncio
+import inspect
+import pytest
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    """An enabled, empty response cache whose invalidation log lives in tmp_path."""
+    monkeypatch.setattr(settings, "CACHE_ENABLED", True)
+    monkeypatch.setattr(response_cache, "invalidation_log", InvalidationLog(str(tmp_path / "invalidations.log")))
+    response_cache.response_cache.invalidate()
+    yield tmp_path
+    response_cache.response_cache.invalidate()
+
+
+def _counting(endpoint: str):
+    calls = []
+
+    @cached(endpoint)
+    async def fn(session, label: str = "", token: str = "PMN"):
+        calls.append((label, token))
+        return len(calls)
+
+    return fn, calls
+
+
+def test_token_matches_only_the_token_argument(cache):
+    fn, calls = _counting("test.labels")
+
+    async def run():
+        await fn(None, label="GOLD", token="PMN")
+        await fn(None, label="", token="GOLD")
+        assert invalidate(token="GOLD") == 1
+        await fn(None, label="GOLD", token="PMN")
+        await fn(None, label="", token="GOLD")
+
+    asyncio.run(run())
+    # The PMN entry whose label happens to read "GOLD" survived.
+    assert calls == [("GOLD", "PMN"), ("", "GOLD"), ("", "GOLD")]
+
+
+def test_invalidation_reaches_other_workers(cache):
+    fn, calls = _counting("test.workers")
+    # Another worker process: same log file, its own read position.
+    other_worker = InvalidationLog(str(cache / "invalidations.log"))
+
+    async def run():
+        await fn(None)
+        await fn(None)
+        assert len(calls) == 1
+        other_worker.publish("test.", None)
+        await fn(None)
+        assert len(calls) == 2
+        await fn(None)
+        assert len(calls) == 2
+
+    asyncio.run(run())
+    # And that worker sees this one's invalidations.
+    invalidate("test.workers", "PMN")
+    assert other_worker.unseen() == [("test.", None), ("test.workers", "PMN")]
+    assert other_worker.unseen() == []
+
+
+def test_partial_line_waits_for_the_rest(tmp_path):
+    path = tmp_path / "invalidations.log"
+    log = InvalidationLog(str(path))
+    path.write_bytes(b'["buys.", null]\n["refunds.", "P')
+    assert log.unseen() == [("buys.", None)]
+    with open(path, "ab") as f:
+        f.write(b'MN"]\n')
+    assert log.unseen() == [("refunds.", "PMN")]
+
+
+
+def test_refund_endpoints_keep_closed_ranges_on_the_open_ttl(cache, monkeypatch):
+    from app.services import buys_service, refunds_service, users_service
+    monkeypatch.setattr(settings, "CACHE_TTL_OPEN_SECONDS", 60)
+    monkeypatch.setattr(settings, "CACHE_TTL_CLOSED_SECONDS", 86400)
+
+    def ttl(fn):
+        closed_is_final = inspect.getclosurevars(fn).nonlocals["closed_is_final"]
+        return response_cache.ttl_for("2020-01-31", closed_is_final)
+
+    # Paying a refund changes the day it was created on, however old.
+    assert ttl(refunds_service.get_kpis) == 60
+    assert ttl(refunds_service.get_daily_count) == 60
+    assert ttl(users_service.get_kpis) == 60
+    assert ttl(users_service.get_top_sellers) == 60
+    assert ttl(users_service.get_retention) == 60
+    # Purchases are final once their day has closed.
+    assert ttl(buys_service.get_kpis) == 86400
+    assert ttl(users_service.get_top_buyers) == 86400
@@ -0,0 +1,148 @@
+from sqlalchemy import text
+from datetime import datetime, timedelta
+from app.services.wallet_index import ActivityIndex, FirstSeenIndex, wallets
+import numpy as np
+import pytest
+import random
+
+SIDES = ("buy", "sell")
+
+
+def _reference(activity, max_offset):
+    """Retention from scratch over (wallet, month number) pairs: cohort = first active month."""
+    months = {}
+    for wallet, month in activity:
+        months.setdefault(wallet, set()).add(month)
+    if not months:
+        return []
+    last = max(max(m) for m in months.values())
+    grid = {}
+    for active in months.values():
+        cohort = min(active)
+        counts = grid.setdefault(cohort, [0] * (max_offset + 1))
+        for month in active:
+            if month - cohort <= max_offset:
+                counts[month - cohort] += 1
+    return [
+        (f"{cohort // 12 + 1970:04d}-{cohort % 12 + 1:02d}-01", counts[:min(max_offset + 1, last - cohort + 1)])
+        for cohort, counts in sorted(grid.items())
+    ]
+
+
+def _month(moment: datetime) -> int:
+    return (moment.year - 1970) * 12 + moment.month - 1
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_incremental_grid_matches_full_recompute(seed):
+    rng = random.Random(seed)
+    # Later batches may reach back before the first month seen so far, which
+    # shifts every bitmap.
+    batches = [
+        [(f"GRID{seed}-{rng.randint(0, 60)}", 640 + rng.randint(0, 40)) for _ in range(rng.randint(1, 30))]
+        for _ in range(30)
+    ]
+    activity = [pair for batch in batches for pair in batch]
+
+    def add(index, pairs):
+        ids = wallets.ids(wallet for wallet, _ in pairs)
+        index.add("buy", ids, np.array([month for _, month in pairs], dtype=np.int64))
+
+    incremental, full = ActivityIndex("PMN"), ActivityIndex("PMN")
+    for batch in batches:
+        add(incremental, batch)
+    add(full, activity)
+
+    for max_offset in (0, 3, 12):
+        expected = _reference(activity, max_offset)
+        assert full.retention("buy", max_offset=max_offset) == expected
+        assert incremental.retention("buy", max_offset=max_offset) == expected
+    assert incremental.retention("sell") == []
+
+
+def test_cohort_range_selects_cohorts_not_activity():
+    index = ActivityIndex("PMN")
+    ids = wallets.ids(["GRANGE-A", "GRANGE-A", "GRANGE-B", "GRANGE-B"])
+    # 648 is 2024-01.
+    index.add("buy", ids, np.array([648, 650, 649, 650], dtype=np.int64))
+
+    assert index.retention("buy", start_month=649, end_month=649, max_offset=2) == [("2024-02-01", [1, 1])]
+
+
+def test_first_seen_keeps_the_earliest():
+    index = FirstSeenIndex("PMN")
+    a, b = (int(i) for i in wallets.ids(["GFIRST-A", "GFIRST-B"]))
+    index.add("buy", np.array([a, b]), np.array(["2024-03-01T10:00", "2024-02-01T00:00"], dtype="datetime64[us]"))
+    index.add("buy", np.array([a, b]), np.array(["2024-01-15T09:00", "2024-04-01T00:00"], dtype="datetime64[us]"))
+
+    first = index.first_seen("buy")
+    assert first[a] == np.datetime64("2024-01-15T09:00")
+    assert first[b] == np.datetime64("2024-02-01T00:00")
+    assert np.isnat(index.first_seen("sell")[a])
+
+
+async def _simulate(session, seed: int, batches: int = 30):
+    """
+    Rows written batch by batch. After each batch yields the successful rows
+    so far as (side, wallet, created_at).
+    """
+    rng = random.Random(seed)
+    clock = datetime(2023, 1, 1)
+    paid, pending = [], {}
+    for _ in range(batches):
+        clock += timedelta(days=rng.randint(3, 25), minutes=rng.randint(0, 600))
+        for _ in range(rng.randint(5, 40)):
+            wallet = f"G{seed}-{rng.randint(0, 60)}"
+            # Purchases may land up to a day late (the buy side's lookback).
+            created = clock - timedelta(hours=rng.randint(0, 23))
+            status = rng.choice("001")
+            await session.execute(
+                text("INSERT INTO pending_txes (public_key, code, status, created_at) VALUES (:w, 'PMN', :s, :c)"),
+                {"w": wallet, "s": status, "c": created},
+            )
+            if status == "0":
+                paid.append(("buy", wallet, created))
+            kind = rng.random()
+            if kind < 0.7:
+                # Paid at once and never updated (updated_at stays NULL), or left pending.
+                status = "0" if kind < 0.4 else "1"
+                result = await session.execute(
+                    text("INSERT INTO pending_refunds (public, code, status, created_at) "
+                         "VALUES (:w, 'PMN', :s, :c) RETURNING id"),
+                    {"w": wallet, "s": status, "c": clock},
+                )
+                row_id = result.scalar()
+                if status == "0":
+                    paid.append(("sell", wallet, clock))
+                else:
+                    pending[row_id] = ("sell", wallet, clock)
+        # Some pending refunds get paid now, long after they were created.
+        for row_id in rng.sample(sorted(pending), k=len(pending) // 3):
+            await session.execute(
+                text("UPDATE pending_refunds SET status = '0', updated_at = :u WHERE id = :id"),
+                {"u": clock, "id": row_id},
+            )
+            paid.append(pending.pop(row_id))
+        await session.commit()
+        yield paid
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_refreshed_grid_matches_full_recompute(pg, seed):
+    async def check(session):
+        incremental = ActivityIndex("PMN")
+        async for paid in _simulate(session, seed):
+            for side in SIDES:
+                await incremental.refresh(session, side)
+        full = ActivityIndex("PMN")
+        for side in SIDES:
+            await full.refresh(session, side)
+
+        for side in SIDES:
+            activity = [(wallet, _month(created)) for row_side, wallet, created in paid if row_side == side]
+            for max_offset in (0, 3, 12):
+                expected = _reference(activity, max_offset)
+                assert full.retention(side, max_offset=max_offset) == expected
+                assert incremental.retention(side, max_offset=max_offset) == expected
+
+    pg.run(("pending_txes", "pending_refunds"), check)
@@ -0,0 +1,116 @@
+from sqlalchemy import text
+from datetime import date
+from types import SimpleNamespace
+from app.config import settings
+from app.services import rollups
+from app.services.date_utils import utc_today
+from app.services.wallet_index import ActivityIndex, FirstSeenIndex
+import asyncio
+import pathlib
+import pytest
+import re
+
+MIGRATION = pathlib.Path(__file__).parent.parent / "migrations" / "003_refund_change_index.sql"
+
+FIRST_ROW = date(2021, 6, 1)
+
+
+class FakeRollup:
+    def __init__(self):
+        self.ranges = []
+
+    async def first_day(self, session):
+        return FIRST_ROW
+
+    async def days(self, session, start, end):
+        self.ranges.append((start, end))
+        return {}
+
+
+@pytest.fixture
+def rollup(monkeypatch):
+    fake = FakeRollup()
+    monkeypatch.setattr(rollups, "get_rollup", lambda table, token: fake)
+    return fake
+
+
+@pytest.mark.parametrize(
+    "start_date, end_date, expected",
+    [
+        (None, None, lambda today: (rollups.months_ago(today, 12), today)),
+        # An end date alone always meant "everything up to then".
+        (None, "2023-02-10", lambda today: (FIRST_ROW, date(2023, 2, 10))),
+        ("2023-01-01", None, lambda today: (date(2023, 1, 1), today)),
+        ("2023-01-01", "2023-02-10", lambda today: (date(2023, 1, 1), date(2023, 2, 10))),
+    ],
+)
+def test_default_window_only_without_either_date(rollup, start_date, end_date, expected):
+    asyncio.run(rollups.load_days(None, "pending_refunds", "PMN", start_date, end_date, default_months=12))
+    assert rollup.ranges == [expected(utc_today())]
+
+
+def test_no_default_starts_at_first_row(rollup):
+    asyncio.run(rollups.load_days(None, "pending_refunds", "PMN"))
+    assert rollup.ranges == [(FIRST_ROW, utc_today())]
+
+
+class CountingSession:
+    """Answers the change poll with no rows and counts the queries."""
+
+    def __init__(self):
+        self.queries = 0
+
+    async def execute(self, statement, params):
+        self.queries += 1
+        return SimpleNamespace(scalar=lambda: None, fetchall=lambda: [])
+
+
+def test_change_poll_is_throttled(monkeypatch):
+    monkeypatch.setattr(settings, "CHANGE_POLL_SECONDS", 30)
+    clock = [1000.0]
+    monkeypatch.setattr(rollups.time, "monotonic", lambda: clock[0])
+    changes = rollups.changed_days("pending_refunds", "PMN")
+    session = CountingSession()
+
+    async def poll_at(seconds):
+        clock[0] = 1000.0 + seconds
+        return await changes.poll(session)
+
+    assert asyncio.run(poll_at(0)) == []
+    assert asyncio.run(poll_at(10)) == []
+    assert session.queries == 1
+    asyncio.run(poll_at(30))
+    asyncio.run(poll_at(45))
+    assert session.queries == 2
+
+
+class RecordingSession:
+    """Passes queries through to `session`, keeping each statement and its parameters."""
+
+    def __init__(self, session):
+        self.session = session
+        self.statements = []
+
+    async def execute(self, statement, params):
+        self.statements.append((statement, params))
+        return await self.session.execute(statement, params)
+
+
+def test_refund_change_queries_use_their_index(pg):
+    async def check(session):
+        conn = await session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+        await conn.exec_driver_sql(re.sub(r"--[^\n]*", "", MIGRATION.read_text(encoding="utf-8")))
+        await conn.exec_driver_sql("SET enable_seqscan = off")
+
+        recorder = RecordingSession(session)
+        changes = rollups.changed_days("pending_refunds", "PMN")
+        await changes.poll(recorder)
+        await changes.poll(recorder)
+        await FirstSeenIndex("PMN")._update_side(recorder, "sell")
+        await ActivityIndex("PMN")._update_side(recorder, "sell")
+        for statement, params in recorder.statements[1:]:
+            result = await session.execute(text(f"EXPLAIN {statement.text}"), params)
+            plan = "\n".join(row[0] for row in result.fetchall())
+            assert "pending_refunds_code_changed_idx" in plan, plan
+
+    pg.run(("pending_refunds",), check)
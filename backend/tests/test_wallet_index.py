@@ -0,0 +1,68 @@
+from sqlalchemy import text
+from datetime import date, datetime
+from types import SimpleNamespace
+from app.services.rollups import ChangedDays, _TABLES
+from app.services.wallet_index import ActivityIndex, FirstSeenIndex, get_activity, get_first_seen, wallets
+import asyncio
+import numpy as np
+import re
+
+
+async def _refund(session, wallet, status, created_at, updated_at=None):
+    await session.execute(
+        text("INSERT INTO pending_refunds (public, code, status, created_at, updated_at) "
+             "VALUES (:w, 'PMN', :s, :c, :u)"),
+        {"w": wallet, "s": status, "c": created_at, "u": updated_at},
+    )
+    await session.commit()
+
+
+def test_refund_with_null_updated_at_is_picked_up(pg):
+    async def check(session):
+        await _refund(session, "GNULL-A", "0", datetime(2024, 1, 5, 10), datetime(2024, 1, 6, 9))
+        first_seen, activity = FirstSeenIndex("PMN"), ActivityIndex("PMN")
+        await first_seen.refresh(session, "sell")
+        await activity.refresh(session, "sell")
+        # Written paid after the last watermark, and never updated.
+        await _refund(session, "GNULL-B", "0", datetime(2024, 2, 1, 8))
+        await first_seen.refresh(session, "sell")
+        await activity.refresh(session, "sell")
+        return first_seen, activity
+
+    first_seen, activity = pg.run(("pending_refunds",), check)
+    wallet_id = int(wallets.ids(["GNULL-B"])[0])
+    assert first_seen.first_seen("sell")[wallet_id] == np.datetime64("2024-02-01T08:00")
+    assert activity.retention("sell") == [("2024-01-01", [1, 0]), ("2024-02-01", [1])]
+
+
+def test_changed_days_sees_rows_without_updated_at(pg):
+    async def check(session):
+        changes = ChangedDays("pending_refunds", "PMN", _TABLES["pending_refunds"]["changed_column"])
+        await _refund(session, "GC-A", "1", datetime(2024, 3, 1, 10), datetime(2024, 3, 1, 11))
+        assert await changes.poll(session) == []
+
+        await _refund(session, "GC-B", "0", datetime(2024, 3, 2, 10))
+        assert await changes.poll(session) == [date(2024, 3, 2)]
+        assert await changes.poll(session) == []
+
+    pg.run(("pending_refunds",), check)
+
+
+class TableRecorder:
+    """Answers every index query with no rows, noting the table it reads."""
+
+    def __init__(self):
+        self.tables = []
+
+    async def execute(self, statement, params):
+        self.tables.append(re.search(r"FROM (\w+)", str(statement)).group(1))
+        return SimpleNamespace(fetchall=lambda: [])
+
+
+def test_only_the_requested_side_is_refreshed():
+    session = TableRecorder()
+    asyncio.run(get_first_seen(session, "SIDES", "buy"))
+    asyncio.run(get_activity(session, "SIDES", "buy"))
+    assert session.tables == ["pending_txes", "pending_txes"]
+    asyncio.run(get_activity(session, "SIDES", "sell"))
+    assert session.tables[-1] == "pending_refunds"